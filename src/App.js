@@ -4,6 +4,7 @@ import Auth from './components/AuthenticationPage/Auth';
 import Sidebar from './components/Sidebar/Sidebar';
 import PuzzlePage from './components/Sidebar/Puzzles/Puzzles';
 import ForumsPage from './components/Sidebar/Forums/Forums';
+import { authHeaders } from './auth';
 
 const App = () => {
   const [currentUser, setCurrentUser] = useState(null);
@@ -21,64 +22,52 @@ const App = () => {
     puzzlesCompleted: 0,
   });
 
-  // Load threads
+  // Load threads, puzzles and the user's completions in one request
   useEffect(() => {
-    fetch(basePage + 'threads')
-      .then(res => res.json())
-      .then(data => setThreads(data));
-  }, []);
+    if (!currentUser) return;
+
+    const loadRemainingThreads = async (cursor) => {
+      while (cursor) {
+        const res = await fetch(`${basePage}threads?limit=100&after=${encodeURIComponent(cursor)}`);
+        const page = await res.json();
+        setThreads(prev => [...prev, ...page]);
+        cursor = res.headers.get('X-Next-Cursor');
+      }
+    };
 
-  // Load puzzles with completion status when user is available
-  useEffect(() => {
-    const fetchPuzzlesWithCompletion = async () => {
+    const bootstrap = async () => {
       try {
-        // First get all puzzles
-        const puzzlesResponse = await fetch(basePage + 'puzzles');
-        const puzzlesData = await puzzlesResponse.json();
-        
-        // If user is logged in, get their completed puzzles
-        if (currentUser && currentUser.id) {
-          const completedResponse = await fetch(`${basePage}users/${currentUser.id}/completed-puzzles`);
-          if (completedResponse.ok) {
-            const completedData = await completedResponse.json();
-            const completedIds = completedData.completed_puzzle_ids || [];
-            
-            // Mark puzzles as completed based on the user's completion data
-            const updatedPuzzles = puzzlesData.map(puzzle => ({
-              ...puzzle,
-              completed: completedIds.includes(puzzle.id)
-            }));
-            
-            setPuzzles(updatedPuzzles);
-            
-            // Update user stats based on completed puzzles
-            const completedCount = updatedPuzzles.filter(p => p.completed).length;
-            const unlockedCount = threads.filter(t =>
-              t.requiredPuzzleId === null ||
-              updatedPuzzles.find(p => p.id === t.requiredPuzzleId && p.completed)
-            ).length;
-            
-            setUserStats(prev => ({
-              ...prev,
-              puzzlesCompleted: completedCount,
-              threadsUnlocked: unlockedCount,
-              totalPuzzles: puzzlesData.length
-            }));
-          } else {
-            // If API call fails, still set puzzles without completion info
-            setPuzzles(puzzlesData);
-          }
-        } else {
-          // If no user, just set puzzles without completion info
-          setPuzzles(puzzlesData);
-        }
+        const res = await fetch(`${basePage}bootstrap?username=${encodeURIComponent(currentUser.username)}`, {
+          headers: authHeaders(currentUser)
+        });
+        const data = await res.json();
+        setThreads(data.threads);
+        setPuzzles(data.puzzles);
+        // The first page is enough to render; fetch the rest behind it
+        await loadRemainingThreads(data.nextCursor);
       } catch (error) {
-        console.error('Error fetching puzzles:', error);
+        console.error('Error loading forum:', error);
       }
     };
-    
-    fetchPuzzlesWithCompletion();
-  }, [currentUser, threads]); // Re-fetch when user or threads change
+
+    bootstrap();
+  }, [currentUser]);
+
+  // Keep the stats in step with the threads and puzzles
+  useEffect(() => {
+    const completedCount = puzzles.filter(p => p.completed).length;
+    const unlockedCount = threads.filter(t =>
+      t.requiredPuzzleId === null ||
+      puzzles.find(p => p.id === t.requiredPuzzleId && p.completed)
+    ).length;
+
+    setUserStats(prev => ({
+      ...prev,
+      puzzlesCompleted: completedCount,
+      threadsUnlocked: unlockedCount,
+      totalPuzzles: puzzles.length
+    }));
+  }, [threads, puzzles]);
 
   // Load user from localStorage
   useEffect(() => {
@@ -110,9 +99,9 @@ const App = () => {
       const userAttempt = attempt.trim().toLowerCase();
       const response = await fetch(`${basePage}puzzles/${puzzle.id}/attempt`, {
           method: 'POST',
-          headers: {
+          headers: authHeaders(currentUser, {
               'Content-Type': 'application/json'
-          },
+          }),
           body: JSON.stringify({
               username: currentUser.username,
               solution: userAttempt
@@ -157,7 +146,7 @@ const App = () => {
     const timestamp = new Date().toISOString();
     const res = await fetch(basePage + 'threads', {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers: authHeaders(currentUser, { 'Content-Type': 'application/json' }),
       body: JSON.stringify({
         ...newThread,
         author: currentUser.username,
@@ -0,0 +1,5 @@
+// Headers that identify the logged-in user by the token /api/login handed out,
+// which saves the server looking them up by username on every request.
+// Users stored before tokens existed have none and are still sent by username.
+export const authHeaders = (user, headers = {}) =>
+  user?.token ? { ...headers, Authorization: `Bearer ${user.token}` } : headers;
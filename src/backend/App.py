@@ -1,15 +1,186 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, ForeignKey, Boolean, Table
-from sqlalchemy.orm import relationship, sessionmaker, declarative_base
-from datetime import datetime
-from flask import Flask, jsonify, request
+from sqlalchemy import create_engine, event, inspect, text, bindparam, case, Column, Integer, Float, String, Text, DateTime, ForeignKey, Boolean, LargeBinary, Table, Index, delete, func, insert, select, true, tuple_, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.orm import relationship, sessionmaker, declarative_base, Session as OrmSession
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta, timezone
+from functools import cache, wraps
+import atexit
+import base64
+import click
+import contextvars
+import gzip
+import hashlib
+import hmac
+import html
+import json
+import logging
+import math
+import multiprocessing
+import os
+import re
+import secrets
+import threading
+import time
+import zlib
+import jwt
+from flask import Blueprint, Flask, Response, current_app, g, has_request_context, jsonify, request
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import http_date, parse_accept_header, parse_date, parse_etags, quote_etag
 from werkzeug.security import generate_password_hash, check_password_hash
 
+# Optional speedups: orjson for encoding responses, brotli for compressing them
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 # Create the base class
 Base = declarative_base()
 
-app = Flask(__name__)
-CORS(app, origins=["http://localhost:3000"])
+# All routes live on this blueprint; create_app() registers it on an app
+api = Blueprint('api', __name__, cli_group=None)
+
+# The same logger as app.logger, usable outside a request
+logger = logging.getLogger(__name__)
+
+def default_config():
+    """The settings create_app() starts from, each overridable by a FORUM_* environment variable."""
+    return dict(
+        DATABASE_URI=os.environ.get('FORUM_DATABASE_URI', 'sqlite:///forum.db'),
+        # Serve GET endpoints from a second, read-only connection pool (SQLite files only)
+        DATABASE_READ_ONLY_POOL=os.environ.get('FORUM_DATABASE_READ_ONLY_POOL', '') == '1',
+        DB_POOL_SIZE=int(os.environ.get('FORUM_DB_POOL_SIZE', 5)),
+        DB_MAX_OVERFLOW=int(os.environ.get('FORUM_DB_MAX_OVERFLOW', 10)),
+        DB_POOL_TIMEOUT=int(os.environ.get('FORUM_DB_POOL_TIMEOUT', 30)),
+        # WAL lets readers carry on while a write is in progress
+        SQLITE_JOURNAL_MODE=os.environ.get('FORUM_SQLITE_JOURNAL_MODE', 'WAL'),
+        SQLITE_SYNCHRONOUS=os.environ.get('FORUM_SQLITE_SYNCHRONOUS', 'NORMAL'),
+        # Negative values are in KiB, positive ones in pages
+        SQLITE_CACHE_SIZE=int(os.environ.get('FORUM_SQLITE_CACHE_SIZE', -20000)),
+        SQLITE_MMAP_SIZE=int(os.environ.get('FORUM_SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+        # Milliseconds to wait for another connection's write lock before failing
+        SQLITE_BUSY_TIMEOUT=int(os.environ.get('FORUM_SQLITE_BUSY_TIMEOUT', 5000)),
+        # When set, votes are buffered in memory and written out this often (in seconds)
+        # instead of one write transaction per click
+        VOTE_FLUSH_INTERVAL=float(os.environ.get('FORUM_VOTE_FLUSH_INTERVAL', 0)),
+        # Full werkzeug method string for new password hashes. Users whose stored hash
+        # uses different parameters are rehashed the next time they log in.
+        PASSWORD_HASH_METHOD=os.environ.get('FORUM_PASSWORD_HASH_METHOD', 'scrypt:32768:8:1'),
+        # Processes that hash passwords off the request threads; 0 hashes inline
+        PASSWORD_HASH_WORKERS=int(os.environ.get('FORUM_PASSWORD_HASH_WORKERS', os.cpu_count() or 1)),
+        # Hashes allowed in flight at once before logins are turned away with a 503
+        PASSWORD_HASH_QUEUE_LIMIT=int(os.environ.get('FORUM_PASSWORD_HASH_QUEUE_LIMIT', 4 * (os.cpu_count() or 1))),
+        # Signs login tokens. Unless it's set and shared, a worker can't check tokens another
+        # worker issued, and callers sent to it are identified by their username instead.
+        SECRET_KEY=os.environ.get('FORUM_SECRET_KEY') or secrets.token_hex(32),
+        AUTH_TOKEN_TTL=int(os.environ.get('FORUM_AUTH_TOKEN_TTL', 7 * 24 * 3600)),
+        # Reject requests that identify the user only by a username in the request
+        AUTH_REQUIRE_TOKEN=os.environ.get('FORUM_AUTH_REQUIRE_TOKEN', '') == '1',
+        # Log requests slower than this many milliseconds, with the SQL they ran; 0 logs none
+        SLOW_REQUEST_MS=float(os.environ.get('FORUM_SLOW_REQUEST_MS', 0)),
+        # Compress responses of at least this many bytes for clients that accept gzip or brotli
+        COMPRESS_MIN_SIZE=int(os.environ.get('FORUM_COMPRESS_MIN_SIZE', 1024)),
+        COMPRESS_GZIP_LEVEL=int(os.environ.get('FORUM_COMPRESS_GZIP_LEVEL', 6)),
+        COMPRESS_BROTLI_QUALITY=int(os.environ.get('FORUM_COMPRESS_BROTLI_QUALITY', 5)),
+        # Seconds between checks for changes committed by other processes sharing the
+        # database, which are then evicted from this one's caches; 0 disables
+        CHANGE_POLL_INTERVAL=float(os.environ.get('FORUM_CHANGE_POLL_INTERVAL', 0.5)),
+        # Seconds change_log entries are kept for slow processes to catch up
+        CHANGE_LOG_RETENTION=int(os.environ.get('FORUM_CHANGE_LOG_RETENTION', 600)),
+        # Puzzle attempts allowed per user and per client address: a burst of this many,
+        # then ATTEMPT_RATE per second. A rate of 0 disables the limit.
+        ATTEMPT_BURST=int(os.environ.get('FORUM_ATTEMPT_BURST', 10)),
+        ATTEMPT_RATE=float(os.environ.get('FORUM_ATTEMPT_RATE', 0.2)),
+        # Deleted threads are hidden at once and their posts purged in the background, this
+        # many per transaction with a pause of THREAD_PURGE_PAUSE seconds between batches
+        THREAD_PURGE_BATCH_SIZE=int(os.environ.get('FORUM_THREAD_PURGE_BATCH_SIZE', 500)),
+        THREAD_PURGE_PAUSE=float(os.environ.get('FORUM_THREAD_PURGE_PAUSE', 0.01)),
+        # `flask archive-posts` archives threads without a new post for this many days
+        ARCHIVE_AFTER_DAYS=int(os.environ.get('FORUM_ARCHIVE_AFTER_DAYS', 180)),
+        # Store posts in this many SQLite files beside the main database, partitioned by
+        # thread, so posts to different threads don't wait on one write lock. 0 keeps them
+        # in the main database. Changing it takes an export-data/import-data round trip,
+        # and archive-posts is refused while it's set.
+        POST_SHARDS=int(os.environ.get('FORUM_POST_SHARDS', 0)),
+        # With POST_SHARDS, seconds between writes of the thread statistics and change_log
+        # entries of new posts, which would otherwise take the main database's lock each
+        THREAD_STATS_FLUSH_INTERVAL=float(os.environ.get('FORUM_THREAD_STATS_FLUSH_INTERVAL', 0.1)),
+    )
+
+# Listing endpoints return everything unless a limit is given, and never more than this per page
+MAX_PAGE_SIZE = 100
+SNIPPET_LENGTH = 120
+# Rows fetched from the cursor at a time when streaming a response
+STREAM_BATCH_SIZE = 500
+# Number of users whose identity and completed puzzles are kept in memory, and for
+# how many seconds before they're reloaded
+COMPLETION_CACHE_SIZE = 1024
+PRINCIPAL_CACHE_TTL = 300
+# Results per search page when no limit is given
+SEARCH_PAGE_SIZE = 20
+# Operations accepted in one /api/batch request
+MAX_BATCH_SIZE = 500
+# Recent change events kept for clients resuming an event stream
+CHANGE_FEED_SIZE = 1000
+# Seconds between keep-alive comments on an idle event stream
+EVENT_STREAM_HEARTBEAT = 15
+# Histogram buckets for /api/metrics
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (100, 1000, 10_000, 100_000, 1_000_000, 10_000_000)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+# Hot ranking: every tenfold increase in votes and posts is worth as much as a
+# thread being this many seconds newer
+HOT_SCORE_DECAY = 45000
+HOT_SCORE_EPOCH = datetime(2024, 1, 1)
+# Users per leaderboard page when no limit is given
+LEADERBOARD_PAGE_SIZE = 20
+# Callers whose puzzle attempt budgets are tracked at once; the longest idle are forgotten first
+ATTEMPT_LIMITER_SIZE = 100_000
+# Threads with more posts than this are never archived, so one block stays cheap to
+# write and decode; and the number of threads whose decoded archive is kept in memory
+ARCHIVE_MAX_POSTS = 5000
+ARCHIVE_CACHE_SIZE = 256
+# Buffered votes on an object that fail to apply this many flushes in a row are dropped
+VOTE_FLUSH_MAX_ATTEMPTS = 3
+# The schema Post is declared in, which every statement on it translates to the database
+# holding the posts (see PostShards). At most SQLite's default limit on attached databases
+# can be shards, and the ids of shard k's posts start above (k + 1) << POST_ID_SHARD_BITS.
+POST_SHARD_SCHEMA = 'post_shard'
+MAX_POST_SHARDS = 10
+POST_ID_SHARD_BITS = 40
+
+def hot_score(upvotes, downvotes, post_count, created_at):
+    """A thread's position in the ?sort=hot listing, higher first.
+
+    Newer threads outrank older ones through the time term rather than by old
+    scores decaying, so the score only changes with the thread's own counters
+    and can be stored and indexed. Also available to SQL as hot_score().
+    """
+    engagement = (upvotes or 0) - (downvotes or 0) + (post_count or 0)
+    if isinstance(created_at, str):
+        created_at = datetime.fromisoformat(created_at)
+    age = ((created_at or datetime.utcnow()) - HOT_SCORE_EPOCH).total_seconds()
+    order = math.copysign(math.log10(max(abs(engagement), 1)), engagement)
+    return round(order + age / HOT_SCORE_DECAY, 7)
+
+def default_hot_score(context):
+    row = context.get_current_parameters()
+    return hot_score(row.get('upvotes'), row.get('downvotes'), row.get('post_count'), row.get('created_at'))
+
+def default_net_votes(context):
+    row = context.get_current_parameters()
+    return (row.get('upvotes') or 0) - (row.get('downvotes') or 0)
 
 # User model
 class User(Base):
@@ -21,12 +192,19 @@ class User(Base):
     password_hash = Column(String(128), nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
     is_admin = Column(Boolean, default=False)
+    # Leaderboard standing, maintained by try_solution: puzzles solved and the sum of their difficulties
+    solved_count = Column(Integer, default=0, server_default='0', nullable=False)
+    score = Column(Integer, default=0, server_default='0', nullable=False)
 
     # Relationships
     threads = relationship("Thread", back_populates="creator")
     posts = relationship("Post", back_populates="author")
     completed_puzzles = relationship("CompletedPuzzle", back_populates="user")
 
+    __table_args__ = (
+        Index('ix_users_score_solved_count_id', 'score', 'solved_count', 'id'),
+    )
+
     def __repr__(self):
         return f"<User(username='{self.username}', email='{self.email}')>"
 
@@ -44,11 +222,33 @@ class Thread(Base):
     upvotes = Column(Integer, default=0)
     downvotes = Column(Integer, default=0)
 
+    # Post statistics, maintained by create_post/delete_post so the thread listing
+    # never has to read posts. A thread without posts counts as active when created.
+    post_count = Column(Integer, default=0, server_default='0', nullable=False)
+    last_post_at = Column(DateTime, default=datetime.utcnow)
+    last_post_author = Column(String(50))
+    snippet = Column(Text)  # First post, truncated to SNIPPET_LENGTH
+    # hot_score() of the counters above, kept up to date by the same writers
+    hot_score = Column(Float, default=default_hot_score, server_default='0', nullable=False)
+    # upvotes - downvotes, kept up to date by apply_votes so ?sort=votes can use an index
+    net_votes = Column(Integer, default=default_net_votes, server_default='0', nullable=False)
+    # Set by delete_thread; the thread is hidden from then on and purged by ThreadPurger
+    deleted_at = Column(DateTime, nullable=True)
+
     # Relationships
     creator = relationship("User", back_populates="threads")
     posts = relationship("Post", back_populates="thread", cascade="all, delete-orphan")
     puzzle = relationship("Puzzle", back_populates="threads")
 
+    __table_args__ = (
+        Index('ix_threads_created_at_id', 'created_at', 'id'),
+        Index('ix_threads_last_post_at_id', 'last_post_at', 'id'),
+        Index('ix_threads_net_votes_id', 'net_votes', 'id'),
+        Index('ix_threads_hot_score_id', 'hot_score', 'id'),
+        # Only threads waiting to be purged are indexed
+        Index('ix_threads_deleted_at', 'deleted_at', sqlite_where=text('deleted_at IS NOT NULL')),
+    )
+
     def __repr__(self):
         return f"<Thread(name='{self.name}', puzzle_id='{self.puzzle_id}')>"
 
@@ -68,9 +268,40 @@ class Post(Base):
     author = relationship("User", back_populates="posts")
     thread = relationship("Thread", back_populates="posts")
 
+    __table_args__ = (
+        # Serves the per-thread post count and first-post lookups of the thread listing
+        Index('ix_posts_thread_id_id', 'thread_id', 'id'),
+        # Keyset pagination of a thread's posts in display order
+        Index('ix_posts_thread_id_timestamp_id', 'thread_id', 'timestamp', 'id'),
+        # Ids are never reused, and each shard hands out its own range of them
+        {'schema': POST_SHARD_SCHEMA, 'sqlite_autoincrement': True},
+    )
+
     def __repr__(self):
         return f"<Post(author_id='{self.user_id}', thread_id='{self.thread_id}', timestamp='{self.timestamp}')>"
 
+# The posts of a thread that has gone quiet, moved out of posts by archive_threads
+class PostArchive(Base):
+    __tablename__ = 'post_archive'
+
+    thread_id = Column(Integer, ForeignKey('threads.id'), primary_key=True)
+    post_count = Column(Integer, nullable=False)
+    block = Column(LargeBinary, nullable=False)  # See encode_archive()
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<PostArchive(thread_id={self.thread_id}, post_count={self.post_count})>"
+
+# Which archived thread each post in post_archive belongs to, for finding one by id
+class ArchivedPostThread(Base):
+    __tablename__ = 'archived_post_threads'
+
+    post_id = Column(Integer, primary_key=True)
+    thread_id = Column(Integer, ForeignKey('threads.id'), nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<ArchivedPostThread(post_id={self.post_id}, thread_id={self.thread_id})>"
+
 class Puzzle(Base):
     __tablename__ = 'puzzles'
 
@@ -100,13 +331,442 @@ class CompletedPuzzle(Base):
     user = relationship("User", back_populates="completed_puzzles")
     puzzle = relationship("Puzzle", back_populates="completed_by")
 
+    __table_args__ = (
+        # One completion per user and puzzle, however many correct attempts race to add it
+        Index('ix_completed_puzzles_user_id_puzzle_id', 'user_id', 'puzzle_id', unique=True),
+    )
+
     def __repr__(self):
         return f"<CompletedPuzzle(user_id={self.user_id}, puzzle_id={self.puzzle_id}>"
 
+# Cache invalidations, written in the same transaction as the change behind them so
+# every process sharing the database can apply them too (see ChangeListener)
+class ChangeLog(Base):
+    __tablename__ = 'change_log'
+
+    id = Column(Integer, primary_key=True)
+    origin = Column(Integer, nullable=False)  # pid of the writing process
+    name = Column(String(50), nullable=False)  # A function registered with @broadcast
+    args = Column(Text, nullable=False)  # Its arguments, as a JSON array
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+    # Ids must never be reused once old entries are purged
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    def __repr__(self):
+        return f"<ChangeLog(id={self.id}, name='{self.name}')>"
+
+def is_memory_db(db_uri):
+    url = make_url(db_uri)
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+class PostShards:
+    """Where posts are stored: the main database, or POST_SHARDS files partitioned by thread.
+
+    Shard k is the file <database>-posts-<k>.db, attached to every connection as
+    posts_<k> and holding the posts of the threads whose id is k modulo the
+    number of shards. Statements on Post are pointed at a shard by the execution
+    options from for_thread() or for_post(), so posts still join users and
+    threads like any other table, while a transaction that only writes posts
+    takes the write lock of its own shard rather than the main database's.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def init_app(self, app):
+        count = app.config['POST_SHARDS']
+        if count > MAX_POST_SHARDS:
+            raise ValueError(f"POST_SHARDS is {count}, at most {MAX_POST_SHARDS} are supported")
+        # A database in memory has no files to put beside it
+        self.count = 0 if is_memory_db(app.config['DATABASE_URI']) else count
+
+    @property
+    def enabled(self):
+        return self.count > 0
+
+    def schemas(self):
+        """The schema of each shard."""
+        return [f"posts_{shard}" for shard in range(self.count)]
+
+    def files(self, database):
+        """(schema, path) of each shard of the SQLite file database."""
+        root, ext = os.path.splitext(database)
+        return [(schema, f"{root}-posts-{shard}{ext}") for shard, schema in enumerate(self.schemas())]
+
+    def options(self, shard):
+        return {'schema_translate_map': {POST_SHARD_SCHEMA: f"posts_{shard}"}}
+
+    def every(self):
+        """Execution options for each place posts are stored in turn."""
+        return [self.options(shard) for shard in range(self.count)] if self.enabled else [{}]
+
+    def partitions(self):
+        """(execution options, criterion on Thread.id) for each shard and the threads it holds."""
+        if not self.enabled:
+            return [({}, true())]
+        return [(self.options(shard), Thread.id % self.count == shard) for shard in range(self.count)]
+
+    def for_thread(self, thread_id):
+        """Execution options that route a statement on Post to the posts of thread_id."""
+        if not self.enabled:
+            return {}
+        return self.options((thread_id or 0) % self.count)
+
+    def for_post(self, post_id):
+        """Execution options that route a statement on Post to post_id, or None if no shard has it."""
+        if not self.enabled:
+            return {}
+        shard = self.shard_of_post(post_id)
+        return self.options(shard) if shard is not None else None
+
+    def shard_of_post(self, post_id):
+        shard = (post_id >> POST_ID_SHARD_BITS) - 1
+        return shard if 0 <= shard < self.count else None
+
+    def split(self, rows):
+        """Group post rows by the shard of their thread_id, as (execution options, rows) pairs."""
+        if not self.enabled:
+            return [({}, rows)]
+        shards = {}
+        for row in rows:
+            shards.setdefault(row['thread_id'] % self.count, []).append(row)
+        return [(self.options(shard), shards[shard]) for shard in sorted(shards)]
+
+    def split_ids(self, post_ids):
+        """Group post ids by shard, as (execution options, ids) pairs. Ids no shard has are left out."""
+        if not self.enabled:
+            return [({}, list(post_ids))]
+        shards = {}
+        for post_id in post_ids:
+            shard = self.shard_of_post(post_id)
+            if shard is not None:
+                shards.setdefault(shard, []).append(post_id)
+        return [(self.options(shard), shards[shard]) for shard in sorted(shards)]
+
+    def reserve_ids(self, engine):
+        """Start each shard's ids at the bottom of its range, unless it has handed some out already."""
+        with engine.begin() as conn:
+            for shard, schema in enumerate(self.schemas()):
+                conn.execute(text(
+                    f"INSERT INTO {schema}.sqlite_sequence (name, seq) SELECT 'posts', :seq "
+                    f"WHERE NOT EXISTS (SELECT 1 FROM {schema}.sqlite_sequence WHERE name = 'posts')"
+                ), {"seq": (shard + 1) << POST_ID_SHARD_BITS})
+
+# Configured from POST_SHARDS by create_app()
+post_shards = PostShards()
+
+def configure_sqlite(engine, config, read_only=False):
+    """Apply the SQLITE_* settings from config to every new connection of engine.
+
+    Post shards are attached to each connection too, with the same settings.
+    """
+    shards = []
+    if post_shards.enabled:
+        shards = post_shards.files(os.path.abspath(engine.url.database.removeprefix('file:')))
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA busy_timeout = {int(config['SQLITE_BUSY_TIMEOUT'])}")
+        for schema, path in shards:
+            cursor.execute(f"ATTACH DATABASE ? AS {schema}", (f"file:{path}?mode=ro" if read_only else path,))
+        for schema in ['main'] + [schema for schema, _ in shards]:
+            # The journal mode is stored in the database file, so only the writer sets it
+            if not read_only:
+                cursor.execute(f"PRAGMA {schema}.journal_mode = {config['SQLITE_JOURNAL_MODE']}")
+            cursor.execute(f"PRAGMA {schema}.synchronous = {config['SQLITE_SYNCHRONOUS']}")
+            cursor.execute(f"PRAGMA {schema}.cache_size = {int(config['SQLITE_CACHE_SIZE'])}")
+            cursor.execute(f"PRAGMA {schema}.mmap_size = {int(config['SQLITE_MMAP_SIZE'])}")
+        cursor.close()
+        dbapi_connection.create_function('hot_score', 4, hot_score, deterministic=True)
+
+# Full-text search indexes. Both are external-content FTS5 tables that read the
+# text from threads/posts themselves, kept in sync by triggers so every write path
+# (routes, seeding, cascades) updates them in the same transaction. Each post shard
+# has a post_search of its own, so {schema} is the schema prefix of the posts.
+THREAD_SEARCH_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS thread_search USING fts5(
+        name, description, content='threads', content_rowid='id', tokenize='porter unicode61'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS threads_search_insert AFTER INSERT ON threads BEGIN
+        INSERT INTO thread_search (rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS threads_search_delete AFTER DELETE ON threads BEGIN
+        INSERT INTO thread_search (thread_search, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS threads_search_update AFTER UPDATE OF name, description ON threads BEGIN
+        INSERT INTO thread_search (thread_search, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO thread_search (rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+]
+POST_SEARCH_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS {schema}post_search USING fts5(
+        text, content='posts', content_rowid='id', tokenize='porter unicode61'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS {schema}posts_search_insert AFTER INSERT ON posts BEGIN
+        INSERT INTO post_search (rowid, text) VALUES (new.id, new.text);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS {schema}posts_search_delete AFTER DELETE ON posts BEGIN
+        INSERT INTO post_search (post_search, rowid, text) VALUES ('delete', old.id, old.text);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS {schema}posts_search_update AFTER UPDATE OF text ON posts BEGIN
+        INSERT INTO post_search (post_search, rowid, text) VALUES ('delete', old.id, old.text);
+        INSERT INTO post_search (rowid, text) VALUES (new.id, new.text);
+    END""",
+]
+
+# Archived posts are only kept compressed in post_archive, so their index is contentless
+# and archived_post_threads says which thread each indexed post belongs to. Nothing
+# writes it but archive_threads and what takes posts back out of post_archive.
+ARCHIVED_POST_SEARCH_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS archived_post_search USING fts5(
+        text, content='', tokenize='porter unicode61'
+    )""",
+]
+
+def ensure_search_index(engine):
+    """Create the FTS5 search tables and triggers if missing. Returns False if unavailable."""
+    if engine.dialect.name != 'sqlite':
+        return False
+    indexes = [('', 'thread_search', THREAD_SEARCH_DDL)]
+    indexes += [(schema, 'post_search', POST_SEARCH_DDL) for schema in post_search_schemas()]
+    with engine.begin() as conn:
+        for schema, name, ddl in indexes:
+            existing = conn.scalar(text(
+                f"SELECT count(*) FROM {schema}sqlite_master WHERE type = 'table' AND name = :name"
+            ), {"name": name})
+            try:
+                for statement in ddl:
+                    conn.execute(text(statement.format(schema=schema)))
+            except OperationalError:
+                logger.warning("SQLite was built without FTS5, search is disabled")
+                return False
+            # Index whatever was written before the search table existed
+            if not existing:
+                conn.execute(text(f"INSERT INTO {schema}{name} ({name}) VALUES ('rebuild')"))
+
+        existing = has_archived_post_search(conn)
+        for statement in ARCHIVED_POST_SEARCH_DDL:
+            conn.execute(text(statement))
+        # A contentless index can't rebuild itself, so threads archived before it existed are read
+        if not existing:
+            for (block,) in conn.execute(select(PostArchive.block)):
+                index_archived_posts(conn, decode_archive(block))
+    return True
+
+def has_archived_post_search(conn):
+    return conn.scalar(text("SELECT count(*) FROM sqlite_master WHERE name = 'archived_post_search'")) > 0
+
+def post_search_schemas():
+    """The schema prefix of each post_search table: '' for posts in the main database."""
+    return [f"{schema}." for schema in post_shards.schemas()] if post_shards.enabled else ['']
+
+def thread_stats_values():
+    """Correlated subqueries that recompute a thread's post statistics in UPDATE threads."""
+    first_text = (
+        select(Post.text).where(Post.thread_id == Thread.id)
+        .order_by(Post.id).limit(1).scalar_subquery()
+    )
+    return {
+        "snippet": case(
+            (func.length(first_text) > SNIPPET_LENGTH, func.substr(first_text, 1, SNIPPET_LENGTH, type_=Text) + '...'),
+            else_=first_text
+        ),
+        "last_post_at": func.coalesce(
+            select(func.max(Post.timestamp)).where(Post.thread_id == Thread.id).scalar_subquery(),
+            Thread.created_at
+        ),
+        "last_post_author": (
+            select(User.username).join(Post, Post.user_id == User.id)
+            .where(Post.thread_id == Thread.id)
+            .order_by(Post.timestamp.desc(), Post.id.desc()).limit(1).scalar_subquery()
+        ),
+    }
+
+def refresh_thread_stats(*criteria):
+    """UPDATEs that recompute the statistics of the threads matching criteria from their posts.
+
+    There's one per shard, each for the threads whose posts it holds. Archived
+    threads are skipped.
+    """
+    post_count = select(func.count(Post.id)).where(Post.thread_id == Thread.id).scalar_subquery()
+    # An archived thread's posts aren't in posts, so its statistics are left as they were
+    archived = select(PostArchive.thread_id).where(PostArchive.thread_id == Thread.id).exists()
+    values = dict(
+        thread_stats_values(),
+        post_count=post_count,
+        hot_score=func.hot_score(Thread.upvotes, Thread.downvotes, post_count, Thread.created_at)
+    )
+    return [
+        update(Thread)
+        .where(*criteria, in_shard, ~archived)
+        .values(**values)
+        .execution_options(synchronize_session=False, **options)
+        for options, in_shard in post_shards.partitions()
+    ]
+
+def reconcile_thread_stats(engine, batch_size=500):
+    """Recompute every thread's statistics from its posts, one batch of threads per transaction.
+
+    Archived threads are skipped.
+    """
+    with engine.connect() as conn:
+        max_id = conn.scalar(select(func.max(Thread.id))) or 0
+    for start in range(0, max_id, batch_size):
+        with engine.begin() as conn:
+            for statement in refresh_thread_stats(Thread.id > start, Thread.id <= start + batch_size):
+                conn.execute(statement)
+
+def reconcile_user_scores(engine):
+    """Recompute every user's solved puzzle count and score from their completions."""
+    solved = select(CompletedPuzzle.puzzle_id).where(CompletedPuzzle.user_id == User.id).correlate(User)
+    with engine.begin() as conn:
+        conn.execute(
+            update(User).values(
+                solved_count=select(func.count()).where(Puzzle.id.in_(solved)).scalar_subquery(),
+                score=select(func.coalesce(func.sum(Puzzle.difficulty), 0)).where(Puzzle.id.in_(solved)).scalar_subquery()
+            )
+        )
+
+def remove_duplicate_completions(engine):
+    """Delete all but the first completion of each user and puzzle, and return how many went.
+
+    Databases from before ix_completed_puzzles_user_id_puzzle_id may have
+    several, which would stop that index from being created.
+    """
+    first = select(func.min(CompletedPuzzle.id)).group_by(CompletedPuzzle.user_id, CompletedPuzzle.puzzle_id)
+    with engine.begin() as conn:
+        return conn.execute(delete(CompletedPuzzle).where(CompletedPuzzle.id.not_in(first))).rowcount
+
+def add_missing_columns(engine):
+    """Add columns the models have gained since their tables were created.
+
+    create_all never alters existing tables. Returns the added columns as
+    'table.column' names.
+    """
+    inspector = inspect(engine)
+    added = []
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}"
+                if column.server_default is not None:
+                    ddl += f" NOT NULL DEFAULT {column.server_default.arg}" if not column.nullable else f" DEFAULT {column.server_default.arg}"
+                conn.execute(text(ddl))
+                added.append(f"{table.name}.{column.name}")
+    return added
+
+def add_post_id_autoincrement(engine):
+    """Rebuild a posts table created before post ids were AUTOINCREMENT.
+
+    Without it SQLite hands the id of the newest post out again once that post
+    is deleted, while shard routing and restoring archived posts rely on ids
+    never being reused. The rows keep their ids. Returns the rebuilt tables as
+    'schema.posts' names.
+    """
+    if engine.dialect.name != 'sqlite':
+        return []
+    columns = ', '.join(column.name for column in Post.__table__.columns)
+    rebuilt = []
+    with engine.begin() as conn:
+        for schema in post_shards.schemas() or ['main']:
+            ddl = conn.scalar(text(f"SELECT sql FROM {schema}.sqlite_master WHERE type = 'table' AND name = 'posts'"))
+            if ddl is None or 'AUTOINCREMENT' in ddl.upper():
+                continue
+            # The old table's triggers follow it through the rename and are dropped with it,
+            # so copying the rows doesn't touch the search index
+            conn.execute(text(f"ALTER TABLE {schema}.posts RENAME TO posts_before_autoincrement"))
+            indexes = conn.scalars(text(
+                f"SELECT name FROM {schema}.sqlite_master "
+                "WHERE type = 'index' AND tbl_name = 'posts_before_autoincrement' AND sql IS NOT NULL"
+            )).all()
+            for index in indexes:
+                conn.execute(text(f"DROP INDEX {schema}.{index}"))
+            Post.__table__.create(conn.execution_options(schema_translate_map={POST_SHARD_SCHEMA: schema}))
+            conn.execute(text(
+                f"INSERT INTO {schema}.posts ({columns}) SELECT {columns} FROM {schema}.posts_before_autoincrement"
+            ))
+            conn.execute(text(f"DROP TABLE {schema}.posts_before_autoincrement"))
+            rebuilt.append(f"{schema}.posts")
+    return rebuilt
+
 # Create database engine and tables
-def init_db(db_uri='sqlite:///forum.db'):
-    engine = create_engine(db_uri)
-    Base.metadata.create_all(engine)
+def engine_args(db_uri, config, read_only=False):
+    """Return the URL and create_engine() options for db_uri under config."""
+    options = {}
+    url = make_url(db_uri)
+    # Unless posts are partitioned, statements that aren't routed to a shard find them in main
+    if not post_shards.enabled:
+        options['execution_options'] = {'schema_translate_map': {POST_SHARD_SCHEMA: None}}
+    if not is_memory_db(db_uri):
+        options.update(
+            pool_size=config['DB_POOL_SIZE'],
+            max_overflow=config['DB_MAX_OVERFLOW'],
+            pool_timeout=config['DB_POOL_TIMEOUT']
+        )
+    if read_only:
+        path = os.path.abspath(url.database)
+        url = url.set(database=f"file:{path}", query={"mode": "ro", "uri": "true"})
+    return url, options
+
+def init_db(db_uri='sqlite:///forum.db', config=None, read_only=False):
+    """Create an engine for db_uri tuned by config (the current app's by default).
+
+    The writable engine also creates any missing tables and indexes. A read-only
+    engine opens the same SQLite file with mode=ro, so its connections can never
+    take the write lock.
+    """
+    config = config if config is not None else current_app.config
+    url, options = engine_args(db_uri, config, read_only)
+    engine = create_engine(url, **options)
+    if url.get_backend_name() == 'sqlite':
+        configure_sqlite(engine, config, read_only)
+    if read_only:
+        return engine
+
+    # Before the search index had its own, archived_post_threads was only kept beside it
+    had_archived_post_threads = inspect(engine).has_table(ArchivedPostThread.__tablename__)
+    # Posts are created in every shard, and everything else once in the main database
+    shard_engines = [engine.execution_options(**options) for options in post_shards.every()]
+    for shard_engine in shard_engines:
+        Base.metadata.create_all(shard_engine)
+    if post_shards.enabled:
+        post_shards.reserve_ids(engine)
+    # create_all skips tables that already exist, so add any newer columns and indexes separately
+    added = add_missing_columns(engine)
+    add_post_id_autoincrement(engine)
+    completion_indexes = {index['name'] for index in inspect(engine).get_indexes(CompletedPuzzle.__tablename__)}
+    duplicates = 0
+    if 'ix_completed_puzzles_user_id_puzzle_id' not in completion_indexes:
+        duplicates = remove_duplicate_completions(engine)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            for bind in shard_engines if table is Post.__table__ else [engine]:
+                index.create(bind, checkfirst=True)
+    if 'threads.post_count' in added or 'threads.hot_score' in added:
+        reconcile_thread_stats(engine)
+    # Each duplicate completion was counted towards its user's score too
+    if 'users.score' in added or duplicates:
+        reconcile_user_scores(engine)
+    if 'threads.net_votes' in added:
+        with engine.begin() as conn:
+            conn.execute(update(Thread).values(
+                net_votes=func.coalesce(Thread.upvotes, 0) - func.coalesce(Thread.downvotes, 0)
+            ))
+    if not had_archived_post_threads:
+        with engine.begin() as conn:
+            for thread_id, block in conn.execute(select(PostArchive.thread_id, PostArchive.block)).all():
+                conn.execute(insert(ArchivedPostThread), [
+                    {"post_id": post.id, "thread_id": thread_id} for post in decode_archive(block)
+                ])
     return engine
 
 # Create session factory
@@ -120,143 +780,1555 @@ def setup_database(db_uri='sqlite:///forum.db'):
     Session = get_session_factory(engine)
     return Session()
 
-engine = init_db()
-Session = get_session_factory(engine)
+class Database:
+    """The engines and session factories for an app's DATABASE_URI, created on first use.
+
+    Creating the app doesn't touch the database, so a worker starts serving at
+    once; the first request or command to need a session creates the engine and
+    checks tables, indexes and the search index, once per process. Binding it to
+    another app closes what it opened for the previous one.
+    """
+
+    def __init__(self):
+        self.config = None
+        self._engine = None
+        self._session_factory = None
+        # Optional second pool for read-only endpoints
+        self._read_session_factory = None
+        self._search_enabled = False
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.close()
+        self.config = app.config
+        app.extensions['forum_db'] = self
+
+    def close(self):
+        """Stop the background workers and dispose of the engines, until the next use."""
+        with self._lock:
+            change_listener.stop()
+            thread_purger.stop()
+            for factory in (self._session_factory, self._read_session_factory):
+                if factory is not None:
+                    factory.kw['bind'].dispose()
+            self._engine = None
+            self._session_factory = None
+            self._read_session_factory = None
+            self._search_enabled = False
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            with self._lock:
+                if self._engine is None:
+                    self._connect()
+        return self._engine
+
+    def _connect(self):
+        config = self.config
+        engine = init_db(config['DATABASE_URI'], config)
+        self._search_enabled = ensure_search_index(engine)
+        self._session_factory = get_session_factory(engine)
+        if config['DATABASE_READ_ONLY_POOL'] and not is_memory_db(config['DATABASE_URI']):
+            self._read_session_factory = get_session_factory(
+                init_db(config['DATABASE_URI'], config, read_only=True)
+            )
+        if config['CHANGE_POLL_INTERVAL'] > 0 and not is_memory_db(config['DATABASE_URI']):
+            change_listener.start(engine, init_db(config['DATABASE_URI'], config, read_only=True), config)
+        thread_purger.start(engine, config)
+        self._engine = engine
+
+    @property
+    def search_enabled(self):
+        return self.engine is not None and self._search_enabled
+
+    @property
+    def has_read_pool(self):
+        return self.engine is not None and self._read_session_factory is not None
+
+    def session(self, read_only=False):
+        """Open a new session, on the read-only pool if asked for and enabled."""
+        if read_only and self.has_read_pool:
+            return self._read_session_factory()
+        self.engine
+        return self._session_factory()
+
+# One per process, bound to its config by create_app()
+db = Database()
+
+def get_db(read_only=False):
+    """Return the session for the current request, opening it on first use.
+
+    Sessions are closed, and rolled back if the request failed, when the app
+    context ends. Pass read_only=True from endpoints that never write to use the
+    read-only pool when it's enabled. A session only connects when it first runs
+    a query, so views that may answer from a cache can call this up front for free.
+    """
+    name = 'db_read_session' if read_only and db.has_read_pool else 'db_session'
+    session = g.get(name)
+    if session is None:
+        session = db.session(read_only=name == 'db_read_session')
+        setattr(g, name, session)
+    return session
+
+def close_db(exc):
+    for name in ('db_session', 'db_read_session'):
+        session = g.pop(name, None)
+        if session is not None:
+            if exc is not None:
+                session.rollback()
+            session.close()
+
+class Metrics:
+    """Counters and histograms keyed by label values, rendered in Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = {}  # name -> (type, help, label names, buckets, {label values: value})
+        self._lock = threading.Lock()
+
+    def counter(self, name, help, labels=()):
+        self._metrics[name] = ('counter', help, labels, None, {})
+
+    def histogram(self, name, help, buckets, labels=()):
+        self._metrics[name] = ('histogram', help, labels, buckets, {})
+
+    def inc(self, name, labels=(), amount=1):
+        with self._lock:
+            values = self._metrics[name][4]
+            values[labels] = values.get(labels, 0) + amount
+
+    def observe(self, name, value, labels=()):
+        _, _, _, buckets, values = self._metrics[name]
+        with self._lock:
+            # Per-bucket (not cumulative) counts including +Inf, then the sum and count
+            state = values.get(labels)
+            if state is None:
+                state = values[labels] = [0] * (len(buckets) + 3)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            else:
+                state[len(buckets)] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, (kind, help, label_names, buckets, values) in self._metrics.items():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for label_values, value in sorted(values.items()):
+                    labels = [f'{k}="{prometheus_escape(v)}"' for k, v in zip(label_names, label_values)]
+                    if kind == 'counter':
+                        lines.append(f"{name}{format_labels(labels)} {value}")
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(buckets + ('+Inf',), value):
+                        cumulative += count
+                        bucket_labels = format_labels(labels + ['le="%s"' % bound])
+                        lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+                    lines.append(f"{name}_sum{format_labels(labels)} {value[-2]}")
+                    lines.append(f"{name}_count{format_labels(labels)} {value[-1]}")
+        return '\n'.join(lines) + '\n'
+
+def prometheus_escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labels):
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+metrics = Metrics()
+metrics.counter('forum_http_requests_total', 'Requests handled.', ('method', 'route', 'status'))
+metrics.histogram('forum_http_request_duration_seconds', 'Time to produce a response.', LATENCY_BUCKETS, ('method', 'route'))
+metrics.histogram('forum_http_request_size_bytes', 'Request body sizes.', SIZE_BUCKETS, ('method', 'route'))
+metrics.histogram('forum_http_response_size_bytes', 'Response body sizes, where known up front.', SIZE_BUCKETS, ('method', 'route'))
+metrics.histogram('forum_db_queries_per_request', 'SQL statements run by one request.', QUERY_COUNT_BUCKETS, ('method', 'route'))
+metrics.counter('forum_db_queries_total', 'SQL statements run, by the route that ran them.', ('route',))
+metrics.counter('forum_db_query_seconds_total', 'Time spent in SQL statements, by the route that ran them.', ('route',))
+metrics.counter('forum_orm_lazy_loads_total', 'Relationships lazy-loaded by the ORM, a sign of N+1 queries.', ('route',))
+metrics.counter('forum_slow_requests_total', 'Requests slower than SLOW_REQUEST_MS.', ('method', 'route'))
+
+class RequestStats:
+    """What's measured of one request while it's served: its start and the SQL it runs."""
+
+    def __init__(self, method, route):
+        self.method = method
+        self.route = route
+        self.started = time.perf_counter()
+        self.query_count = 0
+        self.queries = []  # (seconds, statement), kept when SLOW_REQUEST_MS is set
+
+    def record(self, status, request_size, response_size, path, slow_ms):
+        """Add the finished request to metrics, and log it if it took slow_ms or more.
+
+        response_size is None when the body's size isn't known up front.
+        """
+        elapsed = time.perf_counter() - self.started
+        method, route = self.method, self.route
+        metrics.inc('forum_http_requests_total', (method, route, str(status)))
+        metrics.observe('forum_http_request_duration_seconds', elapsed, (method, route))
+        metrics.observe('forum_http_request_size_bytes', request_size, (method, route))
+        if response_size is not None:
+            metrics.observe('forum_http_response_size_bytes', response_size, (method, route))
+        metrics.observe('forum_db_queries_per_request', self.query_count, (method, route))
+
+        if slow_ms and elapsed * 1000 >= slow_ms:
+            metrics.inc('forum_slow_requests_total', (method, route))
+            logger.warning(
+                "Slow request: %s %s took %.1fms, %d queries\n%s", method, path, elapsed * 1000,
+                self.query_count, '\n'.join(f"  {seconds * 1000:.1f}ms {statement}" for seconds, statement in self.queries)
+            )
+
+# The RequestStats of the request asgi.py is serving, which has no Flask request context
+serving_request = contextvars.ContextVar('serving_request', default=None)
+
+def current_request_stats():
+    if has_request_context():
+        return g.get('request_stats')
+    return serving_request.get()
+
+def metrics_route():
+    """The route a statement or load belongs to: the request's route, or 'background'."""
+    if has_request_context():
+        return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    stats = serving_request.get()
+    return stats.route if stats is not None else 'background'
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the statement's context, which a statement that raises takes with it,
+    # rather than on the pooled connection
+    if context is not None:
+        context.query_started = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_query(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, 'query_started', None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    route = metrics_route()
+    metrics.inc('forum_db_queries_total', (route,))
+    metrics.inc('forum_db_query_seconds_total', (route,), elapsed)
+    stats = current_request_stats()
+    if stats is not None:
+        stats.query_count += 1
+        if current_app.config['SLOW_REQUEST_MS']:
+            stats.queries.append((elapsed, statement))
+
+@event.listens_for(OrmSession, 'do_orm_execute')
+def record_lazy_load(orm_execute_state):
+    if orm_execute_state.is_select and orm_execute_state.lazy_loaded_from is not None:
+        metrics.inc('forum_orm_lazy_loads_total', (metrics_route(),))
+
+@api.before_app_request
+def start_request_timer():
+    g.request_stats = RequestStats(request.method, metrics_route())
+
+@api.after_app_request
+def record_request(response):
+    stats = g.pop('request_stats', None)
+    if stats is not None:
+        stats.record(
+            response.status_code, request.content_length or 0, response.content_length,
+            request.full_path, current_app.config['SLOW_REQUEST_MS']
+        )
+    return response
+
+@api.teardown_app_request
+def record_failed_request(exc):
+    # after_request doesn't run when a view raises, so count the 500 here
+    if exc is not None and 'request_stats' in g:
+        record_request(Response(status=500))
+
+METRICS_MIMETYPE = 'text/plain; version=0.0.4'
+
+@api.route('/api/metrics')
+def get_metrics():
+    """Request, SQL and ORM metrics in Prometheus text format."""
+    return Response(metrics.render(), mimetype=METRICS_MIMETYPE)
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider, encoding with orjson when it's installed.
+
+    Output matches the default provider's apart from whitespace: keys are still
+    sorted, and dates still go through its default() hook.
+    """
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return self.dumps_bytes(obj).decode()
+
+    def dumps_bytes(self, obj):
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=option)
+
+    def response(self, *args, **kwargs):
+        # The default provider pretty-prints in debug mode, which orjson can't match
+        if orjson is None or self.compact is False or (self.compact is None and self._app.debug):
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumps_bytes(obj) + b"\n", mimetype=self.mimetype)
+
+def dumps_json(obj):
+    """Encode obj for the streaming endpoints, which build their bodies outside a request."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(obj)
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson', 'text/plain', 'text/html')
+
+def encoded_etags(etag):
+    """The ETags compress_response() may have given the encodings of one response."""
+    return (etag, f"{etag}-gzip", f"{etag}-br")
+
+@api.after_app_request
+def compress_response(response):
+    """Compress large responses with the best encoding the client accepts.
+
+    Streamed responses are left alone so they can be flushed as they're produced.
+    Each encoding gets its own ETag, since the bytes differ.
+    """
+    if (response.status_code != 200 or response.is_streamed or response.direct_passthrough
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+
+    encoding = request.accept_encodings.best_match(['br', 'gzip'] if brotli is not None else ['gzip'])
+    if encoding is None or response.content_length < current_app.config['COMPRESS_MIN_SIZE']:
+        return response
+    if encoding == 'br':
+        data = brotli.compress(response.get_data(), quality=current_app.config['COMPRESS_BROTLI_QUALITY'])
+    else:
+        data = gzip.compress(response.get_data(), compresslevel=current_app.config['COMPRESS_GZIP_LEVEL'], mtime=0)
+
+    response.set_data(data)
+    response.content_encoding = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f"{etag}-{encoding}", weak)
+    return response
+
+class LRUCache:
+    """A small thread-safe mapping that drops its least recently used entry when full.
+
+    With a ttl, entries also expire that many seconds after they were set.
+    """
+
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (value, expiry time or None)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            value, expires = self._data[key]
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            expires = time.monotonic() + self.ttl if self.ttl is not None else None
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+class ChangeFeed:
+    """An in-process log of recent change events, followed by the event stream endpoints.
+
+    Event ids are consecutive, so a client resuming with Last-Event-ID can be sent
+    exactly what it missed while that's still in the buffer. They start from the
+    current time in milliseconds, so ids from before a restart are recognisably stale.
+    """
+
+    def __init__(self, maxlen):
+        self._events = deque(maxlen=maxlen)
+        self._last_id = int(time.time() * 1000)
+        self._condition = threading.Condition()
+        self._listeners = []
+
+    @property
+    def last_id(self):
+        return self._last_id
+
+    def publish(self, event_type, data):
+        with self._condition:
+            self._last_id += 1
+            self._events.append((self._last_id, event_type, data))
+            self._condition.notify_all()
+        for listener in self._listeners:
+            listener()
+
+    def subscribe(self, listener):
+        """Call listener() after every publish, from the publishing thread."""
+        self._listeners.append(listener)
+
+    def since(self, last_id):
+        """Return (events after last_id, complete).
+
+        complete is False when events after last_id have already been dropped
+        from the buffer, or last_id doesn't come from this process at all.
+        """
+        with self._condition:
+            if last_id > self._last_id:
+                return [], False
+            first_id = self._events[0][0] if self._events else self._last_id + 1
+            if last_id < first_id - 1:
+                return list(self._events), False
+            return list(self._events)[last_id - first_id + 1:], True
+
+    def wait(self, last_id, timeout):
+        """Block until there's an event after last_id. Returns False on timeout."""
+        with self._condition:
+            return self._condition.wait_for(lambda: self._last_id > last_id, timeout)
+
+change_feed = ChangeFeed(CHANGE_FEED_SIZE)
+
+def call_after_commit(session, fn, *args):
+    """Run fn(*args) once the session's transaction commits. Dropped if it rolls back."""
+    session.info.setdefault('after_commit', []).append((fn, args))
+
+def publish_after_commit(session, event_type, data):
+    """Queue a change event to be published once the session's transaction commits."""
+    broadcast_after_commit(session, publish_change, event_type, data)
+
+# Functions other processes may be asked to run by broadcast_after_commit(), by name
+BROADCASTS = {}
+
+def broadcast(fn):
+    """Register fn to be run by ChangeListener for changes made in other processes."""
+    BROADCASTS[fn.__name__] = fn
+    return fn
+
+def broadcast_after_commit(session, fn, *args):
+    """Run fn(*args) once the session's transaction commits, in this and every other process.
+
+    fn must be registered with @broadcast and args must be JSON serializable. The
+    call is logged to change_log in the same transaction, so other processes hear
+    of exactly the changes that were committed.
+    """
+    if fn.__name__ not in BROADCASTS:
+        raise ValueError(f"{fn.__name__} is not registered with @broadcast")
+    if not change_listener.running:
+        call_after_commit(session, fn, *args)
+        return
+    created_at = datetime.utcnow()
+    entry = ChangeLog(origin=os.getpid(), name=fn.__name__, args=dumps_json(args), created_at=created_at)
+    session.add(entry)
+    call_after_commit(session, run_logged_change, entry, created_at, fn, *args)
+
+# The change_log entry, as (id, time), whose broadcast is running
+current_change = contextvars.ContextVar('current_change', default=None)
+
+def change_time(created_at):
+    """A change_log created_at as a Last-Modified value."""
+    return created_at.replace(tzinfo=timezone.utc, microsecond=0)
+
+def run_as_change(change, fn, *args):
+    """Run fn(*args) for a committed change_log entry, which resource versions are bumped to."""
+    token = current_change.set(change)
+    try:
+        fn(*args)
+    finally:
+        current_change.reset(token)
+
+def run_logged_change(entry, created_at, fn, *args):
+    # The entry's attributes expired with the commit, but its identity is kept
+    run_as_change((inspect(entry).identity[0], change_time(created_at)), fn, *args)
+
+class ResourceVersions:
+    """Versions of the resources behind the read endpoints.
+
+    Writers bump a resource once their change is committed. Readers turn the
+    versions into an ETag and Last-Modified, so a client whose copy is current can
+    be answered with a 304 without running any query.
+
+    While ChangeListener runs, a resource's version is the change_log id of its
+    last change, so every process sharing the database gives it the same ETag.
+    Changes a process can't have seen are covered by a floor the listener keeps
+    (see ChangeListener.share_floor). Changes that weren't logged are counted by
+    this process alone, and give ETags only it hands out until the resource's
+    next logged change.
+    """
+
+    def __init__(self):
+        # Distinguishes this process's own counts from those of other processes and runs
+        self._boot_id = secrets.token_hex(8)
+        self._floor = (0, datetime.now(timezone.utc).replace(microsecond=0))  # (change id, last modified)
+        self._shared = False
+        self._versions = {}  # resource -> (change id, unlogged changes since, last modified)
+        self._lock = threading.Lock()
+
+    def share(self, floor_id, floor_time):
+        """Version resources by change_log id from now on, none below floor_id."""
+        with self._lock:
+            self._shared = True
+            self._floor = (floor_id, floor_time)
+
+    def unshare(self):
+        """Go back to versions only this process hands out, when the listener stops."""
+        with self._lock:
+            self._shared = False
+        self.reset()
+
+    def bump(self, *resources):
+        change = current_change.get()
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        with self._lock:
+            for resource in resources:
+                change_id, unlogged, _ = self._versions.get(resource, (0, 0, None))
+                if change is None:
+                    self._versions[resource] = (change_id, unlogged + 1, now)
+                elif change[0] > change_id:
+                    self._versions[resource] = (change[0], 0, change[1])
+                # An older entry arriving late was committed before the newer one, whose
+                # version already covers it
+
+    def validators(self, resources, variant=''):
+        """Return (etag, last_modified) for a response built from resources.
+
+        variant covers anything else the response depends on, like the query string.
+        """
+        with self._lock:
+            floor_id, floor_time = self._floor
+            state = []
+            for resource in resources:
+                change_id, unlogged, modified = self._versions.get(resource, (0, 0, None))
+                if change_id <= floor_id:
+                    change_id, modified = floor_id, max(modified or floor_time, floor_time)
+                state.append((resource, change_id, (unlogged, self._boot_id) if unlogged else None, modified))
+            boot_id = None if self._shared else self._boot_id
+        digest = hashlib.sha1(repr((boot_id, [s[:3] for s in state], variant)).encode())
+        return digest.hexdigest()[:24], max(s[3] for s in state)
+
+    def reset(self):
+        """Invalidate every ETag handed out so far."""
+        with self._lock:
+            self._boot_id = secrets.token_hex(8)
+            if not self._shared:
+                self._floor = (0, datetime.now(timezone.utc).replace(microsecond=0))
+            self._versions.clear()
+
+resource_versions = ResourceVersions()
+
+def changed_resources(event_type, data):
+    """The resources whose responses a change event makes stale."""
+    if event_type == 'thread-created':
+        return ['threads']
+    if event_type == 'thread-deleted':
+        return ['threads', f"posts:{data['threadId']}"]
+    if event_type in ('post-created', 'post-deleted'):
+        # Post counts and snippets are part of the thread listing
+        return ['threads', f"posts:{data['threadId']}"]
+    if event_type == 'vote-changed':
+        return ['threads'] if data['type'] == 'thread' else [f"posts:{data['threadId']}"]
+    return []
+
+@broadcast
+def publish_change(event_type, data):
+    resource_versions.bump(*changed_resources(event_type, data))
+    change_feed.publish(event_type, data)
+
+@event.listens_for(OrmSession, 'after_commit')
+def run_after_commit_callbacks(session):
+    for fn, args in session.info.pop('after_commit', []):
+        fn(*args)
+
+@event.listens_for(OrmSession, 'after_rollback')
+def discard_after_commit_callbacks(session):
+    session.info.pop('after_commit', None)
+
+class ChangeListener:
+    """Applies the broadcast_after_commit() calls of other processes sharing the database.
+
+    A background thread polls PRAGMA data_version on a connection of its own,
+    which changes only when another connection commits, and reads the new
+    change_log entries only then. So workers keep their caches and ETags in step
+    without any service between them, and the check costs no I/O while the
+    database is quiet. The thread also deletes entries older than
+    CHANGE_LOG_RETENTION seconds.
+    """
+
+    def __init__(self):
+        self._thread = None
+        self._last_id = 0
+        self._start = None  # (id, time) of the newest change_log entry when started
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self, engine, read_engine, config):
+        """Follow change_log from its current end. engine deletes old entries,
+        read_engine is polled."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            with read_engine.connect() as conn:
+                newest = conn.execute(
+                    select(ChangeLog.id, ChangeLog.created_at).order_by(ChangeLog.id.desc()).limit(1)
+                ).first()
+                self._last_id = newest.id if newest else 0
+                now = datetime.now(timezone.utc).replace(microsecond=0)
+                self._start = (newest.id, change_time(newest.created_at)) if newest else (0, now)
+                self.share_floor(conn)
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run, args=(engine, read_engine, config), name='change-listener', daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        """Stop following change_log, so the listener can be started on another database."""
+        with self._lock:
+            if self._thread is None:
+                return
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+            self._last_id = 0
+            self._start = None
+            resource_versions.unshare()
+
+    def _run(self, engine, read_engine, config):
+        interval, retention = config['CHANGE_POLL_INTERVAL'], config['CHANGE_LOG_RETENTION']
+        data_version = None
+        next_purge = time.monotonic()
+        with read_engine.connect() as conn:
+            while True:
+                try:
+                    version = conn.exec_driver_sql("PRAGMA data_version").scalar()
+                    if version != data_version:
+                        data_version = version
+                        self.poll(conn)
+                    if time.monotonic() >= next_purge:
+                        next_purge = time.monotonic() + retention / 10
+                        cutoff = datetime.utcnow() - timedelta(seconds=retention)
+                        with engine.begin() as writer:
+                            writer.execute(delete(ChangeLog).where(ChangeLog.created_at < cutoff))
+                except Exception:
+                    logger.exception("Failed to read changes from other processes")
+                conn.rollback()
+                if self._stopped.wait(interval):
+                    return
+
+    def share_floor(self, conn):
+        """Give resource_versions the newest change this process may not have seen.
+
+        That's the newest entry from before it started, or the newest one purged
+        since, whichever came later. Once the purge has passed every process's
+        start, they all have the same floor.
+        """
+        floor = self._start
+        oldest = conn.execute(select(ChangeLog.id, ChangeLog.created_at).order_by(ChangeLog.id).limit(1)).first()
+        if oldest is not None and oldest.id - 1 > floor[0]:
+            # Purged entries are older than the oldest left
+            floor = (oldest.id - 1, change_time(oldest.created_at))
+        resource_versions.share(*floor)
+
+    def poll(self, conn):
+        """Apply the change_log entries committed since the last poll by other processes."""
+        self.share_floor(conn)
+        rows = conn.execute(
+            select(ChangeLog.id, ChangeLog.origin, ChangeLog.name, ChangeLog.args, ChangeLog.created_at)
+            .where(ChangeLog.id > self._last_id).order_by(ChangeLog.id)
+        ).all()
+        if rows and rows[0].id > self._last_id + 1 and self._last_id:
+            # Entries were purged before we read them, so anything could be stale
+            logger.warning("Missed changes from other processes, dropping all caches")
+            reset_caches()
+        pid = os.getpid()
+        for row in rows:
+            self._last_id = row.id
+            if row.origin == pid:
+                continue
+            fn = BROADCASTS.get(row.name)
+            if fn is None:
+                logger.warning("Ignoring unknown change %r from process %s", row.name, row.origin)
+                continue
+            run_as_change((row.id, change_time(row.created_at)), fn, *loads_json(row.args))
+
+change_listener = ChangeListener()
+
+def conditional(*resources):
+    """Make a GET view answer If-None-Match / If-Modified-Since from resource versions.
+
+    Each resource is a name, or a function of the view's arguments returning one
+    or more names. The check runs before the view, so a client whose copy is
+    current gets a 304 without the view running a single query.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            headers, not_modified = check_conditional(
+                resource_names(resources, **kwargs), request.path, request.query_string,
+                request.headers.get('Authorization'),
+                request.headers.get('If-None-Match'), request.headers.get('If-Modified-Since')
+            )
+            if not_modified:
+                response = Response(status=304)
+            else:
+                response = current_app.make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.headers.update(headers)
+            return response
+        return wrapper
+    return decorator
+
+def resource_names(resources, *args, **kwargs):
+    """Expand the resources given to conditional(), calling the functions among them with args."""
+    names = []
+    for resource in resources:
+        resource = resource(*args, **kwargs) if callable(resource) else resource
+        names.extend([resource] if isinstance(resource, str) else resource)
+    return names
+
+def check_conditional(names, path, query_string, authorization, if_none_match, if_modified_since):
+    """Check a GET of path against the versions of resources `names`, for conditional() here and in asgi.py.
+
+    The last three arguments are the raw request headers. Returns (headers,
+    not_modified): the validators to send with the response, and whether the
+    client's copy is current so a 304 will do.
+    """
+    # The body also depends on the URL and on who is asking
+    etag, last_modified = resource_versions.validators(names, (path, query_string, authorization))
+
+    # The client may hold a compressed copy, tagged by compress_response()
+    matched = None
+    if if_none_match:
+        client_etags = parse_etags(if_none_match)
+        matched = next((tag for tag in encoded_etags(etag) if client_etags.contains_weak(tag)), None)
+        not_modified = matched is not None
+    else:
+        since = parse_date(if_modified_since)
+        not_modified = since is not None and since >= last_modified
+    headers = {
+        'ETag': quote_etag(matched or etag),
+        'Last-Modified': http_date(last_modified),
+        # Let clients keep a copy but always check back before using it
+        'Cache-Control': 'no-cache',
+    }
+    return headers, not_modified
 
-@app.route('/')
+@api.route('/')
 def base():
     return 'Hello world. This is the base page for cse108 final project!'
 
-@app.route('/api/threads', methods=['GET'])
+def encode_cursor(values):
+    """Pack the sort key of the last row of a page into an opaque cursor string."""
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, keys):
+    """Unpack a cursor produced by encode_cursor for the given sort key columns.
+
+    Raises ValueError if the cursor is malformed or doesn't match the keys.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(keys):
+            raise ValueError(cursor)
+        return [
+            datetime.fromisoformat(v) if isinstance(key.type, DateTime) else v
+            for key, v in zip(keys, values)
+        ]
+    except (ValueError, TypeError):
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+
+def clamp_limit(value):
+    """Turn a ?limit= value into a page size of at most MAX_PAGE_SIZE. None means no limit."""
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        return None
+    return min(max(limit, 1), MAX_PAGE_SIZE)
+
+def parse_limit():
+    """Read ?limit= from the request, clamped to MAX_PAGE_SIZE. None means no limit."""
+    return clamp_limit(request.args.get('limit'))
+
+def make_snippet(text):
+    text = text or ''
+    return text[:SNIPPET_LENGTH] + '...' if len(text) > SNIPPET_LENGTH else text
+
+# Sort name -> (key columns, descending). The thread id is always the last key so the
+# ordering is total and can be resumed from a cursor.
+THREAD_SORTS = {
+    'oldest': ((Thread.id,), False),
+    'newest': ((Thread.created_at, Thread.id), True),
+    'active': ((Thread.last_post_at, Thread.id), True),
+    'votes': ((Thread.net_votes, Thread.id), True),
+    'hot': ((Thread.hot_score, Thread.id), True),
+}
+
+def thread_listing_query(sort='oldest', after=None, limit=None):
+    """Build the single SELECT behind the thread listing.
+
+    Post statistics come from the thread row itself and author and puzzle names
+    from primary key joins, so a page is one range scan of the threads table.
+    """
+    keys, descending = THREAD_SORTS[sort]
+
+    query = (
+        select(
+            Thread.id,
+            Thread.name,
+            Thread.description,
+            Thread.puzzle_id,
+            Thread.upvotes,
+            Thread.downvotes,
+            User.username.label('author'),
+            Puzzle.name.label('puzzle_name'),
+            Thread.post_count,
+            Thread.snippet,
+            *(key.label(f'sort_key_{i}') for i, key in enumerate(keys))
+        )
+        .outerjoin(User, Thread.creator_id == User.id)
+        .outerjoin(Puzzle, Thread.puzzle_id == Puzzle.id)
+        .where(Thread.deleted_at.is_(None))
+    )
+
+    if after is not None:
+        values = decode_cursor(after, keys)
+        if descending:
+            query = query.where(tuple_(*keys) < tuple_(*values))
+        else:
+            query = query.where(tuple_(*keys) > tuple_(*values))
+
+    query = query.order_by(*(key.desc() if descending else key for key in keys))
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+def thread_row_to_dict(row):
+    return {
+        "id": row.id,
+        "name": row.name,
+        "description": row.description,
+        "requiredPuzzleId": row.puzzle_id if isinstance(row.puzzle_id, int) else None,
+        "postCount": row.post_count,
+        "upvotes": row.upvotes,
+        "downvotes": row.downvotes,
+        "snippet": row.snippet or '',
+        "author": row.author or "unknown",
+        "puzzleName": row.puzzle_name or "General"
+    }
+
+def thread_page_headers(rows, sort, limit):
+    """The cursor headers for a page of thread_listing_query rows."""
+    # A full page means there may be more; hand back where to resume from
+    if limit is not None and len(rows) == limit:
+        last = rows[-1]
+        return {'X-Next-Cursor': encode_cursor(
+            [last._mapping[f'sort_key_{i}'] for i in range(len(THREAD_SORTS[sort][0]))]
+        )}
+    return {}
+
+@api.route('/api/threads', methods=['GET'])
+@conditional('threads')
 def get_threads():
-    session = Session()
-    threads = session.query(Thread).all()
-    result = []
-    for t in threads:
-        first_post = t.posts[0].text if t.posts else ''
-        snippet = first_post[:120] + '...' if len(first_post) > 120 else first_post
-
-        result.append({
-            "id": t.id,
-            "name": t.name,
-            "description": t.description,
-            "requiredPuzzleId": t.puzzle_id if isinstance(t.puzzle_id, int) else None,
-            "postCount": len(t.posts),
-            "upvotes": t.upvotes,
-            "downvotes": t.downvotes,
-            "snippet": snippet,
-            "author": t.creator.username if t.creator else "unknown",
-            "puzzleName": t.puzzle.name if t.puzzle else "General"
-        })
+    sort = request.args.get('sort', 'oldest')
+    if sort not in THREAD_SORTS:
+        return jsonify({"error": f"Unknown sort '{sort}'"}), 400
+    limit = parse_limit()
 
-    session.close()
-    return jsonify(result)
+    try:
+        query = thread_listing_query(sort, request.args.get('after'), limit)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    rows = get_db(read_only=True).execute(query).all()
 
-@app.route('/api/threads', methods=['POST'])
-def create_thread():
-    session = Session()
-    data = request.get_json()
+    response = jsonify([thread_row_to_dict(row) for row in rows])
+    response.headers.update(thread_page_headers(rows, sort, limit))
+    return response
 
-    user = session.query(User).filter_by(username=data.get("author")).first()
+def add_thread(session, user, name, description, puzzle_id=None):
     if not user:
-        session.close()
-        return jsonify({"error": "User not found"}), 404
+        return {"error": "User not found"}, 404
 
     # Check if thread requires a puzzle that the user hasn't completed
-    if data.get('requiredPuzzleId'):
-        completed = session.query(CompletedPuzzle).filter_by(
-            user_id=user.id, 
-            puzzle_id=data.get('requiredPuzzleId')
-        ).first()
-        
-        if not completed and not user.is_admin:
-            session.close()
-            return jsonify({"error": "You must complete the required puzzle first"}), 403
+    if puzzle_id:
+        if not has_unlocked(session, user, puzzle_id):
+            return {"error": "You must complete the required puzzle first"}, 403
 
     new_thread = Thread(
-        name=data['name'],
-        description=data['description'],
-        puzzle_id=data.get('requiredPuzzleId'),
-        creator=user
+        name=name,
+        description=description,
+        puzzle_id=puzzle_id,
+        creator_id=user.id
     )
     session.add(new_thread)
-    session.commit()
+    session.flush()
     thread_id = new_thread.id
-    session.close()
+    publish_after_commit(session, 'thread-created', {"threadId": thread_id})
+    if puzzle_id:
+        broadcast_after_commit(session, puzzles_changed)
 
-    return jsonify({"id": thread_id, "status": "Thread created"}), 201
+    return {"id": thread_id, "status": "Thread created"}, 201
 
+def remove_thread(session, user, thread_id):
+    """Hide a thread at once, leaving its posts to ThreadPurger.
 
-@app.route('/api/threads/<int:thread_id>', methods=['DELETE'])
-def delete_thread(thread_id):
-    session = Session()
+    Deleting a large thread in one go would hold the write lock for as long as
+    it takes to delete every post.
+    """
     thread = session.get(Thread, thread_id)
 
-    if not thread:
-        session.close()
-        return jsonify({"error": "Thread not found"}), 404
+    if not thread or thread.deleted_at is not None:
+        return {"error": "Thread not found"}, 404
 
-    username = request.args.get("username")
-    if not thread.creator or thread.creator.username != username:
-        session.close()
-        return jsonify({"error": "Unauthorized"}), 403
+    if not user or thread.creator_id != user.id:
+        return {"error": "Unauthorized"}, 403
 
-    session.delete(thread)
-    session.commit()
-    session.close()
+    publish_after_commit(session, 'thread-deleted', {"threadId": thread_id})
+    if thread.puzzle_id:
+        broadcast_after_commit(session, puzzles_changed)
+    thread.deleted_at = datetime.utcnow()
+    broadcast_after_commit(session, archive_changed, thread_id)
+    call_after_commit(session, thread_purger.wake)
+    return {"status": "deleted"}, 200
+
+def purge_deleted_threads(engine, batch_size, pause=0):
+    """Delete the threads hidden by remove_thread, and their posts, batch_size posts at a time.
+
+    Each batch is its own transaction and holds the write lock only briefly.
+    Returns the number of threads purged.
+    """
+    purged = 0
+    while True:
+        with engine.connect() as conn:
+            thread_id = conn.scalar(select(Thread.id).where(Thread.deleted_at.isnot(None)).limit(1))
+        if thread_id is None:
+            return purged
+        while True:
+            with engine.begin() as conn:
+                batch = select(Post.id).where(Post.thread_id == thread_id).limit(batch_size)
+                deleted = conn.execute(
+                    delete(Post).where(Post.id.in_(batch)).execution_options(**post_shards.for_thread(thread_id))
+                ).rowcount
+                if deleted < batch_size:
+                    block = conn.scalar(select(PostArchive.block).where(PostArchive.thread_id == thread_id))
+                    if block is not None and has_archived_post_search(conn):
+                        unindex_archived_posts(conn, decode_archive(block))
+                    conn.execute(delete(ArchivedPostThread).where(ArchivedPostThread.thread_id == thread_id))
+                    conn.execute(delete(PostArchive).where(PostArchive.thread_id == thread_id))
+                    conn.execute(delete(Thread).where(Thread.id == thread_id, Thread.deleted_at.isnot(None)))
+                    break
+            time.sleep(pause)
+        purged += 1
+
+class ThreadPurger:
+    """Runs purge_deleted_threads() on a background thread whenever woken.
+
+    It also runs once on start, for threads left over from an earlier process.
+    An in-memory database is only visible to the thread that opened it, so there
+    the purge runs in the waking thread instead.
+    """
+
+    def __init__(self):
+        self._engine = None
+        self._config = None
+        self._inline = False
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def start(self, engine, config):
+        self._engine, self._config = engine, config
+        self._inline = is_memory_db(config['DATABASE_URI'])
+        if not self._inline and self._thread is None:
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name='thread-purger', daemon=True)
+            self._thread.start()
+        self.wake()
+
+    def stop(self):
+        """Stop purging, letting a purge under way finish first."""
+        if self._thread is not None:
+            self._stopped = True
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+        self._engine = None
+
+    def wake(self):
+        if self._engine is None:
+            return
+        if self._inline:
+            self.purge()
+        else:
+            self._wake.set()
+
+    def purge(self):
+        return purge_deleted_threads(
+            self._engine, self._config['THREAD_PURGE_BATCH_SIZE'], self._config['THREAD_PURGE_PAUSE']
+        )
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            if self._stopped:
+                return
+            try:
+                self.purge()
+            except Exception:
+                logger.exception("Failed to purge deleted threads")
+
+thread_purger = ThreadPurger()
+
+@api.route('/api/threads', methods=['POST'])
+def create_thread():
+    session = get_db()
+    data = request.get_json()
+
+    body, status = add_thread(
+        session, current_principal(session, data.get("author")),
+        data['name'], data['description'], data.get('requiredPuzzleId')
+    )
+    if status < 400:
+        session.commit()
+    return jsonify(body), status
+
+
+@api.route('/api/threads/<int:thread_id>', methods=['DELETE'])
+def delete_thread(thread_id):
+    session = get_db()
+
+    body, status = remove_thread(session, current_principal(session, request.args.get("username")), thread_id)
+    if status < 400:
+        session.commit()
+    return jsonify(body), status
+
+POST_SORT_KEYS = (Post.timestamp, Post.id)
+
+def post_listing_query(thread_id, after=None, before=None, limit=None):
+    """Build the SELECT for a page of a thread's posts, with author names joined in.
+
+    Pages are keyed on (timestamp, id) within the thread so each one is a range
+    scan of ix_posts_thread_id_timestamp_id. Paging backwards with `before` reads
+    the index in reverse, so callers must flip those rows back into display order.
+    """
+    query = (
+        select(Post.id, Post.text, Post.timestamp, User.username.label('author'))
+        .join(User, Post.user_id == User.id)
+        .where(Post.thread_id == thread_id)
+        # Evaluated once, not per row: a deleted thread's posts are gone with it
+        .where(select(Thread.id).where(Thread.id == thread_id, Thread.deleted_at.is_(None)).exists())
+    )
+
+    if after is not None:
+        query = query.where(tuple_(*POST_SORT_KEYS) > tuple_(*decode_cursor(after, POST_SORT_KEYS)))
+    if before is not None:
+        query = query.where(tuple_(*POST_SORT_KEYS) < tuple_(*decode_cursor(before, POST_SORT_KEYS)))
+        query = query.order_by(*(key.desc() for key in POST_SORT_KEYS))
+    else:
+        query = query.order_by(*POST_SORT_KEYS)
+
+    if limit is not None:
+        query = query.limit(limit)
+    return query.execution_options(**post_shards.for_thread(thread_id))
+
+def in_display_order(query, before=None):
+    """A post_listing_query() whose rows come out in display order, for streaming them from the cursor.
+
+    A page read backwards with `before` is re-sorted by an outer SELECT, which
+    only sorts that page's rows.
+    """
+    if before is None:
+        return query
+    page = query.subquery()
+    return select(page).order_by(page.c.timestamp, page.c.id).execution_options(**query.get_execution_options())
+
+def post_row_to_dict(row):
+    return {
+        "id": row.id,
+        "author": row.author,
+        "text": row.text,
+        "timestamp": row.timestamp.isoformat()
+    }
 
-    return jsonify({"status": "deleted"})
+def post_page_headers(rows, limit, after=None, before=None):
+    """The cursor headers for a page of post_listing_query rows, in display order."""
+    headers = {}
+    if limit is not None and rows:
+        # A page reached through a cursor has rows on the side it came from, and
+        # a full page may have more in the direction it was read
+        if before is not None or len(rows) == limit:
+            headers['X-Next-Cursor'] = encode_cursor([rows[-1].timestamp, rows[-1].id])
+        if after is not None or (before is not None and len(rows) == limit):
+            headers['X-Prev-Cursor'] = encode_cursor([rows[0].timestamp, rows[0].id])
+    return headers
+
+POST_STREAM_MIMETYPES = {'ndjson': 'application/x-ndjson', 'json': 'application/json'}
+
+def post_stream_format(stream, accept):
+    """How GET /api/posts should stream its body: 'ndjson', 'json', or None to send a page.
+
+    stream is the query parameter and accept the Accept header. Raises
+    ValueError for a format that isn't supported.
+    """
+    if stream is None and parse_accept_header(accept, MIMEAccept).best == 'application/x-ndjson':
+        stream = 'ndjson'
+    if stream not in (None, *POST_STREAM_MIMETYPES):
+        raise ValueError(f"Unknown stream format '{stream}'")
+    return stream
+
+class PostEncoder:
+    """Encodes post rows one at a time, as NDJSON lines or as pieces of one JSON array."""
+
+    def __init__(self, fmt):
+        self.fmt = fmt
+        self._separator = '['
+
+    def encode(self, row):
+        if self.fmt == 'ndjson':
+            return dumps_json(post_row_to_dict(row)) + '\n'
+        piece, self._separator = self._separator + dumps_json(post_row_to_dict(row)), ','
+        return piece
+
+    def end(self):
+        """What follows the last row, if anything."""
+        if self.fmt == 'ndjson':
+            return ''
+        return '[]' if self._separator == '[' else ']'
+
+def format_posts(rows, fmt):
+    """Yield post rows as NDJSON lines or as pieces of one JSON array."""
+    encoder = PostEncoder(fmt)
+    for row in rows:
+        yield encoder.encode(row)
+    end = encoder.end()
+    if end:
+        yield end
+
+def stream_posts(session, query, fmt):
+    """Yield the posts of a query in the format of format_posts().
+
+    Rows are pulled from the cursor in batches, so memory stays flat however long
+    the thread is. The session is closed once the generator is exhausted or dropped.
+    """
+    try:
+        yield from format_posts(session.execute(query.execution_options(yield_per=STREAM_BATCH_SIZE)), fmt)
+    finally:
+        session.close()
 
-@app.route('/api/posts')
+@api.route('/api/posts')
+@conditional(lambda: f"posts:{request.args.get('threadId', type=int)}")
 def get_posts():
-    session = Session()
     thread_id = request.args.get('threadId', type=int)
-    posts = session.query(Post).filter_by(thread_id=thread_id).order_by(Post.timestamp).all()
-    result = [
-        {
-            "id": post.id,
-            "author": post.author.username,
-            "text": post.text,
-            "timestamp": post.timestamp.isoformat()
-        } for post in posts
+    after = request.args.get('after')
+    before = request.args.get('before')
+    if after is not None and before is not None:
+        return jsonify({"error": "Use either 'after' or 'before', not both"}), 400
+    limit = parse_limit()
+
+    try:
+        stream = post_stream_format(request.args.get('stream'), request.headers.get('Accept'))
+        query = post_listing_query(thread_id, after, before, limit)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if stream is not None:
+        mimetype = POST_STREAM_MIMETYPES[stream]
+        archived = archived_page(get_db(read_only=True), thread_id, after, before, limit)
+        if archived is not None:
+            if before is not None:
+                archived.reverse()
+            return Response(format_posts(archived, stream), mimetype=mimetype)
+        # The body is produced after the request has ended, so it needs its own session
+        session = db.session(read_only=True)
+        return Response(stream_posts(session, in_display_order(query, before), stream), mimetype=mimetype)
+
+    rows = post_page(get_db(read_only=True), query, thread_id, after, before, limit)
+    response = jsonify([post_row_to_dict(row) for row in rows])
+    response.headers.update(post_page_headers(rows, limit, after, before))
+    return response
+
+# Archived posts have the attributes of post_listing_query rows, and what's needed to restore them
+ArchivedPost = namedtuple('ArchivedPost', ['id', 'user_id', 'author', 'text', 'timestamp', 'upvotes', 'downvotes'])
+
+def encode_archive(rows):
+    """Pack ArchivedPost-like rows, in display order, into a zlib-compressed JSON array."""
+    data = [
+        [row.id, row.user_id, row.author, row.text, row.timestamp.isoformat(), row.upvotes, row.downvotes]
+        for row in rows
     ]
-    session.close()
-    return jsonify(result)
+    return zlib.compress(dumps_json(data).encode(), 9)
 
-@app.route('/api/posts', methods=['POST'])
-def create_post():
-    session = Session()
-    data = request.get_json()
+def decode_archive(block):
+    posts = [ArchivedPost(*values) for values in loads_json(zlib.decompress(block))]
+    return [post._replace(timestamp=datetime.fromisoformat(post.timestamp)) for post in posts]
 
-    user = session.query(User).filter_by(username=data['author']).first()
-    if not user:
+# thread id -> its archived posts in display order, or () for a thread that isn't archived
+archive_cache = LRUCache(ARCHIVE_CACHE_SIZE)
+
+@broadcast
+def archive_changed(thread_id):
+    """Call after committing a change to whether thread_id is archived, or visible."""
+    archive_cache.pop(thread_id)
+
+def index_archived_posts(conn, posts):
+    """Add a thread's newly archived posts to archived_post_search."""
+    if not posts:
+        return
+    conn.execute(
+        text("INSERT INTO archived_post_search (rowid, text) VALUES (:id, :text)"),
+        [{"id": post.id, "text": post.text} for post in posts]
+    )
+
+def unindex_archived_posts(conn, posts):
+    """Take posts leaving post_archive out of archived_post_search.
+
+    A contentless index can only forget a row given the exact text it indexed.
+    """
+    if not posts:
+        return
+    conn.execute(
+        text("INSERT INTO archived_post_search (archived_post_search, rowid, text) VALUES ('delete', :id, :text)"),
+        [{"id": post.id, "text": post.text} for post in posts]
+    )
+
+def archived_posts(session, thread_id):
+    """The archived posts of a visible thread in display order, or None if it isn't archived."""
+    posts = archive_cache.get(thread_id)
+    if posts is None:
+        block = session.scalar(
+            select(PostArchive.block)
+            .join(Thread, Thread.id == PostArchive.thread_id)
+            .where(PostArchive.thread_id == thread_id, Thread.deleted_at.is_(None))
+        )
+        posts = decode_archive(block) if block is not None else ()
+        archive_cache.set(thread_id, posts)
+    return posts or None
+
+def restore_archived_threads_of(session, post_ids):
+    """Restore the archived threads holding any of post_ids, in the caller's transaction.
+
+    Returns whether there were any, in which case the posts are now in posts.
+    """
+    thread_ids = session.scalars(
+        select(ArchivedPostThread.thread_id).where(ArchivedPostThread.post_id.in_(post_ids)).distinct()
+    ).all()
+    for thread_id in thread_ids:
+        restore_archived_posts(session, thread_id)
+    return bool(thread_ids)
+
+def post_page(session, query, thread_id, after=None, before=None, limit=None):
+    """The rows of a page of posts in display order, query being its post_listing_query()."""
+    rows = session.execute(query).all()
+    if not rows:
+        # The thread may have gone quiet and been archived
+        rows = archived_page(session, thread_id, after, before, limit) or rows
+    if before is not None:
+        rows.reverse()
+    return rows
+
+def archived_page(session, thread_id, after=None, before=None, limit=None):
+    """The rows post_listing_query() would give for an archived thread, or None if it isn't one."""
+    posts = archived_posts(session, thread_id)
+    if posts is None:
+        return None
+    keys = [(post.timestamp, post.id) for post in posts]
+    if before is not None:
+        # Newest first, like the query, for the caller to flip
+        end = bisect_left(keys, tuple(decode_cursor(before, POST_SORT_KEYS)))
+        start = 0 if limit is None else max(end - limit, 0)
+        return posts[start:end][::-1]
+    start = 0 if after is None else bisect_right(keys, tuple(decode_cursor(after, POST_SORT_KEYS)))
+    return posts[start:] if limit is None else posts[start:start + limit]
+
+def archive_threads(session_factory, idle_days, max_posts=ARCHIVE_MAX_POSTS, progress=None):
+    """Move the posts of threads without a post for idle_days into post_archive.
+
+    Each thread is archived in its own transaction, which stays short because
+    threads of more than max_posts posts are left alone. progress(thread_id,
+    post_count) is called after each one. Returns the number of threads archived.
+
+    Archived posts are still listed, from a compressed block per thread, and
+    found by search through archived_post_search. A new post in the thread, or
+    a vote on or deletion of one of its posts, brings the thread back first
+    (see restore_archived_posts).
+
+    post_archive lives in the main database, so moving posts out of a shard
+    would commit to two files at once. Raises ValueError if posts are sharded.
+    """
+    if post_shards.enabled:
+        raise ValueError("posts can't be archived while POST_SHARDS is set")
+    cutoff = datetime.utcnow() - timedelta(days=idle_days)
+    archived = 0
+    session = session_factory()
+    try:
+        thread_ids = session.scalars(
+            select(Thread.id)
+            .where(
+                Thread.last_post_at < cutoff,
+                Thread.deleted_at.is_(None),
+                Thread.post_count.between(1, max_posts),
+                ~select(PostArchive.thread_id).where(PostArchive.thread_id == Thread.id).exists()
+            )
+            .order_by(Thread.id)
+        ).all()
+        searchable = has_archived_post_search(session)
+        session.rollback()
+
+        for thread_id in thread_ids:
+            shard_options = post_shards.for_thread(thread_id)
+            rows = session.execute(
+                select(Post.id, Post.user_id, User.username.label('author'), Post.text, Post.timestamp,
+                       func.coalesce(Post.upvotes, 0).label('upvotes'),
+                       func.coalesce(Post.downvotes, 0).label('downvotes'))
+                .join(User, Post.user_id == User.id)
+                .where(Post.thread_id == thread_id)
+                .order_by(*POST_SORT_KEYS)
+                .execution_options(**shard_options)
+            ).all()
+            if not rows:
+                session.rollback()
+                continue
+            session.add(PostArchive(thread_id=thread_id, post_count=len(rows), block=encode_archive(rows)))
+            session.execute(insert(ArchivedPostThread), [{"post_id": row.id, "thread_id": thread_id} for row in rows])
+            if searchable:
+                index_archived_posts(session, rows)
+            session.execute(
+                delete(Post)
+                .where(Post.thread_id == thread_id, Post.id.in_([row.id for row in rows]))
+                .execution_options(**shard_options)
+            )
+            # Someone posted while we were reading, so the thread isn't quiet after all
+            if session.scalar(
+                select(Post.id).where(Post.thread_id == thread_id).limit(1).execution_options(**shard_options)
+            ) is not None:
+                session.rollback()
+                continue
+            broadcast_after_commit(session, archive_changed, thread_id)
+            session.commit()
+            archived += 1
+            if progress:
+                progress(thread_id, len(rows))
+    finally:
         session.close()
-        return jsonify({"error": "User not found"}), 404
+    return archived
+
+def restore_archived_posts(session, thread_id):
+    """Move an archived thread's posts back into posts, in the caller's transaction.
+
+    The posts keep their ids, which clients and events may already hold. Post
+    ids are never handed out twice, so nothing can have taken them meanwhile.
+    """
+    posts = archived_posts(session, thread_id)
+    if posts is None:
+        return
+    if has_archived_post_search(session):
+        unindex_archived_posts(session, posts)
+    session.execute(insert(Post).execution_options(**post_shards.for_thread(thread_id)), [
+        {"id": post.id, "text": post.text, "timestamp": post.timestamp, "user_id": post.user_id, "thread_id": thread_id,
+         "upvotes": post.upvotes, "downvotes": post.downvotes}
+        for post in posts
+    ])
+    session.execute(delete(ArchivedPostThread).where(ArchivedPostThread.thread_id == thread_id))
+    session.execute(delete(PostArchive).where(PostArchive.thread_id == thread_id))
+    broadcast_after_commit(session, archive_changed, thread_id)
+
+def insert_post(session, user, thread_id, text):
+    """Add a post by user to a thread and its statistics, in the caller's transaction.
+
+    Returns the post's id, thread_id, text and timestamp.
+    """
+    post = session.execute(
+        insert(Post)
+        .values(text=text, user_id=user.id, thread_id=thread_id)
+        .returning(Post.id, Post.thread_id, Post.text, Post.timestamp)
+        .execution_options(**post_shards.for_thread(thread_id))
+    ).one()
+    record_post_added(session, post, user.username)
+    return post
+
+def record_post_added(session, post, author):
+    """Fold a newly inserted post into its thread's statistics, in the caller's transaction.
+
+    When posts are partitioned that's left to thread_activity instead.
+    """
+    if thread_activity is not None:
+        call_after_commit(session, thread_activity.add_thread, post.thread_id)
+        return
+    session.execute(
+        update(Thread)
+        .where(Thread.id == post.thread_id)
+        .values(
+            # SET expressions all see the old row, so a count of 0 means this is the first post
+            snippet=case((Thread.post_count == 0, make_snippet(post.text)), else_=Thread.snippet),
+            post_count=Thread.post_count + 1,
+            last_post_at=post.timestamp,
+            last_post_author=author,
+            hot_score=func.hot_score(Thread.upvotes, Thread.downvotes, Thread.post_count + 1, Thread.created_at)
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+def record_post_removed(session, thread_id):
+    """Update a thread's statistics after one of its posts was deleted (and flushed)."""
+    if thread_activity is not None:
+        call_after_commit(session, thread_activity.add_thread, thread_id)
+        return
+    session.execute(
+        update(Thread)
+        .where(Thread.id == thread_id)
+        .values(
+            post_count=Thread.post_count - 1,
+            hot_score=func.hot_score(Thread.upvotes, Thread.downvotes, Thread.post_count - 1, Thread.created_at),
+            **thread_stats_values()
+        )
+        .execution_options(synchronize_session=False, **post_shards.for_thread(thread_id))
+    )
+
+def publish_post_change(session, event_type, data):
+    """publish_after_commit() for a change to posts alone.
+
+    When posts are partitioned the change_log entry is left to thread_activity,
+    so the caller's transaction only ever writes to the post's shard.
+    """
+    if thread_activity is None:
+        publish_after_commit(session, event_type, data)
+        return
+    call_after_commit(session, publish_change, event_type, data)
+    call_after_commit(session, thread_activity.add_change, event_type, data)
+
+class ThreadActivity:
+    """Writes the main database's share of post writes in batches, when posts are partitioned.
+
+    A new post then only takes the write lock of its shard. The statistics of
+    its thread and the change_log entry other processes hear of it by are
+    queued here instead, and written every `interval` seconds for everything
+    queued in one transaction on the main database. Until then the thread
+    listing shows the statistics as they were; reconcile-thread-stats repairs
+    any lost to a crash.
+    """
+
+    def __init__(self, session_factory, interval):
+        self.session_factory = session_factory
+        self.interval = interval
+        self._thread_ids = set()
+        self._changes = []  # publish_change() arguments to log to change_log
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def add_thread(self, thread_id):
+        """Queue thread_id's statistics to be recomputed from its posts."""
+        with self._lock:
+            self._thread_ids.add(thread_id)
+            self._start()
+
+    def add_change(self, event_type, data):
+        """Queue the change_log entry of a publish_change() call that has already run here."""
+        with self._lock:
+            self._changes.append((event_type, data))
+            self._start()
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="thread-activity", daemon=True)
+            self._thread.start()
+
+    def flush(self):
+        with self._lock:
+            thread_ids, self._thread_ids = self._thread_ids, set()
+            changes, self._changes = self._changes, []
+        if not thread_ids and not changes:
+            return
+
+        session = self.session_factory()
+        try:
+            if thread_ids:
+                for statement in refresh_thread_stats(Thread.id.in_(thread_ids)):
+                    session.execute(statement)
+                # The listing has only changed now
+                call_after_commit(session, resource_versions.bump, 'threads')
+            if change_listener.running:
+                created_at = datetime.utcnow()
+                for event_type, data in changes:
+                    entry = ChangeLog(
+                        origin=os.getpid(), name=publish_change.__name__,
+                        args=dumps_json([event_type, data]), created_at=created_at
+                    )
+                    session.add(entry)
+                    # It was published here before it was logged, so its resources are versioned now
+                    call_after_commit(
+                        session, run_logged_change, entry, created_at,
+                        resource_versions.bump, *changed_resources(event_type, data)
+                    )
+            session.commit()
+        except Exception:
+            session.rollback()
+            # Keep everything so the next flush retries it
+            with self._lock:
+                self._thread_ids |= thread_ids
+                self._changes[:0] = changes
+            raise
+        finally:
+            session.close()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to write thread activity")
+
+    def stop(self):
+        """Stop the background writer and write out whatever is still queued."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+# Set up by create_app() when posts are partitioned
+thread_activity = None
+
+# The write operations below are shared by their endpoints and /api/batch. Each
+# returns (body, status) and leaves committing to the caller. They check everything
+# before writing anything, so one that fails leaves the transaction untouched.
+
+def add_post(session, user, thread_id, text):
+    if not user:
+        return {"error": "User not found"}, 404
         
     # Get the thread
-    thread = session.get(Thread, data['threadId'])
-    if not thread:
-        session.close()
-        return jsonify({"error": "Thread not found"}), 404
+    thread = session.get(Thread, thread_id)
+    if not thread or thread.deleted_at is not None:
+        return {"error": "Thread not found"}, 404
         
     # Check if thread requires a puzzle that the user hasn't completed
-    if thread.puzzle_id:
-        completed = session.query(CompletedPuzzle).filter_by(
-            user_id=user.id, 
-            puzzle_id=thread.puzzle_id
-        ).first()
-        
-        if not completed and not user.is_admin:
-            session.close()
-            return jsonify({"error": "You must complete the required puzzle first"}), 403
+    if thread.puzzle_id and not has_unlocked(session, user, thread.puzzle_id):
+        return {"error": "You must complete the required puzzle first"}, 403
 
-    new_post = Post(
-        text=data['text'],
-        user_id=user.id,
-        thread_id=data['threadId']
-    )
-    session.add(new_post)
-    session.commit()
+    # A new post brings an archived thread back into use
+    restore_archived_posts(session, thread_id)
+    new_post = insert_post(session, user, thread_id, text)
 
     result = {
         "id": new_post.id,
@@ -264,89 +2336,393 @@ def create_post():
         "text": new_post.text,
         "timestamp": new_post.timestamp.isoformat()
     }
+    publish_post_change(session, 'post-created', {"threadId": new_post.thread_id, "post": result})
+    return result, 201
+
+def remove_post(session, user, post_id):
+    shard_options = post_shards.for_post(post_id)
+    post = None
+    if shard_options is not None:
+        query = select(Post.id, Post.user_id, Post.thread_id).where(Post.id == post_id).execution_options(**shard_options)
+        post = session.execute(query).first()
+        # A post of an archived thread is only in post_archive until the thread is restored
+        if post is None and restore_archived_threads_of(session, [post_id]):
+            post = session.execute(query).first()
+    # A shard can still hold posts of a thread that's gone from threads
+    thread = session.get(Thread, post.thread_id) if post else None
+
+    if not thread or thread.deleted_at is not None:
+        return {"error": "Post not found"}, 404
+
+    if not user or post.user_id != user.id:
+        return {"error": "Unauthorized"}, 403
+
+    publish_post_change(session, 'post-deleted', {"threadId": post.thread_id, "postId": post.id})
+    session.execute(delete(Post).where(Post.id == post_id).execution_options(**shard_options))
+    record_post_removed(session, post.thread_id)
+    return {"status": "deleted"}, 200
+
+@api.route('/api/posts', methods=['POST'])
+def create_post():
+    session = get_db()
+    data = request.get_json()
 
-    session.close()
-    return jsonify(result), 201
+    body, status = add_post(session, current_principal(session, data.get('author')), data['threadId'], data['text'])
+    if status < 400:
+        session.commit()
+    return jsonify(body), status
 
-@app.route('/api/posts/<int:post_id>', methods=['DELETE', 'OPTIONS'])
+@api.route('/api/posts/<int:post_id>', methods=['DELETE', 'OPTIONS'])
 def delete_post(post_id):
-    session = Session()
-    post = session.get(Post, post_id)
-
-    if not post:
-        session.close()
-        return jsonify({"error": "Post not found"}), 404
-
-    username = request.args.get("username")
-    if not post.author or post.author.username != username:
-        session.close()
-        return jsonify({"error": "Unauthorized"}), 403
-
-    session.delete(post)
-    session.commit()
-    session.close()
+    session = get_db()
 
-    return jsonify({"status": "deleted"})
+    body, status = remove_post(session, current_principal(session, request.args.get("username")), post_id)
+    if status < 400:
+        session.commit()
+    return jsonify(body), status
 
-@app.route('/api/posts/<int:post_id>/vote', methods=['PATCH'])
+@api.route('/api/posts/<int:post_id>/vote', methods=['PATCH'])
 def vote_on_post(post_id):
     return handle_vote(Post, post_id)
 
 
-@app.route('/api/users/<int:user_id>/completed-puzzles', methods=['GET'])
+@api.route('/api/users/<int:user_id>/completed-puzzles', methods=['GET'])
 def get_user_completed_puzzles(user_id):
     """
     Get all completed puzzles for a specific user
     """
-    try:
-        # Verify user exists
-        user = User.query.get(user_id)
-        if not user:
-            return jsonify({"error": "User not found"}), 404
-            
-        # Query completed puzzles for this user
-        completed_puzzles = CompletedPuzzle.query.filter_by(user_id=user_id).all()
-        
-        # Format the response
-        puzzle_ids = [cp.puzzle_id for cp in completed_puzzles]
-        
-        return jsonify({
-            "user_id": user_id,
-            "completed_puzzle_ids": puzzle_ids,
-            "count": len(puzzle_ids)
-        }), 200
-        
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-
-@app.route('/api/threads/<int:thread_id>/vote', methods=['PATCH'])
+    body, status = user_completed_puzzles(get_db(read_only=True), user_id)
+    return jsonify(body), status
+
+def user_completed_puzzles(session, user_id):
+    username = session.scalar(select(User.username).where(User.id == user_id))
+    if username is None:
+        return {"error": "User not found"}, 404
+
+    puzzle_ids = sorted(completed_puzzle_ids(session, username, user_id))
+    return {
+        "user_id": user_id,
+        "completed_puzzle_ids": puzzle_ids,
+        "count": len(puzzle_ids)
+    }, 200
+
+@api.route('/api/threads/<int:thread_id>/vote', methods=['PATCH'])
 def vote_on_thread(thread_id):
     return handle_vote(Thread, thread_id)
 
 
+VOTE_MODELS = {'thread': Thread, 'post': Post}
+
+def vote_delta(action):
+    """Map a vote action to (upvotes, downvotes) increments.
+
+    Anything else, including the null the client sends to take a vote back, is a no-op.
+    """
+    return {'upvote': (1, 0), 'downvote': (0, 1)}.get(action, (0, 0))
+
+def apply_votes(session, model_class, object_id, upvotes, downvotes):
+    """Add to an object's vote counts with one UPDATE evaluated by the database.
+
+    Unlike incrementing the loaded attribute, concurrent voters can't overwrite
+    each other's votes this way. The new totals are read back with RETURNING and
+    published as a vote-changed event when the transaction commits.
+    """
+    thread_id = Post.thread_id if model_class is Post else Thread.id
+    options = post_shards.for_post(object_id) if model_class is Post else {}
+    if options is None:
+        return
+    values = dict(
+        upvotes=func.coalesce(model_class.upvotes, 0) + upvotes,
+        downvotes=func.coalesce(model_class.downvotes, 0) + downvotes
+    )
+    if model_class is Thread:
+        values['hot_score'] = func.hot_score(values['upvotes'], values['downvotes'], Thread.post_count, Thread.created_at)
+        values['net_votes'] = values['upvotes'] - values['downvotes']
+    row = session.execute(
+        update(model_class)
+        .where(model_class.id == object_id)
+        .values(**values)
+        .returning(model_class.upvotes, model_class.downvotes, thread_id.label('thread_id'))
+        .execution_options(**options)
+    ).first()
+    if row is not None:
+        publish = publish_post_change if model_class is Post else publish_after_commit
+        publish(session, 'vote-changed', {
+            "type": 'post' if model_class is Post else 'thread',
+            "id": object_id,
+            "threadId": row.thread_id,
+            "upvotes": row.upvotes,
+            "downvotes": row.downvotes
+        })
+
+class VoteAggregator:
+    """Coalesces votes in memory and writes them out every `interval` seconds.
+
+    Each flush applies one UPDATE per voted object in a single transaction, so a
+    burst of votes on a hot thread costs one write lock instead of one per vote.
+    If that transaction fails for anything but a busy database, each object is
+    applied in a transaction of its own instead, so one bad object only holds
+    back its own votes; those are dropped after VOTE_FLUSH_MAX_ATTEMPTS tries.
+    """
+
+    def __init__(self, session_factory, interval):
+        self.session_factory = session_factory
+        self.interval = interval
+        self._pending = {}  # (model class, object id) -> [upvotes, downvotes]
+        self._failures = {}  # (model class, object id) -> flushes in a row its votes failed in
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def add(self, model_class, object_id, upvotes, downvotes):
+        with self._lock:
+            counts = self._pending.setdefault((model_class, object_id), [0, 0])
+            counts[0] += upvotes
+            counts[1] += downvotes
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="vote-flusher", daemon=True)
+                self._thread.start()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        try:
+            self._apply(pending)
+        except OperationalError:
+            # The database is locked or unavailable, so every vote waits for the next flush
+            self._requeue(pending)
+            raise
+        except Exception:
+            logger.warning("Failed to flush buffered votes, applying them one object at a time", exc_info=True)
+        else:
+            for key in pending.keys() & self._failures.keys():
+                del self._failures[key]
+            return
+        self._apply_each(pending)
+
+    def _apply_each(self, pending):
+        items = list(pending.items())
+        for index, (key, counts) in enumerate(items):
+            try:
+                self._apply({key: counts})
+            except OperationalError:
+                self._requeue(dict(items[index:]))
+                raise
+            except Exception:
+                model_class, object_id = key
+                attempts = self._failures.pop(key, 0) + 1
+                if attempts < VOTE_FLUSH_MAX_ATTEMPTS:
+                    self._failures[key] = attempts
+                    self._requeue({key: counts})
+                else:
+                    logger.exception(
+                        "Dropping votes %s on %s %s after %d failed flushes",
+                        counts, model_class.__name__, object_id, attempts
+                    )
+            else:
+                self._failures.pop(key, None)
+
+    def _apply(self, pending):
+        """Apply {(model class, object id): [upvotes, downvotes]} in one transaction."""
+        session = self.session_factory()
+        try:
+            for (model_class, object_id), (upvotes, downvotes) in pending.items():
+                apply_votes(session, model_class, object_id, upvotes, downvotes)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def _requeue(self, pending):
+        """Put votes back to be retried by the next flush."""
+        with self._lock:
+            for key, (upvotes, downvotes) in pending.items():
+                counts = self._pending.setdefault(key, [0, 0])
+                counts[0] += upvotes
+                counts[1] += downvotes
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to flush buffered votes")
+
+    def stop(self):
+        """Stop the background flusher and write out whatever is still buffered."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+# Set up by create_app() when VOTE_FLUSH_INTERVAL is set
+vote_aggregator = None
+
+def record_votes(session, model_class, deltas, buffered=True):
+    """Apply {object_id: (upvotes, downvotes)} to model_class and return the ids that exist.
+
+    Votes go straight to the database in the caller's transaction, or to the
+    aggregator when vote coalescing is enabled and buffered is true.
+    """
+    def existing(object_ids):
+        found = set()
+        # Posts are looked up in the shard their ids belong to
+        for options, ids in post_shards.split_ids(object_ids) if model_class is Post else [({}, list(object_ids))]:
+            query = select(model_class.id).where(model_class.id.in_(ids)).execution_options(**options)
+            if model_class is Post:
+                query = query.join(Thread, Post.thread_id == Thread.id)
+            # A deleted thread's posts are waiting to be purged with it
+            query = query.where(Thread.deleted_at.is_(None))
+            found.update(session.scalars(query))
+        return found
+
+    found = existing(deltas)
+    restored = set()
+    # A post of an archived thread is only in post_archive until the thread is restored
+    missing = deltas.keys() - found
+    if model_class is Post and missing and restore_archived_threads_of(session, missing):
+        restored = existing(missing)
+        found |= restored
+    for object_id in found:
+        upvotes, downvotes = deltas[object_id]
+        if not (upvotes or downvotes):
+            continue
+        # The aggregator can't update a restored post before the caller commits it
+        if vote_aggregator is not None and buffered and object_id not in restored:
+            vote_aggregator.add(model_class, object_id, upvotes, downvotes)
+        else:
+            apply_votes(session, model_class, object_id, upvotes, downvotes)
+    return found
+
+def cast_vote(session, model_class, object_id, action, buffered=True):
+    found = record_votes(session, model_class, {object_id: vote_delta(action)}, buffered)
+    if not found:
+        return {"error": "Object not found"}, 404
+    return {"status": "success"}, 200
+
 def handle_vote(model_class, object_id):
     data = request.get_json()
-    action = data.get("action")
 
-    session = Session()
-    obj = session.get(model_class, object_id)
+    session = get_db()
+    body, status = cast_vote(session, model_class, object_id, data.get("action"))
+    if status < 400:
+        session.commit()
+    return jsonify(body), status
+
+def cast_votes(session, data):
+    votes = data.get("votes") if isinstance(data, dict) else None
+    if not isinstance(votes, list):
+        return {"error": "Expected a list of votes"}, 400
+
+    deltas = {name: {} for name in VOTE_MODELS}
+    for vote in votes:
+        if not isinstance(vote, dict) or vote.get("type") not in VOTE_MODELS or not isinstance(vote.get("id"), int):
+            return {"error": f"Invalid vote: {vote!r}"}, 400
+        upvotes, downvotes = vote_delta(vote.get("action"))
+        counts = deltas[vote["type"]].get(vote["id"], (0, 0))
+        deltas[vote["type"]][vote["id"]] = (counts[0] + upvotes, counts[1] + downvotes)
+
+    found = {
+        name: record_votes(session, VOTE_MODELS[name], object_deltas) if object_deltas else set()
+        for name, object_deltas in deltas.items()
+    }
 
-    if obj is None:
-        session.close()
-        return jsonify({"error": "Object not found"}), 404
+    results = [
+        {
+            "type": vote["type"],
+            "id": vote["id"],
+            "status": "success" if vote["id"] in found[vote["type"]] else "not found"
+        } for vote in votes
+    ]
+    return {"status": "success", "results": results}, 200
 
-    if action == "upvote":
-        obj.upvotes += 1
-    elif action == "downvote":
-        obj.downvotes += 1
+@api.route('/api/votes', methods=['POST'])
+def batch_vote():
+    """
+    Apply many votes in one request, e.g.
+    {"votes": [{"type": "thread", "id": 1, "action": "upvote"}, ...]}
+    Votes on the same object are summed and written with a single UPDATE.
+    """
+    session = get_db()
+    body, status = cast_votes(session, request.get_json())
+    if status < 400:
+        session.commit()
+    return jsonify(body), status
 
-    session.commit()
-    session.close()
-    return jsonify({"status": "success"})
+
+def format_event(event_id, event_type, data):
+    return f"id: {event_id}\nevent: {event_type}\ndata: {dumps_json(data)}\n\n"
+
+EVENT_STREAM_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+def stream_start(last_event_id):
+    """The id an event stream starts after: the client's Last-Event-ID, or the newest event's.
+
+    Raises ValueError if last_event_id isn't an event id.
+    """
+    return int(last_event_id) if last_event_id else change_feed.last_id
+
+def next_events(last_id, thread_id=None):
+    """Return (messages, last_id): the server-sent events after last_id, and the id to follow on from.
+
+    Only the events for thread_id are sent if it's given. If the events the
+    client missed are no longer buffered it's sent a `reset` event instead,
+    telling it to reload in full before following the stream again. last_id
+    comes back unchanged when there's nothing new.
+    """
+    events, complete = change_feed.since(last_id)
+    if not complete:
+        last_id = events[-1][0] if events else change_feed.last_id
+        return [format_event(last_id, 'reset', {})], last_id
+    messages = []
+    for event_id, event_type, data in events:
+        last_id = event_id
+        if thread_id is None or data.get("threadId") == thread_id:
+            messages.append(format_event(event_id, event_type, data))
+    return messages, last_id
+
+def event_stream(last_id, thread_id=None):
+    """Yield the messages of next_events() as they come, with a keep-alive when it's quiet."""
+    while True:
+        messages, next_id = next_events(last_id, thread_id)
+        yield from messages
+        if next_id == last_id and not change_feed.wait(last_id, EVENT_STREAM_HEARTBEAT):
+            yield ': keep-alive\n\n'
+        last_id = next_id
+
+def event_stream_response(thread_id=None):
+    # EventSource sends Last-Event-ID itself when reconnecting; the query parameter
+    # lets a client resume from an id it remembered across page loads
+    try:
+        last_id = stream_start(request.headers.get('Last-Event-ID') or request.args.get('lastEventId'))
+    except ValueError:
+        return jsonify({"error": "Invalid Last-Event-ID"}), 400
+
+    return Response(event_stream(last_id, thread_id), mimetype='text/event-stream', headers=EVENT_STREAM_HEADERS)
+
+@api.route('/api/events')
+def thread_list_events():
+    """
+    Server-sent events for the whole forum: thread-created, thread-deleted,
+    post-created, post-deleted and vote-changed.
+    """
+    return event_stream_response()
+
+@api.route('/api/threads/<int:thread_id>/events')
+def thread_events(thread_id):
+    """
+    Server-sent events for the posts and votes of one thread.
+    """
+    return event_stream_response(thread_id)
 
 
 def populate_welcome_thread_comments():
-    session = Session()
+    session = db.session()
 
     # Only proceed if the thread already exists
     introductions_thread = session.query(Thread).filter_by(name="Introductions Thread").first()
@@ -369,19 +2745,15 @@ def populate_welcome_thread_comments():
         return
 
     # Add posts only if none exist
-    existing_posts = session.query(Post).filter_by(thread_id=introductions_thread.id).all()
-    if len(existing_posts) == 0:
-        post1 = Post(
-            text="Welcome to our puzzle community! Feel free to introduce yourself.",
-            author=user,
-            thread=introductions_thread
-        )
-        post2 = Post(
-            text="Hi everyone! Excited to solve puzzles with you all.",
-            author=user,
-            thread=introductions_thread
-        )
-        session.add_all([post1, post2])
+    existing_post = session.scalar(
+        select(Post.id).where(Post.thread_id == introductions_thread.id).limit(1)
+        .execution_options(**post_shards.for_thread(introductions_thread.id))
+    )
+    if existing_post is None:
+        insert_post(session, user, introductions_thread.id,
+                    "Welcome to our puzzle community! Feel free to introduce yourself.")
+        insert_post(session, user, introductions_thread.id,
+                    "Hi everyone! Excited to solve puzzles with you all.")
         session.commit()
         print("Added welcome posts to 'Introductions Thread'.")
     else:
@@ -390,195 +2762,798 @@ def populate_welcome_thread_comments():
     session.close()
 
 
-@app.route('/api/register', methods=['POST'])
+class HasherBusy(Exception):
+    """Raised when the password hashing queue is full."""
+
+@cache
+def hash_method_prefix(method):
+    """What generate_password_hash() puts before the salt for method: its name and parameters.
+
+    werkzeug fills in parameters left out of method, e.g. the iterations of pbkdf2:sha256.
+    """
+    return generate_password_hash('', method).split('$', 1)[0]
+
+class PasswordHasher:
+    """Hashes and checks passwords in a process pool instead of on request threads.
+
+    scrypt is deliberately slow, so a burst of logins hashed inline would hold up
+    every other request a worker is serving. At most `queue_limit` hashes may be
+    in flight; past that, callers get HasherBusy immediately rather than queueing.
+    A pool broken by a worker dying is replaced by a new one on the next submit.
+    """
+
+    def __init__(self, method='scrypt:32768:8:1', workers=0, queue_limit=1):
+        self.method = method
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(max(queue_limit, 1))
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.shutdown()
+        self.method = app.config['PASSWORD_HASH_METHOD']
+        self.workers = app.config['PASSWORD_HASH_WORKERS']
+        self._slots = threading.BoundedSemaphore(max(app.config['PASSWORD_HASH_QUEUE_LIMIT'], 1))
+
+    def submit(self, fn, *args):
+        """Start fn(*args) in the pool and return its Future, or raise HasherBusy.
+
+        The caller's slot is given back when the future completes.
+        """
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy()
+        try:
+            with self._lock:
+                if self._executor is None:
+                    # The pool starts once the app's background threads are running, and a
+                    # process forked from one of those could inherit a lock held mid-way
+                    methods = multiprocessing.get_all_start_methods()
+                    context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+                executor = self._executor
+            future = executor.submit(fn, *args)
+        except BrokenProcessPool:
+            self._slots.release()
+            self._discard(executor)
+            raise
+        except BaseException:
+            self._slots.release()
+            raise
+
+        def done(future):
+            self._slots.release()
+            if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+                self._discard(executor)
+        future.add_done_callback(done)
+        return future
+
+    def _discard(self, executor):
+        """Drop executor if it's still the pool, so the next submit starts a new one."""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, fn, *args):
+        if self.workers <= 0:
+            return fn(*args)
+        # A pool that broke under this call has been discarded, so one retry gets a new
+        # pool; if that breaks too, shed the request rather than fail it
+        for _ in range(2):
+            try:
+                return self.submit(fn, *args).result()
+            except BrokenProcessPool:
+                pass
+        raise HasherBusy()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def check(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        return password_hash.split('$', 1)[0] != hash_method_prefix(self.method)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+# Configured by create_app()
+password_hasher = PasswordHasher()
+atexit.register(password_hasher.shutdown)
+
+@api.app_errorhandler(HasherBusy)
+def hasher_busy(e):
+    return jsonify({'error': 'Server is busy, please try again shortly'}), 503, {'Retry-After': '1'}
+
+# Who a request is acting for, resolved from its token or username
+Principal = namedtuple('Principal', ['id', 'username', 'is_admin'])
+
+# username -> Principal for callers that don't send a token
+principal_cache = LRUCache(COMPLETION_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL)
+
+class AuthError(Exception):
+    """Raised when a request carries a bad or expired token, or none when one is required."""
+
+@api.app_errorhandler(AuthError)
+def auth_error(e):
+    return jsonify({'error': str(e) or 'Invalid or expired token'}), 401
+
+def issue_token(user):
+    now = int(time.time())
+    claims = {
+        'sub': str(user.id),
+        'name': user.username,
+        'adm': bool(user.is_admin),
+        'iat': now,
+        'exp': now + current_app.config['AUTH_TOKEN_TTL']
+    }
+    return jwt.encode(claims, current_app.config['SECRET_KEY'], algorithm='HS256')
+
+def token_principal(auth=None):
+    """Return the Principal from a bearer token, or None if there isn't one.
+
+    auth is an Authorization header, by default the current request's.
+    """
+    if auth is None:
+        auth = request.headers.get('Authorization', '')
+    if not auth.startswith('Bearer '):
+        return None
+    try:
+        claims = jwt.decode(auth[len('Bearer '):], current_app.config['SECRET_KEY'], algorithms=['HS256'])
+        return Principal(int(claims['sub']), claims['name'], claims['adm'])
+    except (jwt.InvalidTokenError, KeyError, ValueError):
+        raise AuthError()
+
+def fallible_token_principal(username=None, auth=None):
+    """token_principal(auth), or None if the token fails its check but username can stand in.
+
+    A bad token is only an error when there's no username to fall back to, or
+    tokens are required: it may simply have expired, or been signed by a worker
+    with a SECRET_KEY of its own.
+    """
+    try:
+        return token_principal(auth)
+    except AuthError:
+        if current_app.config['AUTH_REQUIRE_TOKEN'] or not username:
+            raise
+        return None
+
+def current_principal(session, username=None, auth=None):
+    """Identify the caller, or return None if there is no such user.
+
+    A valid bearer token identifies the caller without touching the database.
+    Otherwise fall back to the username the client sent, looked up once and then
+    served from principal_cache. auth is passed on to token_principal().
+    """
+    principal = fallible_token_principal(username, auth)
+    if principal is not None:
+        return principal
+
+    if current_app.config['AUTH_REQUIRE_TOKEN']:
+        raise AuthError('Authentication required')
+    if not username:
+        return None
+    principal = principal_cache.get(username)
+    if principal is None:
+        row = session.execute(
+            select(User.id, User.username, User.is_admin).where(User.username == username)
+        ).first()
+        if row is None:
+            return None
+        principal = Principal(row.id, row.username, bool(row.is_admin))
+        principal_cache.set(username, principal)
+    return principal
+
+@api.route('/api/register', methods=['POST'])
 def register():
     data = request.get_json()
-    session = Session()
-    if session.query(User).filter_by(username=data['username']).first():
-        session.close()
-        return jsonify({'error': 'Username already exists'}), 400
-
-    new_user = User(
-        username=data['username'],
-        email=data['email'],
-        password_hash= generate_password_hash(data['password']),
-        is_admin=False
-    )
-    session.add(new_user)
-    session.commit()
-    session.close()
-    return jsonify({'message': 'User created successfully'}), 201
+    session = get_db()
+    body, status = register_user(session, data['username'], data['email'], data['password'])
+    if status < 400:
+        session.commit()
+    return jsonify(body), status
 
-@app.route('/api/login', methods=['POST'])
+@api.route('/api/login', methods=['POST'])
 def login():
     data = request.get_json()
-    session = Session()
-    user = session.query(User).filter_by(username=data['username']).first()
-    session.close()
+    session = get_db()
+    body, status = log_in(session, data['username'], data['password'])
+    if status < 400:
+        session.commit()
+    return jsonify(body), status
+
+# register_user() and log_in() wait on password_hasher, so asgi.py runs them on a worker thread
+
+def register_user(session, username, email, password):
+    if session.query(User).filter_by(username=username).first():
+        return {'error': 'Username already exists'}, 400
 
-    if not user or not check_password_hash(user.password_hash, data['password']):
-        return jsonify({'error': 'Invalid credentials'}), 401
+    session.add(User(
+        username=username,
+        email=email,
+        password_hash=password_hasher.hash(password),
+        is_admin=False
+    ))
+    return {'message': 'User created successfully'}, 201
+
+def log_in(session, username, password):
+    user = session.query(User).filter_by(username=username).first()
+
+    if not user or not password_hasher.check(user.password_hash, password):
+        return {'error': 'Invalid credentials'}, 401
 
-    return jsonify({'username': user.username, 'email': user.email})
+    # Move the user onto the configured hash parameters while we have the password
+    if password_hasher.needs_rehash(user.password_hash):
+        try:
+            user.password_hash = password_hasher.hash(password)
+        except HasherBusy:
+            pass
+
+    return {'id': user.id, 'username': user.username, 'email': user.email, 'token': issue_token(user)}, 200
 
 # New endpoints for puzzles functionality
 
-@app.route('/api/puzzles', methods=['GET'])
-def get_puzzles():
-    session = Session()
-    
-    # Get the username from query params
-    username = request.args.get('username')
-    
-    # Get all puzzles
-    puzzles = session.query(Puzzle).all()
-    
-    result = []
-    if username:
-        # Get the user id
-        user = session.query(User).filter_by(username=username).first()
-        
-        if user:
-            # Get their completed puzzles
-            completed_puzzle_ids = [
-                cp.puzzle_id for cp in session.query(CompletedPuzzle).filter_by(user_id=user.id).all()
-            ]
-            
-            # Format result with completion status
-            for p in puzzles:
-                # Get any related thread for this puzzle
-                related_thread = session.query(Thread).filter_by(puzzle_id=p.id).first()
-                
-                puzzle_data = {
-                    "id": p.id,
-                    "name": p.name,
-                    "description": p.description,
-                    "completed": p.id in completed_puzzle_ids,
-                    "difficulty": p.difficulty
-                }
-                
-                # Add thread info if there is one
-                if related_thread:
-                    puzzle_data["threadId"] = related_thread.id
-                    puzzle_data["threadName"] = related_thread.name
-                result.append(puzzle_data)
-        else:
-            # If user not found, just return puzzles without completion status
-            for p in puzzles:
-                result.append({
-                    "id": p.id,
-                    "name": p.name,
-                    "description": p.description,
-                    "completed": False,
-                    "difficulty": p.difficulty
-                })
-    else:
-        # No username provided, return puzzles without completion status
+class PuzzleCatalog:
+    """Every puzzle with its discussion thread, loaded on first use and kept until invalidated.
+
+    Writers that change puzzles or puzzle threads call invalidate(); the next reader
+    reloads the whole catalog with two queries.
+    """
+
+    def __init__(self, session_factory):
+        self.session_factory = session_factory
+        self._entries = None  # (puzzle data, solution digests)
+        self._generation = 0
+        # Solutions are only kept as HMACs under this process's key, never in plain text
+        self._solution_key = secrets.token_bytes(32)
+        self._lock = threading.Lock()
+
+    def _snapshot(self):
+        entries = self._entries
+        if entries is None:
+            with self._lock:
+                if self._entries is None:
+                    generation = self._generation
+                    entries = self._load()
+                    # Don't keep a result that an invalidate() raced with
+                    if generation == self._generation:
+                        self._entries = entries
+                else:
+                    entries = self._entries
+        return entries
+
+    def get(self):
+        """Return an OrderedDict of puzzle id -> puzzle data. Callers must not modify it."""
+        return self._snapshot()[0]
+
+    def check_solution(self, puzzle_id, solution):
+        """Whether solution solves puzzle_id, checked without touching the database."""
+        digest = self._snapshot()[1].get(puzzle_id)
+        return digest is not None and hmac.compare_digest(digest, self._digest(solution))
+
+    def _digest(self, solution):
+        return hmac.new(self._solution_key, normalize_solution(solution).encode(), hashlib.sha256).digest()
+
+    def invalidate(self):
+        self._generation += 1
+        self._entries = None
+
+    def _load(self):
+        session = self.session_factory()
+        puzzles = session.execute(
+            select(Puzzle.id, Puzzle.name, Puzzle.description, Puzzle.clue_link, Puzzle.difficulty, Puzzle.solution_key)
+            .order_by(Puzzle.id)
+        ).all()
+        threads = session.execute(
+            select(Thread.puzzle_id, Thread.id, Thread.name)
+            .where(Thread.puzzle_id.isnot(None), Thread.deleted_at.is_(None))
+            .order_by(Thread.id)
+        ).all()
+        session.close()
+
+        entries = OrderedDict()
+        solutions = {}
         for p in puzzles:
-            result.append({
+            entries[p.id] = {
                 "id": p.id,
                 "name": p.name,
                 "description": p.description,
-                "completed": False,
+                "externalUrl": p.clue_link,
                 "difficulty": p.difficulty
-            })
-    
-    session.close()
-    return jsonify(result)
+            }
+            solutions[p.id] = self._digest(p.solution_key)
+        # A puzzle's discussion thread is the first one created for it
+        for t in threads:
+            entry = entries.get(t.puzzle_id)
+            if entry is not None and "threadId" not in entry:
+                entry["threadId"] = t.id
+                entry["threadName"] = t.name
+        return entries, solutions
+
+def normalize_solution(solution):
+    return (solution or '').strip().lower()
+
+puzzle_catalog = PuzzleCatalog(db.session)
+
+@broadcast
+def puzzles_changed():
+    """Call after committing a change to puzzles or their discussion threads."""
+    puzzle_catalog.invalidate()
+    resource_versions.bump('puzzles')
+
+# username -> frozenset of solved puzzle ids, dropped by attempt_puzzle_solution on a solve
+completion_cache = LRUCache(COMPLETION_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL)
+
+def completed_puzzle_ids(session, username, user_id=None):
+    """Return the ids of the puzzles a user has solved, or None if there is no such user.
+
+    Pass user_id when it's already known to save looking it up on a cache miss.
+    """
+    completed = completion_cache.get(username)
+    if completed is None:
+        if user_id is None:
+            user_id = session.scalar(select(User.id).where(User.username == username))
+        if user_id is None:
+            return None
+        completed = frozenset(session.scalars(
+            select(CompletedPuzzle.puzzle_id).where(CompletedPuzzle.user_id == user_id)
+        ))
+        completion_cache.set(username, completed)
+    return completed
+
+def has_unlocked(session, principal, puzzle_id):
+    """Whether the caller may see and post in threads gated behind puzzle_id."""
+    return principal.is_admin or puzzle_id in completed_puzzle_ids(session, principal.username, principal.id)
+
+def puzzle_summaries(completed):
+    """The puzzle listing, marking the ids in completed as solved."""
+    result = []
+    for puzzle_id, entry in puzzle_catalog.get().items():
+        puzzle_data = {
+            "id": entry["id"],
+            "name": entry["name"],
+            "description": entry["description"],
+            "completed": puzzle_id in completed,
+            "difficulty": entry["difficulty"]
+        }
+        if "threadId" in entry:
+            puzzle_data["threadId"] = entry["threadId"]
+            puzzle_data["threadName"] = entry["threadName"]
+        result.append(puzzle_data)
+    return result
+
+def caller_completions():
+    """The completions resource of whoever the request claims to be, for conditional()."""
+    username = request.args.get('username')
+    principal = fallible_token_principal(username)
+    username = principal.username if principal else username
+    return ['puzzles', f"completions:{username}"] if username else ['puzzles']
 
-@app.route('/api/puzzles/<int:puzzle_id>', methods=['GET'])
+@api.route('/api/puzzles', methods=['GET'])
+@conditional(caller_completions)
+def get_puzzles():
+    session = get_db(read_only=True)
+    user = current_principal(session, request.args.get('username'))
+    completed = completed_puzzle_ids(session, user.username, user.id) if user else frozenset()
+    return jsonify(puzzle_summaries(completed))
+
+def bootstrap(session, user, sort='oldest', limit=MAX_PAGE_SIZE):
+    """Everything the client loads at startup: the first page of threads, the puzzle
+    catalog and the caller's solved puzzles.
+
+    The threads are one range scan and the rest normally comes from puzzle_catalog
+    and completion_cache, so this is a few queries at most however big the forum is.
+    """
+    if sort not in THREAD_SORTS:
+        return {"error": f"Unknown sort '{sort}'"}, 400
+
+    rows = session.execute(thread_listing_query(sort, limit=limit)).all()
+    completed = completed_puzzle_ids(session, user.username, user.id) if user else frozenset()
+    return {
+        "threads": [thread_row_to_dict(row) for row in rows],
+        "nextCursor": thread_page_headers(rows, sort, limit).get('X-Next-Cursor'),
+        "puzzles": puzzle_summaries(completed),
+        "completedPuzzleIds": sorted(completed)
+    }, 200
+
+@api.route('/api/bootstrap', methods=['GET'])
+@conditional('threads', caller_completions)
+def get_bootstrap():
+    session = get_db(read_only=True)
+    user = current_principal(session, request.args.get('username'))
+    limit = clamp_limit(request.args.get('limit')) or MAX_PAGE_SIZE
+    body, status = bootstrap(session, user, request.args.get('sort', 'oldest'), limit)
+    return jsonify(body), status
+
+@api.route('/api/puzzles/<int:puzzle_id>', methods=['GET'])
+@conditional(lambda puzzle_id: caller_completions())
 def get_puzzle_detail(puzzle_id):
-    session = Session()
-    
-    # Get username from query params
-    username = request.args.get('username')
-    
-    # Get the puzzle
-    puzzle = session.get(Puzzle, puzzle_id)
-    
-    if not puzzle:
-        session.close()
-        return jsonify({"error": "Puzzle not found"}), 404
-    
-    # Get any related thread for this puzzle
-    related_thread = session.query(Thread).filter_by(puzzle_id=puzzle_id).first()
-    
-    # Build base response
-    result = {
-        "id": puzzle.id,
-        "name": puzzle.name,
-        "description": puzzle.description,
-        "externalUrl": puzzle.external_url,
-        "difficulty": puzzle.difficulty,
-        "completed": False
-    }
-    
-    # Add thread info if there is one
-    if related_thread:
-        result["threadId"] = related_thread.id
-        result["threadName"] = related_thread.name
-
-    # Check completion status if username provided
-    if username:
-        user = session.query(User).filter_by(username=username).first()
-        if user:
-            completed = session.query(CompletedPuzzle).filter_by(
-                user_id=user.id, puzzle_id=puzzle_id
-            ).first()
-            
-            result["completed"] = completed is not None
+    session = get_db(read_only=True)
+    body, status = puzzle_detail(session, current_principal(session, request.args.get('username')), puzzle_id)
+    return jsonify(body), status
+
+def puzzle_detail(session, user, puzzle_id):
+    entry = puzzle_catalog.get().get(puzzle_id)
+    if entry is None:
+        return {"error": "Puzzle not found"}, 404
+
+    result = dict(entry, completed=False)
+
+    # Check completion status if the caller is known
+    if user:
+        result["completed"] = puzzle_id in completed_puzzle_ids(session, user.username, user.id)
+
+    return result, 200
+
+@broadcast
+def completions_changed(username):
+    """Call after committing a new completion for username."""
+    completion_cache.pop(username)
+    resource_versions.bump(f"completions:{username}", 'leaderboard')
+
+@broadcast
+def reset_caches():
+    """Drop everything cached from the database, after changes too broad to track."""
+    puzzle_catalog.invalidate()
+    completion_cache.clear()
+    principal_cache.clear()
+    resource_versions.reset()
+
+class RateLimited(Exception):
+    """Raised when a caller has used up their budget, with the seconds until they may retry."""
+
+    def __init__(self, retry_after):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+
+@api.app_errorhandler(RateLimited)
+def rate_limited(e):
+    return jsonify({'error': 'Too many attempts, please slow down'}), 429, {'Retry-After': str(e.retry_after)}
+
+class TokenBucketLimiter:
+    """Per-key token buckets, held in memory.
+
+    Each key may take `burst` tokens at once, refilled at `rate` per second.
+    A key that has been idle long enough is back to a full bucket, the same as
+    an unknown one, so only the `maxsize` most recently used keys are kept.
+    """
+
+    def __init__(self, rate=0, burst=1, maxsize=ATTEMPT_LIMITER_SIZE):
+        self.rate = rate
+        self.burst = burst
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()  # key -> (tokens, time of last update)
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.rate = app.config['ATTEMPT_RATE']
+        self.burst = max(app.config['ATTEMPT_BURST'], 1)
+        with self._lock:
+            self._buckets.clear()
+
+    def acquire(self, *keys):
+        """Take a token from each key's bucket, or raise RateLimited and take none."""
+        if self.rate <= 0 or not keys:
+            return
+        now = time.monotonic()
+        with self._lock:
+            levels = []
+            for key in keys:
+                tokens, updated = self._buckets.get(key, (self.burst, now))
+                levels.append(min(self.burst, tokens + (now - updated) * self.rate))
+            shortfall = max(1 - tokens for tokens in levels)
+            if shortfall > 0:
+                raise RateLimited(math.ceil(shortfall / self.rate))
+            for key, tokens in zip(keys, levels):
+                self._buckets[key] = (tokens - 1, now)
+                self._buckets.move_to_end(key)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+
+# Configured by create_app()
+attempt_limiter = TokenBucketLimiter()
+
+def try_solution(session, user, puzzle_id, solution, address=None):
+    """Check a guess at a puzzle, charging it to the attempt budgets of the user and address.
+
+    Both budgets are charged together, or neither is. The puzzle, the caller's
+    identity and their completions all come from memory once cached, so a
+    wrong guess costs no queries.
+    """
+    keys = [f"addr:{address}"] if address is not None else []
+    if user:
+        keys.append(f"user:{user.id}")
+    attempt_limiter.acquire(*keys)
+
+    puzzle = puzzle_catalog.get().get(puzzle_id)
+    if puzzle is None:
+        return {"error": "Puzzle not found"}, 404
+
+    if not user:
+        return {"error": "User not found"}, 404
+
+    # Check if already completed
+    if puzzle_id in completed_puzzle_ids(session, user.username, user.id):
+        return {"success": True, "message": "You've already solved this puzzle!"}, 202
     
-    session.close()
-    return jsonify(result)
+    # Check solution
+    if puzzle_catalog.check_solution(puzzle_id, solution):
+        # Mark as completed, unless a concurrent attempt (or an earlier one in the same
+        # batch, which the cached completions don't know of yet) already has
+        inserted = session.execute(
+            sqlite_insert(CompletedPuzzle)
+            .values(user_id=user.id, puzzle_id=puzzle_id)
+            .on_conflict_do_nothing(index_elements=['user_id', 'puzzle_id'])
+        ).rowcount
+        if not inserted:
+            return {"success": True, "message": "You've already solved this puzzle!"}, 202
+        session.execute(
+            update(User)
+            .where(User.id == user.id)
+            .values(solved_count=User.solved_count + 1, score=User.score + (puzzle["difficulty"] or 0))
+            .execution_options(synchronize_session=False)
+        )
+        broadcast_after_commit(session, completions_changed, user.username)
+        return {"success": True, "message": "Correct! Puzzle solved successfully!"}, 200
+    else:
+        return {"success": False, "message": "Incorrect solution. Try again!"}, 201
 
-@app.route('/api/puzzles/<int:puzzle_id>/attempt', methods=['POST'])
+@api.route('/api/puzzles/<int:puzzle_id>/attempt', methods=['POST'])
 def attempt_puzzle_solution(puzzle_id):
-    session = Session()
+    session = get_db()
     data = request.get_json()
     
-    # Check if puzzle exists
-    puzzle = session.get(Puzzle, puzzle_id)
-    if not puzzle:
-        session.close()
-        return jsonify({"error": "Puzzle not found"}), 404
-    
-    # Get the user
-    username = data.get('username')
-    solution_attempt = data.get('solution', '').strip().lower()
-    
-    if not username:
-        session.close()
+    if not data.get('username') and 'Authorization' not in request.headers:
         return jsonify({"error": "Username is required"}), 400
     
-    user = session.query(User).filter_by(username=username).first()
-    if not user:
-        session.close()
-        return jsonify({"error": "User not found"}), 404
-    
-    # Check if already completed
-    already_completed = session.query(CompletedPuzzle).filter_by(user_id=user.id, puzzle_id=puzzle_id).first()
-    
-    if already_completed:
-        session.close()
-        return jsonify({"success": True, "message": "You've already solved this puzzle!"}), 202
-    
-    # Check solution
-    if solution_attempt == puzzle.solution_key.lower():
-        # Mark as completed
-        completion = CompletedPuzzle(
-            user_id=user.id,
-            puzzle_id=puzzle_id
-        )
-        session.add(completion)
+    user = current_principal(session, data.get('username'))
+    body, status = try_solution(session, user, puzzle_id, data.get('solution'), request.remote_addr)
+    if status < 400:
+        session.commit()
+    return jsonify(body), status
+
+LEADERBOARD_KEYS = (User.score, User.solved_count, User.id)
+
+def leaderboard_query(after=None, limit=LEADERBOARD_PAGE_SIZE):
+    """Users who have solved anything, best first: one range scan of ix_users_score_solved_count_id."""
+    query = select(User.username, *LEADERBOARD_KEYS).where(User.score > 0)
+    if after is not None:
+        query = query.where(tuple_(*LEADERBOARD_KEYS) < tuple_(*decode_cursor(after, LEADERBOARD_KEYS)))
+    return query.order_by(*(key.desc() for key in LEADERBOARD_KEYS)).limit(limit)
+
+def leaderboard_row_to_dict(row):
+    return {"username": row.username, "solved": row.solved_count, "score": row.score}
+
+def leaderboard_page_headers(rows, limit):
+    if len(rows) == limit:
+        last = rows[-1]
+        return {'X-Next-Cursor': encode_cursor([last.score, last.solved_count, last.id])}
+    return {}
+
+@api.route('/api/leaderboard', methods=['GET'])
+@conditional('leaderboard')
+def get_leaderboard():
+    """Users by total difficulty of the puzzles they've solved, then by how many."""
+    limit = parse_limit() or LEADERBOARD_PAGE_SIZE
+    try:
+        query = leaderboard_query(request.args.get('after'), limit)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    rows = get_db(read_only=True).execute(query).all()
+
+    response = jsonify([leaderboard_row_to_dict(row) for row in rows])
+    response.headers.update(leaderboard_page_headers(rows, limit))
+    return response
+
+# Operations accepted by /api/batch, each run with the arguments taken from the
+# operation object and the address the request came from. 'author' (or 'username')
+# identifies the user for that operation when the request doesn't carry a token.
+BATCH_OPERATIONS = {
+    'post.create': lambda session, user, op, address: add_post(session, user, op['threadId'], op['text']),
+    'post.delete': lambda session, user, op, address: remove_post(session, user, op['id']),
+    'vote': lambda session, user, op, address: cast_vote(
+        session, VOTE_MODELS[op['type']], op['id'], op.get('action'), buffered=False
+    ),
+    'puzzle.attempt': lambda session, user, op, address: try_solution(
+        session, user, op['puzzleId'], op.get('solution'), address
+    ),
+}
+
+@api.route('/api/batch', methods=['POST'])
+def batch():
+    """
+    Run several write operations in one transaction, e.g.
+    {"atomic": false, "operations": [
+        {"op": "post.create", "threadId": 1, "text": "...", "author": "alice"},
+        {"op": "vote", "type": "post", "id": 7, "action": "upvote"},
+        {"op": "post.delete", "id": 8, "author": "alice"},
+        {"op": "puzzle.attempt", "puzzleId": 2, "solution": "...", "author": "alice"}
+    ]}
+    Every operation gets a {"status", "body"} result matching what its own endpoint
+    would have returned. Failed operations are skipped, unless "atomic" is true, in
+    which case the first failure rolls back the whole batch.
+    """
+    body, status = run_batch(get_db(), request.get_json(), address=request.remote_addr)
+    return jsonify(body), status
+
+def run_batch(session, data, auth=None, address=None):
+    """Run the operations of a /api/batch request and commit or roll back the session.
+
+    address is where the request came from, which puzzle attempts are charged to
+    as on their own endpoint.
+    """
+    operations = data.get("operations") if isinstance(data, dict) else None
+    if not isinstance(operations, list) or not operations:
+        return {"error": "Expected a list of operations"}, 400
+    if len(operations) > MAX_BATCH_SIZE:
+        return {"error": f"At most {MAX_BATCH_SIZE} operations per batch"}, 400
+    atomic = bool(data.get("atomic"))
+
+    results = []
+    failed = False
+    for op in operations:
+        if failed and atomic:
+            results.append({"status": 424, "body": {"error": "Not run, an earlier operation failed"}})
+            continue
+        handler = BATCH_OPERATIONS.get(op.get("op")) if isinstance(op, dict) else None
+        if handler is None:
+            body, status = {"error": f"Unknown operation: {op!r}"}, 400
+        else:
+            try:
+                user = current_principal(session, op.get("author") or op.get("username"), auth)
+                body, status = handler(session, user, op, address)
+            except (KeyError, TypeError):
+                body, status = {"error": f"Invalid operation: {op!r}"}, 400
+            except RateLimited as e:
+                body, status = {"error": "Too many attempts, please slow down", "retryAfter": e.retry_after}, 429
+        failed = failed or status >= 400
+        results.append({"status": status, "body": body})
+
+    committed = not (failed and atomic)
+    if committed:
         session.commit()
-        session.close()
-        return jsonify({"success": True, "message": "Correct! Puzzle solved successfully!"}), 200
     else:
-        session.close()
-        return jsonify({"success": False, "message": "Incorrect solution. Try again!"}), 201
+        session.rollback()
+    return {"committed": committed, "results": results}, 200
+
+# snippet() wraps matches in these, and search() swaps them for <mark> tags once
+# the surrounding post text has been escaped
+MATCH_START, MATCH_END = '\x02', '\x03'
+
+THREAD_SEARCH_SQL = f"""
+    SELECT 'thread' AS kind, t.id AS thread_id, NULL AS post_id, t.name AS thread_name,
+           snippet(thread_search, -1, '{MATCH_START}', '{MATCH_END}', '...', 16) AS snippet,
+           bm25(thread_search, 2.0, 1.0) AS rank, 0 AS archived
+    FROM thread_search JOIN threads t ON t.id = thread_search.rowid
+    WHERE thread_search MATCH :query AND t.deleted_at IS NULL
+      AND (:see_all OR t.puzzle_id IS NULL OR t.puzzle_id IN :unlocked)
+"""
+# One of these per post_search table, {schema} being its schema prefix
+POST_SEARCH_SQL = f"""
+    SELECT 'post', p.thread_id, p.id, t.name,
+           snippet(post_search, 0, '{MATCH_START}', '{MATCH_END}', '...', 16),
+           bm25(post_search), 0
+    FROM {{schema}}post_search
+    JOIN {{schema}}posts p ON p.id = post_search.rowid
+    JOIN threads t ON t.id = p.thread_id
+    WHERE post_search MATCH :query AND t.deleted_at IS NULL
+      AND (:see_all OR t.puzzle_id IS NULL OR t.puzzle_id IN :unlocked)
+"""
+# The index keeps no text to take a snippet from, so search_results() makes those
+ARCHIVED_POST_SEARCH_SQL = """
+    SELECT 'post', a.thread_id, a.post_id, t.name, NULL, bm25(archived_post_search), 1
+    FROM archived_post_search
+    JOIN archived_post_threads a ON a.post_id = archived_post_search.rowid
+    JOIN threads t ON t.id = a.thread_id
+    WHERE archived_post_search MATCH :query AND t.deleted_at IS NULL
+      AND (:see_all OR t.puzzle_id IS NULL OR t.puzzle_id IN :unlocked)
+"""
+
+@cache
+def search_query(schemas):
+    """The search over threads, archived posts and the posts in each of schemas, ranked together."""
+    arms = [THREAD_SEARCH_SQL] + [POST_SEARCH_SQL.format(schema=schema) for schema in schemas]
+    arms.append(ARCHIVED_POST_SEARCH_SQL)
+    return text(
+        "UNION ALL".join(arms) + "ORDER BY rank\nLIMIT :limit OFFSET :offset"
+    ).bindparams(bindparam('unlocked', expanding=True))
+
+def fts_query(q):
+    """Turn free text into an FTS5 query that matches all of its words, the last one as a prefix.
+
+    Each word is quoted so user input can never be parsed as FTS5 syntax.
+    """
+    terms = ['"' + term.replace('"', '""') + '"' for term in q.split()]
+    if terms:
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+def query_terms(query):
+    """The words of an fts_query() string, lowercased."""
+    return [term.replace('""', '"').lower() for term in re.findall(r'"((?:[^"]|"")*)"', query)]
+
+def archived_snippet(text, terms, size=16):
+    """Roughly what snippet() gives, for the text of an archived post.
+
+    Words starting with one of terms are marked, and the window of size words
+    starts just before the first of them.
+    """
+    words = list(re.finditer(r'\w+', text))
+    marked = [any(word.group().lower().startswith(term) for term in terms) for word in words]
+    first = marked.index(True) if True in marked else 0
+    start = max(first - 2, 0)
+    end = min(start + size, len(words))
+    parts = ['...' if start > 0 else '']
+    position = words[start].start() if words else 0
+    for word, is_match in zip(words[start:end], marked[start:end]):
+        parts.append(text[position:word.start()])
+        parts.append(MATCH_START + word.group() + MATCH_END if is_match else word.group())
+        position = word.end()
+    parts.append('...' if end < len(words) else text[position:])
+    return ''.join(parts)
+
+def highlight(snippet):
+    return html.escape(snippet or '').replace(MATCH_START, '<mark>').replace(MATCH_END, '</mark>')
+
+@api.route('/api/search', methods=['GET'])
+def search():
+    """
+    Ranked full-text search over thread names, descriptions and posts.
+    Threads behind a puzzle the caller (?username=) hasn't solved are left out.
+    """
+    if not db.search_enabled:
+        return jsonify({"error": "Search is not available"}), 501
+
+    query = fts_query(request.args.get('q', ''))
+    if not query:
+        return jsonify({"error": "Missing search query"}), 400
+    limit = parse_limit() or SEARCH_PAGE_SIZE
+    offset = max(request.args.get('offset', 0, type=int), 0)
+
+    session = get_db(read_only=True)
+    user = current_principal(session, request.args.get('username'))
+    return jsonify(search_results(session, user, query, limit, offset))
+
+def search_results(session, user, query, limit, offset):
+    """Run search_query() for an fts_query() string as user (None for anonymous)."""
+    see_all = False
+    unlocked = frozenset()
+    if user:
+        see_all = user.is_admin
+        unlocked = completed_puzzle_ids(session, user.username, user.id)
+
+    rows = session.execute(search_query(tuple(post_search_schemas())), {
+        "query": query,
+        "see_all": see_all,
+        # An empty IN () list renders as a subquery that matches nothing
+        "unlocked": list(unlocked),
+        "limit": limit,
+        "offset": offset
+    }).all()
+
+    terms = query_terms(query)
+    results = []
+    for row in rows:
+        snippet = row.snippet
+        if row.archived:
+            posts = archived_posts(session, row.thread_id) or ()
+            texts = [post.text for post in posts if post.id == row.post_id]
+            snippet = archived_snippet(texts[0], terms) if texts else ''
+        results.append({
+            "kind": row.kind,
+            "threadId": row.thread_id,
+            "threadName": row.thread_name,
+            "postId": row.post_id,
+            "snippet": highlight(snippet)
+        })
+    return results
 
 def create_admin_user():
-    session = Session()
+    session = db.session()
     existing_admin = session.query(User).filter_by(username='admin').first()
     if not existing_admin:
         admin = User(
@@ -595,7 +3570,7 @@ def create_admin_user():
     session.close()
 
 def create_sample_puzzles():
-    session = Session()
+    session = db.session()
     
     # Check if we already have puzzles
     existing_puzzles = session.query(Puzzle).count()
@@ -630,8 +3605,7 @@ def create_sample_puzzles():
     ]
     
     session.add_all(puzzles)
-    session.commit()
-    print("[INFO] Sample puzzles created.")
+    session.flush()
     
     # Create a thread for the first puzzle
     admin = session.query(User).filter_by(username='admin').first()
@@ -639,54 +3613,268 @@ def create_sample_puzzles():
         puzzle_thread = Thread(
             name="Caesar Cipher Discussion",
             description="Share hints and discuss the Caesar's Secret puzzle",
-            puzzle_id=1,
+            puzzle_id=puzzles[0].id,
             creator=admin
         )
         session.add(puzzle_thread)
-        session.commit()
+        session.flush()
         
         # Add a welcome post to the thread
-        welcome_post = Post(
-            text="Welcome to the Caesar Cipher discussion thread! Here you can share hints (but not the solution!) and ask questions about the puzzle.",
-            user_id=admin.id,
-            thread_id=puzzle_thread.id
+        insert_post(
+            session, admin, puzzle_thread.id,
+            "Welcome to the Caesar Cipher discussion thread! Here you can share hints (but not the solution!) and ask questions about the puzzle."
         )
-        session.add(welcome_post)
-        session.commit()
-        print("[INFO] Created puzzle discussion thread.")
-        
-    session.close()
-    
-    # Create a thread for the first puzzle
-    admin = session.query(User).filter_by(username='admin').first()
+
+    # Puzzles, thread and post go in together, so a failed run leaves nothing half-seeded
+    broadcast_after_commit(session, puzzles_changed)
+    session.commit()
+    print("[INFO] Sample puzzles created.")
     if admin:
-        puzzle_thread = Thread(
-            name="Caesar Cipher Discussion",
-            description="Share hints and discuss the Caesar's Secret puzzle",
-            puzzle_id=1,
-            creator=admin
-        )
-        session.add(puzzle_thread)
-        session.commit()
-        
-        # Add a welcome post to the thread
-        welcome_post = Post(
-            text="Welcome to the Caesar Cipher discussion thread! Here you can share hints (but not the solution!) and ask questions about the puzzle.",
-            user_id=admin.id,
-            thread_id=puzzle_thread.id
-        )
-        session.add(welcome_post)
-        session.commit()
         print("[INFO] Created puzzle discussion thread.")
-        
     session.close()
 
-if __name__ == '__main__':
+def seed_database():
+    """Add the admin user, sample puzzles and welcome posts. Safe to run repeatedly."""
     create_admin_user()
     create_sample_puzzles()
     populate_welcome_thread_comments()
-    app.run(debug=True, port=5000)
 
-create_admin_user()
-create_sample_puzzles()
-populate_welcome_thread_comments()
\ No newline at end of file
+@api.cli.command('seed')
+def seed_command():
+    """Create the tables and add the sample data the forum starts with."""
+    seed_database()
+    click.echo("Database seeded.")
+
+@api.cli.command('reconcile-thread-stats')
+def reconcile_thread_stats_command():
+    """Recompute every thread's post count, last post, snippet and hot score from its posts."""
+    reconcile_thread_stats(db.engine)
+    click.echo("Thread statistics reconciled.")
+
+@api.cli.command('archive-posts')
+@click.option('--idle-days', type=int, help='Archive threads without a post for this many days [default: ARCHIVE_AFTER_DAYS].')
+@click.option('--max-posts', default=ARCHIVE_MAX_POSTS, show_default=True, help='Leave threads with more posts than this.')
+def archive_posts_command(idle_days, max_posts):
+    """Move the posts of quiet threads into compressed per-thread blocks."""
+    if idle_days is None:
+        idle_days = current_app.config['ARCHIVE_AFTER_DAYS']
+    try:
+        archived = archive_threads(
+            db.session, idle_days, max_posts, lambda thread_id, count: click.echo(f"thread {thread_id}: {count} posts", err=True)
+        )
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Archived {archived} threads.")
+
+@api.cli.command('reconcile-user-scores')
+def reconcile_user_scores_command():
+    """Recompute every user's leaderboard standing from their completed puzzles."""
+    reconcile_user_scores(db.engine)
+    click.echo("User scores reconciled.")
+
+# Tables in dump files, parents before children so a dump loads in order
+DUMP_TABLES = {table.name: table for table in (
+    User.__table__, Puzzle.__table__, Thread.__table__, Post.__table__, CompletedPuzzle.__table__
+)}
+DUMP_BATCH_SIZE = 5000
+
+def open_dump(path, mode):
+    """Open an NDJSON dump for text I/O: '-' is stdin/stdout, and *.gz is gzipped."""
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return click.open_file(path, mode, encoding='utf-8')
+
+def loads_json(line):
+    return orjson.loads(line) if orjson is not None else json.loads(line)
+
+def export_rows(engine, out, batch_size=DUMP_BATCH_SIZE, progress=None):
+    """Write every row of DUMP_TABLES to out, one {"table", "row"} object per line.
+
+    Rows are read batch_size at a time, so memory stays flat however big the
+    tables are. Everything is read in one transaction, so a dump of a live
+    database is a consistent snapshot of each of its files. progress(table,
+    count) is called after each batch. Returns the number of rows written per
+    table.
+    """
+    counts = {}
+    with engine.connect() as conn, conn.begin():
+        for name, table in DUMP_TABLES.items():
+            dates = [column.name for column in table.columns if isinstance(column.type, DateTime)]
+            counts[name] = 0
+            # Posts are read from each shard in turn
+            for options in post_shards.every() if table is Post.__table__ else [{}]:
+                result = conn.execution_options(yield_per=batch_size).execute(
+                    select(table).order_by(table.c.id).execution_options(**options)
+                )
+                for rows in result.mappings().partitions():
+                    lines = []
+                    for row in rows:
+                        row = dict(row)
+                        for key in dates:
+                            if row[key] is not None:
+                                row[key] = row[key].isoformat()
+                        lines.append(dumps_json({"table": name, "row": row}))
+                    out.write('\n'.join(lines) + '\n')
+                    counts[name] += len(rows)
+                    if progress:
+                        progress(name, counts[name])
+            if table is Post.__table__:
+                counts[name] += export_archived_posts(conn, out)
+                if progress:
+                    progress(name, counts[name])
+    return counts
+
+def export_archived_posts(conn, out):
+    """Write archived posts to out as ordinary posts rows, one thread at a time."""
+    count = 0
+    result = conn.execution_options(yield_per=1).execute(
+        select(PostArchive.thread_id, PostArchive.block).order_by(PostArchive.thread_id)
+    )
+    for thread_id, block in result:
+        posts = decode_archive(block)
+        out.write('\n'.join(dumps_json({"table": "posts", "row": {
+            "id": post.id, "text": post.text, "timestamp": post.timestamp.isoformat(), "user_id": post.user_id,
+            "thread_id": thread_id, "upvotes": post.upvotes, "downvotes": post.downvotes
+        }}) for post in posts) + '\n')
+        count += len(posts)
+    return count
+
+def import_rows(engine, lines, batch_size=DUMP_BATCH_SIZE, progress=None):
+    """Insert the rows of an export_rows() dump, batch_size rows per executemany.
+
+    Each batch is committed on its own, so a failed import keeps the batches
+    before it. Rows keep their ids, so the target tables should be empty. The
+    exception is posts when they're partitioned: each shard numbers its own, so
+    they're given new ids by the shard they go to (nothing refers to post ids).
+    progress(table, count) is called after each batch. Returns the number of
+    rows inserted per table.
+    """
+    counts = {}
+    batch, batch_table = [], None
+
+    def flush():
+        with engine.begin() as conn:
+            # Posts go to the shard of their thread
+            for options, rows in post_shards.split(batch) if batch_table == 'posts' else [({}, batch)]:
+                conn.execute(insert(DUMP_TABLES[batch_table]).execution_options(**options), rows)
+        counts[batch_table] = counts.get(batch_table, 0) + len(batch)
+        if progress:
+            progress(batch_table, counts[batch_table])
+
+    dates = {
+        name: [column.name for column in table.columns if isinstance(column.type, DateTime)]
+        for name, table in DUMP_TABLES.items()
+    }
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            entry = loads_json(line)
+            name, row = entry["table"], entry["row"]
+            if name not in DUMP_TABLES:
+                raise ValueError(f"unknown table '{name}'")
+            for key in dates[name]:
+                if row.get(key) is not None:
+                    row[key] = datetime.fromisoformat(row[key])
+        except (ValueError, TypeError, KeyError) as e:
+            raise ValueError(f"line {number}: {e}") from e
+
+        if name == 'posts' and post_shards.enabled:
+            row.pop('id', None)
+        if name != batch_table or len(batch) >= batch_size:
+            if batch:
+                flush()
+            batch, batch_table = [], name
+        batch.append(row)
+    if batch:
+        flush()
+    return counts
+
+def report_progress(table, count):
+    click.echo(f"{table}: {count} rows", err=True)
+
+@api.cli.command('export-data')
+@click.argument('path', default='-')
+@click.option('--batch-size', default=DUMP_BATCH_SIZE, show_default=True, help='Rows read per query batch.')
+def export_data_command(path, batch_size):
+    """Write users, puzzles, threads, posts and completions to PATH as NDJSON.
+
+    PATH may be '-' for stdout, and is gzipped if it ends in .gz. Safe to run
+    against a live database.
+    """
+    with open_dump(path, 'w') as out:
+        counts = export_rows(db.engine, out, batch_size, report_progress)
+    click.echo(f"Exported {sum(counts.values())} rows.", err=True)
+
+@api.cli.command('import-data')
+@click.argument('path', default='-')
+@click.option('--batch-size', default=DUMP_BATCH_SIZE, show_default=True, help='Rows inserted per transaction.')
+def import_data_command(path, batch_size):
+    """Load an export-data dump from PATH into an empty database."""
+    try:
+        with open_dump(path, 'r') as lines:
+            counts = import_rows(db.engine, lines, batch_size, report_progress)
+    except ValueError as e:
+        raise click.ClickException(f"Invalid dump: {e}")
+    except IntegrityError as e:
+        raise click.ClickException(f"Rows conflict with existing data: {e.orig}")
+    finally:
+        # Even a failed import may have committed some batches, so have running
+        # workers drop whatever they cached from before it
+        session = db.session()
+        broadcast_after_commit(session, reset_caches)
+        session.commit()
+        session.close()
+    click.echo(f"Imported {sum(counts.values())} rows.", err=True)
+
+def create_app(config=None):
+    """Create the forum app, with config overriding default_config().
+
+    This doesn't touch the database: the engine is created, and the schema
+    checked, by the first request or command that needs it. Sample data is added
+    by `flask --app App seed`. The database, caches and background workers are
+    shared by the process, so each call rebinds them to the new app's config,
+    after writing out what the previous app's workers still had queued.
+    """
+    global vote_aggregator, thread_activity
+
+    # Buffered writes belong to the database they were made on
+    stop_background_writers()
+    app = Flask(__name__)
+    app.json = FastJSONProvider(app)
+    app.config.from_mapping(default_config())
+    if config:
+        app.config.from_mapping(config)
+    CORS(app, origins=["http://localhost:3000"], expose_headers=["X-Next-Cursor", "X-Prev-Cursor"])
+
+    app.register_blueprint(api)
+    app.teardown_appcontext(close_db)
+    db.init_app(app)
+    post_shards.init_app(app)
+    password_hasher.init_app(app)
+    attempt_limiter.init_app(app)
+    # Nothing cached from the previous app's database carries over
+    reset_caches()
+    archive_cache.clear()
+    if app.config['VOTE_FLUSH_INTERVAL'] > 0:
+        vote_aggregator = VoteAggregator(db.session, app.config['VOTE_FLUSH_INTERVAL'])
+    if post_shards.enabled:
+        thread_activity = ThreadActivity(db.session, app.config['THREAD_STATS_FLUSH_INTERVAL'])
+    return app
+
+def stop_background_writers():
+    """Stop the vote and thread activity writers, writing out whatever they hold."""
+    global vote_aggregator, thread_activity
+    for writer in (vote_aggregator, thread_activity):
+        if writer is not None:
+            writer.stop()
+    vote_aggregator = thread_activity = None
+
+atexit.register(stop_background_writers)
+
+# `flask --app App run` finds create_app() itself; WSGI servers can load 'App:create_app()'
+if __name__ == '__main__':
+    app = create_app()
+    with app.app_context():
+        seed_database()
+    app.run(debug=True, port=5000)
@@ -0,0 +1,556 @@
+"""
+Async serving mode for the forum API.
+
+    uvicorn asgi:app --port 5000
+
+Serves the same endpoints and JSON as App.py on an ASGI server, with the database
+reached through SQLAlchemy's async engine (aiosqlite). Request handlers never
+block the event loop waiting on SQLite or on password hashing, and an open event
+stream costs a coroutine instead of a worker thread, so one process can hold
+thousands of connections.
+
+The write logic is shared with App.py: its services take a plain Session, and run
+here through AsyncSession.run_sync, which drives them on the async connection.
+Registering and logging in wait on password hashing instead, so those run on a
+worker thread with a session of App's engine.
+Every request runs inside the Flask app's context, so they see its config. The
+schema is checked through App's engine at startup, so DATABASE_URI must name a
+database file both engines can open.
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from functools import wraps
+
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import MutableHeaders
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Match, Route
+from werkzeug.http import quote_etag, unquote_etag
+
+import App
+from App import (
+    EVENT_STREAM_HEADERS, EVENT_STREAM_HEARTBEAT, LEADERBOARD_PAGE_SIZE, MAX_PAGE_SIZE, METRICS_MIMETYPE,
+    POST_STREAM_MIMETYPES, SEARCH_PAGE_SIZE, STREAM_BATCH_SIZE, THREAD_SORTS, AuthError, HasherBusy, Post,
+    PostEncoder, RateLimited, RequestStats, Thread, add_post, add_thread, archived_page, bootstrap, cast_vote,
+    cast_votes, change_feed, check_conditional, clamp_limit, completed_puzzle_ids, configure_sqlite,
+    current_principal, engine_args, fallible_token_principal, format_posts, fts_query, in_display_order,
+    is_memory_db, leaderboard_page_headers, leaderboard_query, leaderboard_row_to_dict, log_in, metrics,
+    next_events, post_listing_query, post_page, post_page_headers, post_row_to_dict, post_stream_format,
+    puzzle_detail, puzzle_summaries, register_user, remove_post, remove_thread, resource_names, run_batch,
+    search_results, serving_request, stream_start, thread_listing_query, thread_page_headers,
+    thread_row_to_dict, try_solution, user_completed_puzzles
+)
+
+flask_app = App.create_app()
+config = flask_app.config
+
+def init_async_db(db_uri, config, read_only=False):
+    """Create an aiosqlite engine for db_uri with the same pool and SQLite settings as init_db()."""
+    url, options = engine_args(db_uri, config, read_only)
+    engine = create_async_engine(url.set(drivername='sqlite+aiosqlite'), **options)
+    configure_sqlite(engine.sync_engine, config, read_only)
+    return engine
+
+engine = init_async_db(config['DATABASE_URI'], config)
+# Rows are turned into dicts before committing, but keep attributes loaded anyway:
+# a lazy load after commit would need IO the async session can't do implicitly
+Session = async_sessionmaker(engine, expire_on_commit=False)
+
+ReadSession = Session
+if config['DATABASE_READ_ONLY_POOL'] and not is_memory_db(config['DATABASE_URI']):
+    ReadSession = async_sessionmaker(init_async_db(config['DATABASE_URI'], config, read_only=True))
+
+class BadRequest(Exception):
+    """Raised for a request whose body can't be used, answered with a 400."""
+
+async def get_json(request):
+    """The JSON object in the request body, or raise BadRequest."""
+    try:
+        data = await request.json()
+    except ValueError:
+        raise BadRequest("Request body must be JSON")
+    if not isinstance(data, dict):
+        raise BadRequest("Request body must be a JSON object")
+    return data
+
+def int_arg(request, name, default=None):
+    try:
+        return int(request.query_params[name])
+    except (KeyError, ValueError):
+        return default
+
+def client_address(request):
+    """The caller's address, as Flask's request.remote_addr gives it."""
+    return request.client.host if request.client else None
+
+def as_caller(service, request, username):
+    """Wrap an App.py service so it's called with the principal behind the request."""
+    auth = request.headers.get('Authorization', '')
+
+    def run(session, *args):
+        return service(session, current_principal(session, username, auth), *args)
+    return run
+
+async def write(fn, *args):
+    """Run fn(session, *args) -> (body, status) in a new transaction, committing unless it failed."""
+    async with Session() as session:
+        body, status = await session.run_sync(fn, *args)
+        if status < 400:
+            await session.commit()
+    return JSONResponse(body, status)
+
+async def write_in_thread(fn, *args):
+    """Like write(), for services that block on password hashing: they run on a worker
+    thread with a session of App's engine, so the loop carries on meanwhile."""
+    def run():
+        with App.db.session() as session:
+            body, status = fn(session, *args)
+            if status < 400:
+                session.commit()
+            return body, status
+    body, status = await run_in_threadpool(run)
+    return JSONResponse(body, status)
+
+async def read(fn, *args):
+    """Run fn(session, *args) -> (body, status) on the read-only pool."""
+    async with ReadSession() as session:
+        body, status = await session.run_sync(fn, *args)
+    return JSONResponse(body, status)
+
+def conditional(*resources):
+    """The counterpart of App.conditional() for these handlers.
+
+    Callable resources are given the request instead of the view's arguments.
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request):
+            headers, not_modified = check_conditional(
+                resource_names(resources, request), request.url.path, request.scope['query_string'],
+                request.headers.get('Authorization'),
+                request.headers.get('If-None-Match'), request.headers.get('If-Modified-Since')
+            )
+            if not_modified:
+                response = Response(status_code=304)
+            else:
+                response = await view(request)
+                if response.status_code != 200:
+                    return response
+            response.headers.update(headers)
+            return response
+        return wrapper
+    return decorator
+
+def caller_completions(request):
+    username = request.query_params.get('username')
+    principal = fallible_token_principal(username, request.headers.get('Authorization', ''))
+    username = principal.username if principal else username
+    return ['puzzles', f"completions:{username}"] if username else ['puzzles']
+
+async def base(request):
+    return PlainTextResponse('Hello world. This is the base page for cse108 final project!')
+
+# Threads
+
+@conditional('threads')
+async def get_threads(request):
+    sort = request.query_params.get('sort', 'oldest')
+    if sort not in THREAD_SORTS:
+        return JSONResponse({"error": f"Unknown sort '{sort}'"}, 400)
+    limit = clamp_limit(request.query_params.get('limit'))
+
+    try:
+        query = thread_listing_query(sort, request.query_params.get('after'), limit)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, 400)
+    async with ReadSession() as session:
+        rows = (await session.execute(query)).all()
+
+    return JSONResponse([thread_row_to_dict(row) for row in rows], headers=thread_page_headers(rows, sort, limit))
+
+async def create_thread(request):
+    data = await get_json(request)
+    return await write(
+        as_caller(add_thread, request, data.get("author")),
+        data['name'], data['description'], data.get('requiredPuzzleId')
+    )
+
+async def delete_thread(request):
+    thread_id = request.path_params['thread_id']
+    return await write(as_caller(remove_thread, request, request.query_params.get("username")), thread_id)
+
+async def vote_on_thread(request):
+    data = await get_json(request)
+    return await write(cast_vote, Thread, request.path_params['thread_id'], data.get("action"))
+
+# Posts
+
+async def stream_posts(query, fmt):
+    """The async counterpart of App.stream_posts(), with a session of its own."""
+    encoder = PostEncoder(fmt)
+    async with ReadSession() as session:
+        rows = await session.stream(query.execution_options(yield_per=STREAM_BATCH_SIZE))
+        async for row in rows:
+            yield encoder.encode(row)
+    end = encoder.end()
+    if end:
+        yield end
+
+@conditional(lambda request: f"posts:{int_arg(request, 'threadId')}")
+async def get_posts(request):
+    thread_id = int_arg(request, 'threadId')
+    after = request.query_params.get('after')
+    before = request.query_params.get('before')
+    if after is not None and before is not None:
+        return JSONResponse({"error": "Use either 'after' or 'before', not both"}, 400)
+    limit = clamp_limit(request.query_params.get('limit'))
+
+    try:
+        stream = post_stream_format(request.query_params.get('stream'), request.headers.get('Accept'))
+        query = post_listing_query(thread_id, after, before, limit)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, 400)
+
+    if stream is not None:
+        media_type = POST_STREAM_MIMETYPES[stream]
+        async with ReadSession() as session:
+            archived = await session.run_sync(archived_page, thread_id, after, before, limit)
+        if archived is not None:
+            if before is not None:
+                archived.reverse()
+            return StreamingResponse(format_posts(archived, stream), media_type=media_type)
+        return StreamingResponse(stream_posts(in_display_order(query, before), stream), media_type=media_type)
+
+    async with ReadSession() as session:
+        rows = await session.run_sync(post_page, query, thread_id, after, before, limit)
+
+    return JSONResponse([post_row_to_dict(row) for row in rows], headers=post_page_headers(rows, limit, after, before))
+
+async def create_post(request):
+    data = await get_json(request)
+    return await write(as_caller(add_post, request, data.get('author')), data['threadId'], data['text'])
+
+async def delete_post(request):
+    post_id = request.path_params['post_id']
+    return await write(as_caller(remove_post, request, request.query_params.get("username")), post_id)
+
+async def vote_on_post(request):
+    data = await get_json(request)
+    return await write(cast_vote, Post, request.path_params['post_id'], data.get("action"))
+
+async def batch_vote(request):
+    return await write(cast_votes, await get_json(request))
+
+async def batch(request):
+    data = await get_json(request)
+    async with Session() as session:
+        body, status = await session.run_sync(
+            run_batch, data, request.headers.get('Authorization', ''), client_address(request)
+        )
+    return JSONResponse(body, status)
+
+# Server-sent events
+
+class FeedWaiter:
+    """Lets coroutines wait for the next change_feed event without tying up a thread.
+
+    Events may be published from any thread, so each publish hops onto the event
+    loop before waking the waiters.
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._published = None
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._published = asyncio.Event()
+        change_feed.subscribe(self._notify)
+
+    def _notify(self):
+        try:
+            self._loop.call_soon_threadsafe(self._wake)
+        except RuntimeError:
+            pass  # The loop has shut down
+
+    def _wake(self):
+        published, self._published = self._published, asyncio.Event()
+        published.set()
+
+    async def wait(self, last_id, timeout):
+        """Wait until there's an event after last_id. Returns False on timeout."""
+        published = self._published
+        if change_feed.last_id > last_id:
+            return True
+        try:
+            await asyncio.wait_for(published.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return change_feed.last_id > last_id
+
+feed_waiter = FeedWaiter()
+
+async def event_stream(last_id, thread_id=None):
+    """The async counterpart of App.event_stream()."""
+    while True:
+        messages, next_id = next_events(last_id, thread_id)
+        for message in messages:
+            yield message
+        if next_id == last_id and not await feed_waiter.wait(last_id, EVENT_STREAM_HEARTBEAT):
+            yield ': keep-alive\n\n'
+        last_id = next_id
+
+def event_stream_response(request, thread_id=None):
+    try:
+        last_id = stream_start(request.headers.get('Last-Event-ID') or request.query_params.get('lastEventId'))
+    except ValueError:
+        return JSONResponse({"error": "Invalid Last-Event-ID"}, 400)
+
+    return StreamingResponse(
+        event_stream(last_id, thread_id), media_type='text/event-stream', headers=EVENT_STREAM_HEADERS
+    )
+
+async def thread_list_events(request):
+    return event_stream_response(request)
+
+async def thread_events(request):
+    return event_stream_response(request, request.path_params['thread_id'])
+
+# Authentication
+
+async def register(request):
+    data = await get_json(request)
+    return await write_in_thread(register_user, data['username'], data['email'], data['password'])
+
+async def login(request):
+    data = await get_json(request)
+    return await write_in_thread(log_in, data['username'], data['password'])
+
+# Puzzles and search
+
+def puzzle_listing(session, user):
+    completed = completed_puzzle_ids(session, user.username, user.id) if user else frozenset()
+    return puzzle_summaries(completed), 200
+
+@conditional(caller_completions)
+async def get_puzzles(request):
+    return await read(as_caller(puzzle_listing, request, request.query_params.get('username')))
+
+@conditional('threads', caller_completions)
+async def get_bootstrap(request):
+    limit = clamp_limit(request.query_params.get('limit')) or MAX_PAGE_SIZE
+    return await read(
+        as_caller(bootstrap, request, request.query_params.get('username')),
+        request.query_params.get('sort', 'oldest'), limit
+    )
+
+@conditional(caller_completions)
+async def get_puzzle_detail(request):
+    puzzle_id = request.path_params['puzzle_id']
+    return await read(as_caller(puzzle_detail, request, request.query_params.get('username')), puzzle_id)
+
+async def get_user_completed_puzzles(request):
+    return await read(user_completed_puzzles, request.path_params['user_id'])
+
+async def attempt_puzzle_solution(request):
+    data = await get_json(request)
+    if not data.get('username') and 'Authorization' not in request.headers:
+        return JSONResponse({"error": "Username is required"}, 400)
+
+    puzzle_id = request.path_params['puzzle_id']
+    return await write(
+        as_caller(try_solution, request, data.get('username')), puzzle_id, data.get('solution'),
+        client_address(request)
+    )
+
+@conditional('leaderboard')
+async def get_leaderboard(request):
+    limit = clamp_limit(request.query_params.get('limit')) or LEADERBOARD_PAGE_SIZE
+    try:
+        query = leaderboard_query(request.query_params.get('after'), limit)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, 400)
+    async with ReadSession() as session:
+        rows = (await session.execute(query)).all()
+
+    return JSONResponse([leaderboard_row_to_dict(row) for row in rows], headers=leaderboard_page_headers(rows, limit))
+
+async def search(request):
+    if not App.db.search_enabled:
+        return JSONResponse({"error": "Search is not available"}, 501)
+
+    query = fts_query(request.query_params.get('q', ''))
+    if not query:
+        return JSONResponse({"error": "Missing search query"}, 400)
+    limit = clamp_limit(request.query_params.get('limit')) or SEARCH_PAGE_SIZE
+    offset = max(int_arg(request, 'offset', 0), 0)
+
+    def run(session, user):
+        return search_results(session, user, query, limit, offset), 200
+    return await read(as_caller(run, request, request.query_params.get('username')))
+
+async def get_metrics(request):
+    return Response(metrics.render(), media_type=METRICS_MIMETYPE)
+
+async def bad_request(request, e):
+    return JSONResponse({'error': str(e)}, 400)
+
+async def auth_error(request, e):
+    return JSONResponse({'error': str(e) or 'Invalid or expired token'}, 401)
+
+async def hasher_busy(request, e):
+    return JSONResponse({'error': 'Server is busy, please try again shortly'}, 503, {'Retry-After': '1'})
+
+async def rate_limited(request, e):
+    return JSONResponse({'error': 'Too many attempts, please slow down'}, 429, {'Retry-After': str(e.retry_after)})
+
+def route_of(scope):
+    """The path of the route serving scope, as App.metrics_route() gives its URL rule."""
+    partial = None
+    for route in routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and partial is None:
+            partial = route.path
+    return partial or 'unmatched'
+
+class MetricsMiddleware:
+    """Records each request in App's metrics, as App.record_request() does for the Flask app.
+
+    A streamed response is recorded once its headers are sent, as Flask records it
+    once the view returns.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        stats = RequestStats(scope['method'], route_of(scope))
+        token = serving_request.set(stats)
+        headers = dict(scope['headers'])
+        path = scope['path'] + '?' + scope['query_string'].decode('latin-1')
+        recorded = False
+
+        def record(status, response_size=None):
+            nonlocal recorded
+            recorded = True
+            stats.record(
+                status, int(headers.get(b'content-length', 0)), response_size, path, config['SLOW_REQUEST_MS']
+            )
+
+        async def send_recorded(message):
+            if message['type'] == 'http.response.start':
+                length = dict(message['headers']).get(b'content-length')
+                record(message['status'], int(length) if length is not None else None)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_recorded)
+        except Exception:
+            if not recorded:
+                record(500)
+            raise
+        finally:
+            serving_request.reset(token)
+
+class EncodedETagMiddleware:
+    """Gives a response compressed by GZipMiddleware an ETag of its own, as App.compress_response() does.
+
+    The compressed bytes differ from the identity ones, so they mustn't share a
+    strong ETag. check_conditional() accepts either tag back.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        async def send_tagged(message):
+            if message['type'] == 'http.response.start':
+                headers = MutableHeaders(raw=message['headers'])
+                encoding = headers.get('content-encoding')
+                if encoding and 'etag' in headers:
+                    etag, weak = unquote_etag(headers['etag'])
+                    headers['etag'] = quote_etag(f"{etag}-{encoding}", weak)
+            await send(message)
+
+        await self.app(scope, receive, send_tagged)
+
+class FlaskContextMiddleware:
+    """Runs each request inside the Flask app's context, for the services' current_app lookups."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        with flask_app.app_context():
+            await self.app(scope, receive, send)
+
+@asynccontextmanager
+async def lifespan(app):
+    # Creates any missing tables and indexes before the first request
+    App.db.engine
+    feed_waiter.start()
+    yield
+    await engine.dispose()
+
+routes = [
+    Route('/', base),
+    Route('/api/threads', get_threads, methods=['GET']),
+    Route('/api/threads', create_thread, methods=['POST']),
+    Route('/api/threads/{thread_id:int}', delete_thread, methods=['DELETE']),
+    Route('/api/threads/{thread_id:int}/vote', vote_on_thread, methods=['PATCH']),
+    Route('/api/threads/{thread_id:int}/events', thread_events),
+    Route('/api/posts', get_posts, methods=['GET']),
+    Route('/api/posts', create_post, methods=['POST']),
+    Route('/api/posts/{post_id:int}', delete_post, methods=['DELETE']),
+    Route('/api/posts/{post_id:int}/vote', vote_on_post, methods=['PATCH']),
+    Route('/api/votes', batch_vote, methods=['POST']),
+    Route('/api/batch', batch, methods=['POST']),
+    Route('/api/events', thread_list_events),
+    Route('/api/register', register, methods=['POST']),
+    Route('/api/login', login, methods=['POST']),
+    Route('/api/puzzles', get_puzzles, methods=['GET']),
+    Route('/api/bootstrap', get_bootstrap, methods=['GET']),
+    Route('/api/puzzles/{puzzle_id:int}', get_puzzle_detail, methods=['GET']),
+    Route('/api/puzzles/{puzzle_id:int}/attempt', attempt_puzzle_solution, methods=['POST']),
+    Route('/api/users/{user_id:int}/completed-puzzles', get_user_completed_puzzles, methods=['GET']),
+    Route('/api/leaderboard', get_leaderboard, methods=['GET']),
+    Route('/api/search', search, methods=['GET']),
+    Route('/api/metrics', get_metrics),
+]
+
+app = Starlette(
+    routes=routes,
+    middleware=[
+        Middleware(
+            CORSMiddleware,
+            allow_origins=["http://localhost:3000"],
+            allow_methods=["*"],
+            allow_headers=["*"],
+            expose_headers=["X-Next-Cursor", "X-Prev-Cursor"]
+        ),
+        Middleware(EncodedETagMiddleware),
+        Middleware(
+            GZipMiddleware,
+            minimum_size=flask_app.config['COMPRESS_MIN_SIZE'],
+            compresslevel=flask_app.config['COMPRESS_GZIP_LEVEL']
+        ),
+        Middleware(FlaskContextMiddleware),
+        Middleware(MetricsMiddleware),
+    ],
+    exception_handlers={
+        BadRequest: bad_request, AuthError: auth_error, HasherBusy: hasher_busy, RateLimited: rate_limited
+    },
+    lifespan=lifespan
+)
@@ -0,0 +1,371 @@
+"""
+Load test for the forum API.
+
+    python bench.py --threads 500 --posts 50000 --requests 500 --concurrency 8 -o before.json
+
+Seeds a fresh SQLite database with a reproducible data set, drives each endpoint
+with the given concurrency and writes a JSON report of throughput, latency
+percentiles and SQL statements per request. Reports are written with sorted keys
+so two runs can be compared with diff.
+
+Requests go through the Flask test client by default. With --server they go over
+HTTP to the app served by a local threaded server instead. With --url they go to a
+server you started yourself, e.g. `FORUM_DATABASE_URI=sqlite:///bench.db uvicorn
+asgi:app` after `python bench.py --seed-only`. SQL statements can't be counted in
+that case, so they're reported as null.
+"""
+import glob
+import http.client
+import json
+import math
+import os
+import platform
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+
+import click
+import sqlalchemy
+from sqlalchemy import event, func, insert, select
+from sqlalchemy.engine import Engine
+
+import App
+
+ENDPOINTS = ['get_threads', 'get_posts', 'handle_vote', 'create_post', 'get_puzzles']
+
+class Dataset:
+    """Ids of the seeded rows, for building requests."""
+
+    def __init__(self, usernames, thread_ids, open_thread_ids, post_ids):
+        self.usernames = usernames
+        self.thread_ids = thread_ids
+        # Threads anyone may post in
+        self.open_thread_ids = open_thread_ids
+        self.post_ids = post_ids
+
+def seed(users, threads, posts, puzzles, completions, rng):
+    """Insert the benchmark rows in bulk and return a Dataset of everything in the database."""
+    session = App.db.session()
+    start = datetime(2024, 1, 1)
+    password_hash = App.password_hasher.hash('bench')
+
+    first_user = session.scalar(select(func.max(App.User.id))) or 0
+    session.execute(insert(App.User), [
+        {"username": f"user{i}", "email": f"user{i}@example.com", "password_hash": password_hash, "is_admin": False}
+        for i in range(users)
+    ])
+    user_ids = list(range(first_user + 1, first_user + users + 1))
+
+    first_puzzle = session.scalar(select(func.max(App.Puzzle.id))) or 0
+    session.execute(insert(App.Puzzle), [
+        {"name": f"Puzzle {i}", "description": f"Benchmark puzzle {i}", "solution_key": f"answer{i}",
+         "clue_link": None, "difficulty": 1 + i % 3}
+        for i in range(puzzles)
+    ])
+    puzzle_ids = list(range(first_puzzle + 1, first_puzzle + puzzles + 1))
+
+    # The first threads are puzzle discussion threads, up to half of them; the rest are open
+    first_thread = session.scalar(select(func.max(App.Thread.id))) or 0
+    gated = min(len(puzzle_ids), threads // 2)
+    session.execute(insert(App.Thread), [
+        {"name": f"Thread {i}", "description": f"Benchmark thread {i} " + "lorem ipsum " * rng.randint(1, 20),
+         "puzzle_id": puzzle_ids[i] if i < gated else None,
+         "creator_id": rng.choice(user_ids), "created_at": start + timedelta(minutes=i)}
+        for i in range(threads)
+    ])
+
+    thread_ids = list(range(first_thread + 1, first_thread + threads + 1))
+    for offset in range(0, posts, App.STREAM_BATCH_SIZE):
+        rows = [
+            {"text": "lorem ipsum dolor sit amet " * rng.randint(1, 10), "user_id": rng.choice(user_ids),
+             "thread_id": rng.choice(thread_ids), "timestamp": start + timedelta(seconds=i),
+             "upvotes": 0, "downvotes": 0}
+            for i in range(offset, min(offset + App.STREAM_BATCH_SIZE, posts))
+        ]
+        for options, shard_rows in App.post_shards.split(rows):
+            session.execute(insert(App.Post).execution_options(**options), shard_rows)
+
+    pairs = set()
+    while len(pairs) < min(completions, users * puzzles):
+        pairs.add((rng.choice(user_ids), rng.choice(puzzle_ids)))
+    if pairs:
+        session.execute(insert(App.CompletedPuzzle), [
+            {"user_id": user_id, "puzzle_id": puzzle_id} for user_id, puzzle_id in sorted(pairs)
+        ])
+    session.commit()
+    App.reconcile_thread_stats(App.db.engine)
+    App.reconcile_user_scores(App.db.engine)
+
+    dataset = Dataset(
+        usernames=list(session.scalars(select(App.User.username).order_by(App.User.id))),
+        thread_ids=list(session.scalars(select(App.Thread.id).order_by(App.Thread.id))),
+        open_thread_ids=list(session.scalars(
+            select(App.Thread.id).where(App.Thread.puzzle_id.is_(None)).order_by(App.Thread.id)
+        )),
+        post_ids=[
+            post_id for options in App.post_shards.every()
+            for post_id in session.scalars(select(App.Post.id).order_by(App.Post.id).execution_options(**options))
+        ]
+    )
+    session.close()
+    return dataset
+
+def table_counts():
+    session = App.db.session()
+    counts = {
+        model.__tablename__: sum(
+            session.scalar(select(func.count()).select_from(model).execution_options(**options))
+            for options in (App.post_shards.every() if model is App.Post else [{}])
+        )
+        for model in (App.User, App.Thread, App.Post, App.Puzzle, App.CompletedPuzzle)
+    }
+    session.close()
+    return counts
+
+def make_request(endpoint, dataset, rng):
+    """Return (method, path, json body) for one request to endpoint."""
+    if endpoint == 'get_threads':
+        return 'GET', '/api/threads', None
+    if endpoint == 'get_posts':
+        return 'GET', f"/api/posts?threadId={rng.choice(dataset.thread_ids)}", None
+    if endpoint == 'handle_vote':
+        action = rng.choice(['upvote', 'downvote'])
+        return 'PATCH', f"/api/posts/{rng.choice(dataset.post_ids)}/vote", {"action": action}
+    if endpoint == 'create_post':
+        return 'POST', '/api/posts', {
+            "threadId": rng.choice(dataset.open_thread_ids),
+            "author": rng.choice(dataset.usernames),
+            "text": "benchmark post"
+        }
+    if endpoint == 'get_puzzles':
+        return 'GET', f"/api/puzzles?username={rng.choice(dataset.usernames)}", None
+    raise ValueError(endpoint)
+
+class TestClientTransport:
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def send(self, method, path, body):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open(path, method=method, json=body)
+        response.close()
+        return response.status_code
+
+class HTTPTransport:
+    def __init__(self, base_url):
+        url = urlsplit(base_url)
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.prefix = url.path.rstrip('/')
+
+    def send(self, method, path, body):
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        try:
+            headers = {}
+            payload = None
+            if body is not None:
+                payload = json.dumps(body)
+                headers['Content-Type'] = 'application/json'
+            connection.request(method, self.prefix + path, payload, headers)
+            response = connection.getresponse()
+            response.read()
+            return response.status
+        finally:
+            connection.close()
+
+class QueryCounter:
+    """Counts SQL statements and their time across every engine in the process."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        event.listen(Engine, 'before_cursor_execute', self._before)
+        event.listen(Engine, 'after_cursor_execute', self._after)
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        self._local.started = time.perf_counter()
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - self._local.started
+        with self._lock:
+            self.count += 1
+            self.seconds += elapsed
+
+    def snapshot(self):
+        with self._lock:
+            return self.count, self.seconds
+
+def percentile(ordered, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return None
+    return ordered[max(math.ceil(p / 100 * len(ordered)), 1) - 1]
+
+def run_endpoint(endpoint, transport, dataset, requests, concurrency, warmup, seed_value, counter):
+    """Send `requests` requests to endpoint from `concurrency` threads and summarise them."""
+    rng = random.Random(f"{seed_value}:{endpoint}")
+    plan = [make_request(endpoint, dataset, rng) for _ in range(warmup + requests)]
+    for method, path, body in plan[:warmup]:
+        transport.send(method, path, body)
+    plan = plan[warmup:]
+
+    latencies = [None] * len(plan)
+    statuses = [None] * len(plan)
+    next_index = iter(range(len(plan)))
+    index_lock = threading.Lock()
+
+    def worker():
+        while True:
+            with index_lock:
+                i = next(next_index, None)
+            if i is None:
+                return
+            method, path, body = plan[i]
+            started = time.perf_counter()
+            try:
+                statuses[i] = transport.send(method, path, body)
+            except Exception as e:
+                statuses[i] = type(e).__name__
+            latencies[i] = time.perf_counter() - started
+
+    queries_before = counter.snapshot() if counter else None
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - started
+    # Count buffered votes against the endpoint that cast them
+    if App.vote_aggregator is not None:
+        App.vote_aggregator.flush()
+
+    status_counts = {}
+    for status in statuses:
+        status_counts[str(status)] = status_counts.get(str(status), 0) + 1
+    ordered = sorted(latencies)
+    result = {
+        "requests": len(plan),
+        "errors": sum(1 for s in statuses if not isinstance(s, int) or s >= 400),
+        "statuses": status_counts,
+        "seconds": round(elapsed, 4),
+        "throughput_rps": round(len(plan) / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            "mean": round(sum(ordered) / len(ordered) * 1000, 3),
+            "p50": round(percentile(ordered, 50) * 1000, 3),
+            "p95": round(percentile(ordered, 95) * 1000, 3),
+            "p99": round(percentile(ordered, 99) * 1000, 3),
+            "max": round(ordered[-1] * 1000, 3),
+        },
+        "queries_per_request": None,
+        "query_ms_per_request": None,
+    }
+    if counter:
+        count, seconds = counter.snapshot()
+        result["queries_per_request"] = round((count - queries_before[0]) / len(plan), 3)
+        result["query_ms_per_request"] = round((seconds - queries_before[1]) / len(plan) * 1000, 3)
+    return result
+
+@click.command()
+@click.option('--db', default='bench.db', show_default=True, help='SQLite file to create; replaced if it exists.')
+@click.option('--users', default=1000, show_default=True)
+@click.option('--threads', default=200, show_default=True)
+@click.option('--posts', default=20000, show_default=True)
+@click.option('--puzzles', default=20, show_default=True, help='Each gets a discussion thread of its own.')
+@click.option('--completions', default=2000, show_default=True, help='Solved (user, puzzle) pairs.')
+@click.option('--requests', 'requests', default=200, show_default=True, help='Measured requests per endpoint.')
+@click.option('--warmup', default=10, show_default=True, help='Unmeasured requests per endpoint first.')
+@click.option('--concurrency', default=1, show_default=True)
+@click.option('--endpoint', 'endpoints', multiple=True, type=click.Choice(ENDPOINTS), help='Repeatable; all by default.')
+@click.option('--server', is_flag=True, help='Serve the app on a local port and send real HTTP requests.')
+@click.option('--url', default=None, help='Benchmark an already running server instead.')
+@click.option('--seed', 'seed_value', default=0, show_default=True, help='Random seed for data and requests.')
+@click.option('--seed-only', is_flag=True, help='Create the database and exit.')
+@click.option('--post-shards', default=0, show_default=True, help='Partition posts across this many files.')
+@click.option('-o', '--output', default='-', show_default=True, help='Report file, - for stdout.')
+def main(db, users, threads, posts, puzzles, completions, requests, warmup, concurrency, endpoints,
+         server, url, seed_value, seed_only, post_shards, output):
+    # Post shards of an earlier run go too, whatever their number
+    root, ext = os.path.splitext(db)
+    for path in [db] + glob.glob(f"{glob.escape(root)}-posts-*{ext}"):
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+    app = App.create_app({
+        'DATABASE_URI': f"sqlite:///{os.path.abspath(db)}",
+        'POST_SHARDS': post_shards,
+    })
+
+    rng = random.Random(seed_value)
+    started = time.perf_counter()
+    dataset = seed(users, threads, posts, puzzles, completions, rng)
+    seed_seconds = time.perf_counter() - started
+    counts = table_counts()
+    click.echo(f"Seeded {counts} in {seed_seconds:.1f}s", err=True)
+    if seed_only:
+        return
+
+    counter = None
+    http_server = None
+    if url:
+        transport = HTTPTransport(url)
+        mode = 'url'
+    else:
+        counter = QueryCounter()
+        if server:
+            from werkzeug.serving import make_server
+            http_server = make_server('127.0.0.1', 0, app, threaded=True)
+            threading.Thread(target=http_server.serve_forever, daemon=True).start()
+            transport = HTTPTransport(f"http://127.0.0.1:{http_server.server_port}")
+            mode = 'server'
+        else:
+            transport = TestClientTransport(app)
+            mode = 'test-client'
+
+    results = {}
+    for endpoint in endpoints or ENDPOINTS:
+        results[endpoint] = run_endpoint(
+            endpoint, transport, dataset, requests, concurrency, warmup, seed_value, counter
+        )
+        summary = results[endpoint]
+        click.echo(
+            f"{endpoint:12} {summary['throughput_rps']:>9} req/s  p50 {summary['latency_ms']['p50']}ms"
+            f"  p99 {summary['latency_ms']['p99']}ms  queries {summary['queries_per_request']}",
+            err=True
+        )
+    if http_server is not None:
+        http_server.shutdown()
+
+    report = {
+        "config": {
+            "mode": mode,
+            "url": url,
+            "requests": requests,
+            "warmup": warmup,
+            "concurrency": concurrency,
+            "seed": seed_value,
+            "vote_flush_interval": app.config['VOTE_FLUSH_INTERVAL'],
+            "post_shards": App.post_shards.count,
+            "python": platform.python_version(),
+            "sqlalchemy": sqlalchemy.__version__,
+            "sqlite": App.db.engine.dialect.dbapi.sqlite_version,
+        },
+        "dataset": counts,
+        "endpoints": results,
+    }
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if output == '-':
+        click.echo(text)
+    else:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+
+if __name__ == '__main__':
+    main()
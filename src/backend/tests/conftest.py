@@ -0,0 +1,66 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import App  # noqa: E402
+
+# Quick to hash, and nothing running in the background unless a test asks for it
+TEST_CONFIG = dict(
+    PASSWORD_HASH_METHOD='pbkdf2:sha256:1000',
+    PASSWORD_HASH_WORKERS=0,
+    SECRET_KEY='test',
+    CHANGE_POLL_INTERVAL=0,
+    ATTEMPT_RATE=0,
+)
+
+@pytest.fixture
+def make_app(tmp_path):
+    """Create a seeded app on a fresh database file, with config overriding TEST_CONFIG."""
+    def make(**config):
+        app = App.create_app(dict(TEST_CONFIG, DATABASE_URI=f"sqlite:///{tmp_path / 'forum.db'}", **config))
+        with app.app_context():
+            App.seed_database()
+        return app
+    yield make
+    App.stop_background_writers()
+    App.db.close()
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+def create_thread(client, name='thread', author='admin'):
+    response = client.post('/api/threads', json={'author': author, 'name': name, 'description': 'd'})
+    assert response.status_code == 201
+    return response.get_json()['id']
+
+def create_post(client, thread_id, text='post', author='admin'):
+    response = client.post('/api/posts', json={'author': author, 'threadId': thread_id, 'text': text})
+    assert response.status_code == 201
+    return response.get_json()['id']
+
+def read_all(client, url):
+    """Follow X-Next-Cursor from url to the last page, returning the pages' ids."""
+    pages = []
+    while True:
+        response = client.get(url)
+        assert response.status_code == 200
+        pages.append([item['id'] for item in response.get_json()])
+        cursor = response.headers.get('X-Next-Cursor')
+        if cursor is None:
+            return pages
+        url = f"{url.split('&after=')[0]}&after={cursor}"
+
+def register(client, username, password='password123'):
+    response = client.post('/api/register', json={
+        'username': username, 'email': f"{username}@example.com", 'password': password
+    })
+    assert response.status_code == 201
+    return response.get_json()
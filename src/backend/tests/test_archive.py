@@ -0,0 +1,137 @@
+import pytest
+
+import App
+from conftest import create_post, create_thread, register
+
+def archive_all():
+    # Every thread with posts counts as idle when the cutoff is in the future
+    return App.archive_threads(App.db.session, -1)
+
+def live_post_ids(thread_id):
+    session = App.db.session()
+    try:
+        return sorted(session.scalars(
+            App.select(App.Post.id).where(App.Post.thread_id == thread_id)
+            .execution_options(**App.post_shards.for_thread(thread_id))
+        ))
+    finally:
+        session.close()
+
+def test_archived_posts_are_still_listed(client):
+    thread_id = create_thread(client)
+    post_ids = [create_post(client, thread_id, f"post {i}") for i in range(3)]
+    before = client.get(f'/api/posts?threadId={thread_id}').get_json()
+
+    assert archive_all() >= 1
+
+    assert live_post_ids(thread_id) == []
+    assert client.get(f'/api/posts?threadId={thread_id}').get_json() == before
+    page = client.get(f'/api/posts?threadId={thread_id}&limit=2')
+    assert [post['id'] for post in page.get_json()] == post_ids[:2]
+    rest = client.get(f"/api/posts?threadId={thread_id}&limit=2&after={page.headers['X-Next-Cursor']}")
+    assert [post['id'] for post in rest.get_json()] == post_ids[2:]
+
+def test_archived_posts_are_found_by_search(client):
+    thread_id = create_thread(client)
+    post_id = create_post(client, thread_id, 'a rather unusual zebracorn')
+    archive_all()
+
+    results = client.get('/api/search?q=zebracorn').get_json()
+
+    assert [(result['postId'], result['threadId']) for result in results if result['kind'] == 'post'] == [
+        (post_id, thread_id)
+    ]
+
+def test_new_post_restores_archive_with_original_ids(client):
+    thread_id = create_thread(client)
+    post_ids = [create_post(client, thread_id, f"post {i}") for i in range(2)]
+    archive_all()
+
+    new_id = create_post(client, thread_id, 'back again')
+
+    assert live_post_ids(thread_id) == post_ids + [new_id]
+    assert [post['id'] for post in client.get(f'/api/posts?threadId={thread_id}').get_json()] == post_ids + [new_id]
+    session = App.db.session()
+    assert session.get(App.PostArchive, thread_id) is None
+    session.close()
+
+def test_purge_removes_archive(client):
+    # Purge here rather than racing the background purger
+    App.thread_purger.stop()
+    thread_id = create_thread(client)
+    create_post(client, thread_id, 'soon gone')
+    archive_all()
+
+    assert client.delete(f'/api/threads/{thread_id}?username=admin').status_code == 200
+    assert App.purge_deleted_threads(App.db.engine, 100) == 1
+
+    session = App.db.session()
+    assert session.get(App.PostArchive, thread_id) is None
+    assert session.get(App.Thread, thread_id) is None
+    session.close()
+
+def test_author_can_delete_archived_post(client):
+    thread_id = create_thread(client)
+    kept, removed = create_post(client, thread_id, 'kept'), create_post(client, thread_id, 'a doomed zebracorn')
+    archive_all()
+
+    assert client.delete(f'/api/posts/{removed}?username=admin').status_code == 200
+
+    assert live_post_ids(thread_id) == [kept]
+    assert [post['id'] for post in client.get(f'/api/posts?threadId={thread_id}').get_json()] == [kept]
+    assert not [result for result in client.get('/api/search?q=zebracorn').get_json() if result['kind'] == 'post']
+    session = App.db.session()
+    assert session.get(App.Thread, thread_id).post_count == 1
+    session.close()
+
+def test_others_cannot_delete_archived_post(client):
+    register(client, 'bob')
+    thread_id = create_thread(client)
+    post_id = create_post(client, thread_id)
+    archive_all()
+
+    assert client.delete(f'/api/posts/{post_id}?username=bob').status_code == 403
+
+    assert live_post_ids(thread_id) == []
+    session = App.db.session()
+    assert session.get(App.PostArchive, thread_id) is not None
+    session.close()
+
+@pytest.mark.parametrize('flush_interval', [0, 3600])
+def test_vote_on_archived_post_restores_it(make_app, flush_interval):
+    client = make_app(VOTE_FLUSH_INTERVAL=flush_interval).test_client()
+    thread_id = create_thread(client)
+    post_id = create_post(client, thread_id)
+    archive_all()
+
+    assert client.patch(f'/api/posts/{post_id}/vote', json={'action': 'upvote'}).status_code == 200
+    response = client.post('/api/votes', json={'votes': [{'type': 'post', 'id': post_id, 'action': 'upvote'}]})
+    assert response.get_json()['results'][0]['status'] == 'success'
+    if App.vote_aggregator is not None:
+        App.vote_aggregator.flush()
+
+    assert live_post_ids(thread_id) == [post_id]
+    session = App.db.session()
+    assert session.get(App.Post, post_id).upvotes == 2
+    session.close()
+
+def test_vote_on_archived_post_of_deleted_thread_is_refused(client):
+    App.thread_purger.stop()
+    thread_id = create_thread(client)
+    post_id = create_post(client, thread_id)
+    archive_all()
+    assert client.delete(f'/api/threads/{thread_id}?username=admin').status_code == 200
+
+    assert client.patch(f'/api/posts/{post_id}/vote', json={'action': 'upvote'}).status_code == 404
+    assert client.delete(f'/api/posts/{post_id}?username=admin').status_code == 404
+
+def test_archived_post_threads_is_rebuilt_for_older_databases(client):
+    thread_id = create_thread(client)
+    post_id = create_post(client, thread_id)
+    archive_all()
+    with App.db.engine.begin() as conn:
+        conn.execute(App.text("DROP TABLE archived_post_threads"))
+    App.db.close()
+
+    assert client.delete(f'/api/posts/{post_id}?username=admin').status_code == 200
+    assert live_post_ids(thread_id) == []
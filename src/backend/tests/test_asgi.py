@@ -0,0 +1,107 @@
+import importlib
+import json
+
+import pytest
+
+pytest.importorskip('aiosqlite')
+from starlette.testclient import TestClient  # noqa: E402
+
+import App  # noqa: E402
+from conftest import TEST_CONFIG  # noqa: E402
+
+@pytest.fixture
+def asgi_client(tmp_path, monkeypatch):
+    """A client of a fresh asgi.app on its own seeded database file."""
+    monkeypatch.setenv('FORUM_DATABASE_URI', f"sqlite:///{tmp_path / 'forum.db'}")
+    for key, value in TEST_CONFIG.items():
+        monkeypatch.setenv(f"FORUM_{key}", str(value))
+    # asgi builds its app on import, from the environment
+    import asgi
+    asgi = importlib.reload(asgi)
+    with asgi.flask_app.app_context():
+        App.seed_database()
+    with TestClient(asgi.app) as client:
+        yield client
+    App.stop_background_writers()
+    App.db.close()
+
+def create_thread(client, name='thread'):
+    response = client.post('/api/threads', json={'author': 'admin', 'name': name, 'description': 'd'})
+    assert response.status_code == 201
+    return response.json()['id']
+
+def create_post(client, thread_id, text='post'):
+    response = client.post('/api/posts', json={'author': 'admin', 'threadId': thread_id, 'text': text})
+    assert response.status_code == 201
+    return response.json()['id']
+
+def test_threads_and_posts(asgi_client):
+    thread_id = create_thread(asgi_client, 'hello')
+    post_ids = [create_post(asgi_client, thread_id, f"post {i}") for i in range(3)]
+
+    threads = asgi_client.get('/api/threads').json()
+    assert next(thread for thread in threads if thread['id'] == thread_id)['postCount'] == 3
+
+    page = asgi_client.get(f'/api/posts?threadId={thread_id}&limit=2')
+    assert [post['id'] for post in page.json()] == post_ids[:2]
+    rest = asgi_client.get(f"/api/posts?threadId={thread_id}&after={page.headers['X-Next-Cursor']}")
+    assert [post['id'] for post in rest.json()] == post_ids[2:]
+
+    streamed = asgi_client.get(f'/api/posts?threadId={thread_id}&stream=ndjson').text.splitlines()
+    assert [json.loads(line)['id'] for line in streamed] == post_ids
+
+@pytest.mark.parametrize('body', ['nope', '[1, 2]'])
+def test_bad_body_is_rejected(asgi_client, body):
+    for path in ('/api/posts', '/api/threads', '/api/batch', '/api/register'):
+        response = asgi_client.post(path, content=body, headers={'Content-Type': 'application/json'})
+        assert response.status_code == 400
+        assert 'error' in response.json()
+
+def test_conditional_get(asgi_client):
+    etag = asgi_client.get('/api/threads').headers['ETag']
+
+    assert asgi_client.get('/api/threads', headers={'If-None-Match': etag}).status_code == 304
+    create_thread(asgi_client)
+    assert asgi_client.get('/api/threads', headers={'If-None-Match': etag}).status_code == 200
+
+def test_each_encoding_has_its_own_etag(asgi_client):
+    for i in range(20):
+        create_thread(asgi_client, f"a thread with a long enough name to need compressing {i}")
+
+    plain = asgi_client.get('/api/threads', headers={'Accept-Encoding': 'identity'})
+    compressed = asgi_client.get('/api/threads', headers={'Accept-Encoding': 'gzip'})
+
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Encoding' not in plain.headers
+    assert compressed.headers['ETag'] != plain.headers['ETag']
+    for response, encoding in ((plain, 'identity'), (compressed, 'gzip')):
+        again = asgi_client.get('/api/threads', headers={
+            'If-None-Match': response.headers['ETag'], 'Accept-Encoding': encoding
+        })
+        assert again.status_code == 304
+        assert again.headers['ETag'] == response.headers['ETag']
+
+def test_register_log_in_and_use_the_token(asgi_client):
+    assert asgi_client.post('/api/register', json={
+        'username': 'alice', 'email': 'alice@example.com', 'password': 'password123'
+    }).status_code == 201
+    token = asgi_client.post('/api/login', json={'username': 'alice', 'password': 'password123'}).json()['token']
+    assert asgi_client.post('/api/login', json={'username': 'alice', 'password': 'wrong'}).status_code == 401
+
+    response = asgi_client.post('/api/threads', json={'name': 'n', 'description': 'd'},
+                                headers={'Authorization': f"Bearer {token}"})
+
+    assert response.status_code == 201
+
+def test_puzzles_completions_and_metrics(asgi_client):
+    solved = asgi_client.post('/api/puzzles/1/attempt', json={
+        'username': 'admin', 'solution': 'this is your first challenge'
+    })
+    assert solved.status_code == 200
+
+    assert asgi_client.get('/api/puzzles?username=admin').json()[0]['completed']
+    assert asgi_client.get('/api/users/1/completed-puzzles').json()['completed_puzzle_ids'] == [1]
+
+    metrics = asgi_client.get('/api/metrics')
+    assert metrics.status_code == 200
+    assert '/api/puzzles/{puzzle_id:int}/attempt' in metrics.text
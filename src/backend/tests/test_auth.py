@@ -0,0 +1,79 @@
+import jwt
+
+import App
+from conftest import register
+
+def token_for(client, username):
+    register(client, username)
+    response = client.post('/api/login', json={'username': username, 'password': 'password123'})
+    assert response.status_code == 200
+    return response.get_json()['token']
+
+def bearer(token):
+    return {'Authorization': f"Bearer {token}"}
+
+def new_thread(client, token=None, author=None):
+    body = {'name': 'n', 'description': 'd'}
+    if author:
+        body['author'] = author
+    return client.post('/api/threads', json=body, headers=bearer(token) if token else {})
+
+def thread_author(client, thread_id):
+    return next(thread['author'] for thread in client.get('/api/threads').get_json() if thread['id'] == thread_id)
+
+def test_token_identifies_the_caller(client):
+    token = token_for(client, 'alice')
+
+    response = new_thread(client, token)
+
+    assert response.status_code == 201
+    assert thread_author(client, response.get_json()['id']) == 'alice'
+
+def test_token_outranks_the_username(client):
+    token = token_for(client, 'alice')
+
+    response = new_thread(client, token, author='admin')
+
+    assert thread_author(client, response.get_json()['id']) == 'alice'
+
+def test_bad_token_alone_is_rejected(client):
+    token = jwt.encode({'sub': '1', 'name': 'admin', 'adm': True}, 'not the key', algorithm='HS256')
+
+    assert new_thread(client, 'garbage').status_code == 401
+    assert new_thread(client, token).status_code == 401
+
+def test_token_from_another_worker_falls_back_to_username(client):
+    # Signed with a SECRET_KEY of its own, as by a worker started without FORUM_SECRET_KEY
+    token = jwt.encode({'sub': '1', 'name': 'admin', 'adm': True}, 'another worker', algorithm='HS256')
+    register(client, 'alice')
+
+    response = new_thread(client, token, author='alice')
+
+    assert response.status_code == 201
+    assert thread_author(client, response.get_json()['id']) == 'alice'
+    assert client.get('/api/puzzles?username=alice', headers=bearer(token)).status_code == 200
+
+def test_expired_token_is_rejected(make_app):
+    client = make_app(AUTH_TOKEN_TTL=-1).test_client()
+    token = token_for(client, 'alice')
+
+    assert new_thread(client, token).status_code == 401
+    assert new_thread(client, token, author='alice').status_code == 201
+
+def test_required_token(make_app):
+    client = make_app(AUTH_REQUIRE_TOKEN=True).test_client()
+    token = token_for(client, 'alice')
+
+    assert new_thread(client, author='alice').status_code == 401
+    assert new_thread(client, 'garbage', author='alice').status_code == 401
+    assert new_thread(client, token).status_code == 201
+
+def test_token_needs_no_lookup(client, monkeypatch):
+    token = token_for(client, 'alice')
+    App.principal_cache.clear()
+    looked_up = []
+    monkeypatch.setattr(App.principal_cache, 'set', lambda *args: looked_up.append(args))
+
+    assert client.get('/api/puzzles', headers=bearer(token)).status_code == 200
+    assert new_thread(client, token).status_code == 201
+    assert looked_up == []
@@ -0,0 +1,50 @@
+from conftest import create_thread
+
+SOLUTION = 'this is your first challenge'
+
+def test_bootstrap_matches_the_listings(client):
+    for i in range(3):
+        create_thread(client, f"thread {i}")
+
+    body = client.get('/api/bootstrap?username=admin').get_json()
+
+    assert body['threads'] == client.get('/api/threads').get_json()
+    assert body['puzzles'] == client.get('/api/puzzles?username=admin').get_json()
+    assert body['completedPuzzleIds'] == []
+    assert body['nextCursor'] is None
+
+def test_bootstrap_pages_on_through_threads(client):
+    for i in range(3):
+        create_thread(client, f"thread {i}")
+    every = [thread['id'] for thread in client.get('/api/threads?sort=newest').get_json()]
+
+    body = client.get('/api/bootstrap?sort=newest&limit=2').get_json()
+    rest = client.get(f"/api/threads?sort=newest&limit=2&after={body['nextCursor']}").get_json()
+
+    assert [thread['id'] for thread in body['threads'] + rest] == every
+
+def test_bootstrap_marks_the_callers_solved_puzzles(client):
+    assert client.post('/api/puzzles/1/attempt', json={'username': 'admin', 'solution': SOLUTION}).status_code == 200
+
+    body = client.get('/api/bootstrap?username=admin').get_json()
+    anonymous = client.get('/api/bootstrap').get_json()
+
+    assert body['completedPuzzleIds'] == [1]
+    assert [puzzle['id'] for puzzle in body['puzzles'] if puzzle['completed']] == [1]
+    assert anonymous['completedPuzzleIds'] == []
+    assert not any(puzzle['completed'] for puzzle in anonymous['puzzles'])
+
+def test_unknown_sort_is_rejected(client):
+    assert client.get('/api/bootstrap?sort=sideways').status_code == 400
+
+def test_bootstrap_is_conditional_on_threads_and_completions(client):
+    etag = client.get('/api/bootstrap?username=admin').headers['ETag']
+    assert client.get('/api/bootstrap?username=admin', headers={'If-None-Match': etag}).status_code == 304
+
+    client.post('/api/puzzles/1/attempt', json={'username': 'admin', 'solution': SOLUTION})
+    response = client.get('/api/bootstrap?username=admin', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+
+    create_thread(client)
+    assert client.get('/api/bootstrap?username=admin', headers={'If-None-Match': etag}).status_code == 200
@@ -0,0 +1,47 @@
+from conftest import create_post, create_thread
+
+def test_unchanged_listing_is_not_modified(client):
+    first = client.get('/api/threads')
+
+    assert client.get('/api/threads', headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+    assert client.get('/api/threads', headers={'If-Modified-Since': first.headers['Last-Modified']}).status_code == 304
+
+def test_weak_etag_matches(client):
+    etag = client.get('/api/threads').headers['ETag']
+
+    assert client.get('/api/threads', headers={'If-None-Match': f'W/{etag}'}).status_code == 304
+
+def test_new_thread_invalidates_listing(client):
+    etag = client.get('/api/threads').headers['ETag']
+
+    create_thread(client)
+
+    response = client.get('/api/threads', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+def test_new_post_invalidates_only_its_thread(client):
+    thread_id, other_id = create_thread(client, 'one'), create_thread(client, 'two')
+    posts_etag = client.get(f'/api/posts?threadId={thread_id}').headers['ETag']
+    other_etag = client.get(f'/api/posts?threadId={other_id}').headers['ETag']
+
+    create_post(client, thread_id)
+
+    assert client.get(f'/api/posts?threadId={thread_id}', headers={'If-None-Match': posts_etag}).status_code == 200
+    assert client.get(f'/api/posts?threadId={other_id}', headers={'If-None-Match': other_etag}).status_code == 304
+
+def test_etag_depends_on_query_and_caller(client):
+    plain = client.get('/api/threads').headers['ETag']
+
+    assert client.get('/api/threads?limit=1').headers['ETag'] != plain
+    assert client.get('/api/threads', headers={'Authorization': 'Bearer x'}).headers['ETag'] != plain
+
+def test_solving_a_puzzle_invalidates_the_solvers_listing(client):
+    etag = client.get('/api/puzzles?username=admin').headers['ETag']
+
+    response = client.post('/api/puzzles/1/attempt', json={'username': 'admin', 'solution': 'this is your first challenge'})
+    assert response.status_code == 200
+
+    response = client.get('/api/puzzles?username=admin', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.get_json()[0]['completed']
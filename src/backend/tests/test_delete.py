@@ -0,0 +1,84 @@
+import time
+
+import pytest
+
+import App
+from conftest import create_post, create_thread, register
+
+def listed_thread_ids(client, **params):
+    query = '&'.join(f"{key}={value}" for key, value in params.items())
+    return [thread['id'] for thread in client.get(f'/api/threads?{query}').get_json()]
+
+def deleted_thread(client):
+    thread_id = create_thread(client)
+    post_id = create_post(client, thread_id)
+    assert client.delete(f'/api/threads/{thread_id}?username=admin').status_code == 200
+    return thread_id, post_id
+
+def test_deleted_thread_is_hidden_at_once(client):
+    App.thread_purger.stop()
+    thread_id, post_id = deleted_thread(client)
+
+    for sort in App.THREAD_SORTS:
+        assert thread_id not in listed_thread_ids(client, sort=sort)
+    assert client.get(f'/api/posts?threadId={thread_id}').get_json() == []
+    assert client.post('/api/posts', json={'author': 'admin', 'threadId': thread_id, 'text': 'x'}).status_code == 404
+    assert client.delete(f'/api/threads/{thread_id}?username=admin').status_code == 404
+
+@pytest.mark.parametrize('shards', [0, 2])
+def test_deleted_thread_and_its_posts_take_no_votes(make_app, shards):
+    client = make_app(POST_SHARDS=shards).test_client()
+    App.thread_purger.stop()
+    thread_id, post_id = deleted_thread(client)
+    last_event = App.change_feed.last_id
+
+    assert client.patch(f'/api/threads/{thread_id}/vote', json={'action': 'upvote'}).status_code == 404
+    assert client.patch(f'/api/posts/{post_id}/vote', json={'action': 'upvote'}).status_code == 404
+    response = client.post('/api/votes', json={'votes': [
+        {'type': 'thread', 'id': thread_id, 'action': 'upvote'},
+        {'type': 'post', 'id': post_id, 'action': 'upvote'},
+    ]})
+    assert [result['status'] for result in response.get_json()['results']] == ['not found', 'not found']
+    assert App.change_feed.since(last_event) == ([], True)
+
+def test_only_the_creator_or_an_admin_may_delete(client):
+    register(client, 'alice')
+    thread_id = create_thread(client)
+
+    assert client.delete(f'/api/threads/{thread_id}?username=alice').status_code == 403
+    assert thread_id in listed_thread_ids(client)
+
+def test_purge_deletes_posts_in_batches(client):
+    App.thread_purger.stop()
+    thread_id = create_thread(client)
+    for i in range(5):
+        create_post(client, thread_id, f"post {i}")
+    keep = create_thread(client, 'keep')
+    kept_post = create_post(client, keep)
+    client.delete(f'/api/threads/{thread_id}?username=admin')
+
+    assert App.purge_deleted_threads(App.db.engine, batch_size=2) == 1
+
+    session = App.db.session()
+    try:
+        assert session.get(App.Thread, thread_id) is None
+        assert session.scalars(App.select(App.Post.id).where(App.Post.thread_id.in_([thread_id, keep]))).all() == [
+            kept_post
+        ]
+    finally:
+        session.close()
+
+def test_background_purger_runs_when_woken(client):
+    thread_id, _ = deleted_thread(client)
+
+    deadline = time.monotonic() + 5
+    while True:
+        session = App.db.session()
+        try:
+            purged = session.get(App.Thread, thread_id) is None
+        finally:
+            session.close()
+        if purged or time.monotonic() > deadline:
+            break
+        time.sleep(0.01)
+    assert purged
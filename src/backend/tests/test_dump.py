@@ -0,0 +1,73 @@
+import pytest
+
+import App
+from conftest import TEST_CONFIG, create_post, create_thread
+
+def fill(client):
+    thread_id = create_thread(client, 'exported')
+    for i in range(3):
+        create_post(client, thread_id, f"post {i}")
+    client.patch(f'/api/threads/{thread_id}/vote', json={'action': 'upvote'})
+    client.post('/api/puzzles/1/attempt', json={'username': 'admin', 'solution': 'this is your first challenge'})
+    return thread_id
+
+def snapshot(client, thread_id, post_key=('id', 'author', 'text', 'timestamp')):
+    return {
+        'threads': client.get('/api/threads').get_json(),
+        'posts': [{key: post[key] for key in post_key}
+                  for post in client.get(f'/api/posts?threadId={thread_id}').get_json()],
+        'puzzles': client.get('/api/puzzles?username=admin').get_json(),
+        'leaderboard': client.get('/api/leaderboard').get_json(),
+    }
+
+def empty_app(tmp_path, **config):
+    return App.create_app(dict(TEST_CONFIG, DATABASE_URI=f"sqlite:///{tmp_path / 'target.db'}", **config))
+
+@pytest.mark.parametrize('name', ['forum.ndjson', 'forum.ndjson.gz'])
+def test_export_then_import_gives_the_same_forum(app, tmp_path, name):
+    client = app.test_client()
+    thread_id = fill(client)
+    before = snapshot(client, thread_id)
+    dump = str(tmp_path / name)
+
+    result = app.test_cli_runner().invoke(args=['export-data', dump])
+    assert result.exit_code == 0, result.output
+
+    target = empty_app(tmp_path)
+    result = target.test_cli_runner().invoke(args=['import-data', dump])
+    assert result.exit_code == 0, result.output
+    assert snapshot(target.test_client(), thread_id) == before
+
+def test_import_into_shards_renumbers_posts(app, tmp_path):
+    client = app.test_client()
+    thread_id = fill(client)
+    before = snapshot(client, thread_id, ('author', 'text', 'timestamp'))
+    dump = str(tmp_path / 'forum.ndjson')
+    app.test_cli_runner().invoke(args=['export-data', dump])
+
+    target = empty_app(tmp_path, POST_SHARDS=2)
+    assert target.test_cli_runner().invoke(args=['import-data', dump]).exit_code == 0
+
+    target_client = target.test_client()
+    assert snapshot(target_client, thread_id, ('author', 'text', 'timestamp')) == before
+    post_ids = [post['id'] for post in target_client.get(f'/api/posts?threadId={thread_id}').get_json()]
+    assert {App.post_shards.shard_of_post(post_id) for post_id in post_ids} == {thread_id % 2}
+
+def test_bad_dump_is_reported_by_line(tmp_path):
+    dump = tmp_path / 'bad.ndjson'
+    dump.write_text('{"table": "users", "row": {"id": 5, "username": "x", "email": "x", "password_hash": "x"}}\n'
+                    '{"table": "nope", "row": {}}\n')
+
+    result = empty_app(tmp_path).test_cli_runner().invoke(args=['import-data', str(dump)])
+
+    assert result.exit_code != 0
+    assert 'line 2' in result.output
+
+def test_import_over_existing_rows_is_refused(app, tmp_path):
+    dump = str(tmp_path / 'forum.ndjson')
+    app.test_cli_runner().invoke(args=['export-data', dump])
+
+    result = app.test_cli_runner().invoke(args=['import-data', dump])
+
+    assert result.exit_code != 0
+    assert 'conflict' in result.output
@@ -0,0 +1,75 @@
+import json
+
+import App
+from conftest import create_post, create_thread
+
+def first_message(client, url, **headers):
+    """The first message of the event stream at url, parsed into (id, event, data)."""
+    response = client.get(url, headers=headers, buffered=False)
+    try:
+        assert response.status_code == 200
+        assert response.mimetype == 'text/event-stream'
+        message = next(response.iter_encoded()).decode()
+    finally:
+        response.close()
+    fields = dict(line.split(': ', 1) for line in message.strip().splitlines())
+    return int(fields['id']), fields['event'], json.loads(fields['data'])
+
+def test_feed_resumes_after_last_id():
+    feed = App.ChangeFeed(3)
+    start = feed.last_id
+    for number in range(2):
+        feed.publish('tick', {"n": number})
+
+    assert feed.since(start + 1) == ([(start + 2, 'tick', {"n": 1})], True)
+    assert feed.since(start + 2) == ([], True)
+
+def test_feed_is_incomplete_once_events_are_dropped():
+    feed = App.ChangeFeed(2)
+    start = feed.last_id
+    for number in range(3):
+        feed.publish('tick', {"n": number})
+
+    events, complete = feed.since(start)
+    assert not complete
+    assert [event[0] for event in events] == [start + 2, start + 3]
+    # An id from the future comes from another process, or before a restart
+    assert feed.since(start + 10) == ([], False)
+
+def test_stream_resumes_from_last_event_id(client):
+    thread_id = create_thread(client)
+    last_id = App.change_feed.last_id
+    post_id = create_post(client, thread_id, 'missed it')
+
+    event_id, event, data = first_message(client, '/api/events', **{'Last-Event-ID': str(last_id)})
+
+    assert event_id == last_id + 1
+    assert event == 'post-created'
+    assert data['threadId'] == thread_id and data['post']['id'] == post_id
+
+def test_stream_resumes_from_query_parameter(client):
+    thread_id = create_thread(client)
+    last_id = App.change_feed.last_id
+    create_post(client, thread_id)
+
+    assert first_message(client, f'/api/events?lastEventId={last_id}')[0] == last_id + 1
+
+def test_thread_stream_skips_other_threads(client):
+    thread_id, other_id = create_thread(client, 'one'), create_thread(client, 'two')
+    last_id = App.change_feed.last_id
+    create_post(client, other_id)
+    post_id = create_post(client, thread_id)
+
+    event_id, event, data = first_message(client, f'/api/threads/{thread_id}/events', **{'Last-Event-ID': str(last_id)})
+
+    assert (event_id, event, data['post']['id']) == (last_id + 2, 'post-created', post_id)
+
+def test_stale_last_event_id_gets_reset(client):
+    create_thread(client)
+
+    event_id, event, data = first_message(client, '/api/events', **{'Last-Event-ID': '1'})
+
+    assert (event_id, event, data) == (App.change_feed.last_id, 'reset', {})
+
+def test_bad_last_event_id_is_rejected(client):
+    assert client.get('/api/events', headers={'Last-Event-ID': 'soon'}).status_code == 400
@@ -0,0 +1,56 @@
+import sqlite3
+
+import App
+from conftest import TEST_CONFIG, register
+
+SOLUTION = 'this is your first challenge'
+
+def attempt(puzzle_id, username, solution):
+    return {'op': 'puzzle.attempt', 'puzzleId': puzzle_id, 'username': username, 'solution': solution}
+
+def completions(app):
+    with sqlite3.connect(app.config['DATABASE_URI'][len('sqlite:///'):]) as conn:
+        return conn.execute("SELECT user_id, puzzle_id FROM completed_puzzles ORDER BY id").fetchall()
+
+def test_leaderboard_ranks_by_score(client):
+    register(client, 'alice')
+    for username, puzzle_id, solution in (('alice', 1, SOLUTION), ('alice', 2, '36'), ('admin', 1, SOLUTION)):
+        assert client.post(f'/api/puzzles/{puzzle_id}/attempt', json={
+            'username': username, 'solution': solution
+        }).status_code == 200
+
+    board = client.get('/api/leaderboard').get_json()
+
+    assert [(row['username'], row['solved']) for row in board] == [('alice', 2), ('admin', 1)]
+    assert board[0]['score'] > board[1]['score']
+
+def test_puzzle_is_completed_once_per_batch(app):
+    client = app.test_client()
+
+    response = client.post('/api/batch', json={'operations': [attempt(1, 'admin', SOLUTION)] * 2})
+
+    assert [result['status'] for result in response.get_json()['results']] == [200, 202]
+    assert completions(app) == [(1, 1)]
+    assert [row['solved'] for row in client.get('/api/leaderboard').get_json()] == [1]
+
+def test_puzzle_is_completed_once_per_request(client):
+    statuses = [client.post('/api/puzzles/1/attempt', json={'username': 'admin', 'solution': SOLUTION}).status_code
+                for _ in range(2)]
+
+    assert statuses == [200, 202]
+
+def test_duplicate_completions_are_removed_on_startup(app, tmp_path):
+    client = app.test_client()
+    client.post('/api/puzzles/1/attempt', json={'username': 'admin', 'solution': SOLUTION})
+    score = client.get('/api/leaderboard').get_json()[0]['score']
+    App.db.close()
+    # As left by a version without the unique index
+    with sqlite3.connect(tmp_path / 'forum.db') as conn:
+        conn.execute("DROP INDEX ix_completed_puzzles_user_id_puzzle_id")
+        conn.execute("INSERT INTO completed_puzzles (user_id, puzzle_id) VALUES (1, 1)")
+        conn.execute("UPDATE users SET solved_count = 2, score = 2 * score WHERE id = 1")
+
+    app = App.create_app(dict(TEST_CONFIG, DATABASE_URI=app.config['DATABASE_URI']))
+
+    assert app.test_client().get('/api/leaderboard').get_json() == [{'username': 'admin', 'solved': 1, 'score': score}]
+    assert completions(app) == [(1, 1)]
@@ -0,0 +1,29 @@
+import os
+
+import pytest
+
+import App
+from conftest import register
+
+def log_in(client, username, password='password123'):
+    return client.post('/api/login', json={'username': username, 'password': password})
+
+def test_pool_is_replaced_after_its_workers_die(make_app):
+    client = make_app(PASSWORD_HASH_WORKERS=1).test_client()
+    register(client, 'alice')
+    assert log_in(client, 'alice').status_code == 200
+
+    for process in list(App.password_hasher._executor._processes.values()):
+        process.kill()
+
+    assert [log_in(client, 'alice').status_code for _ in range(3)] == [200, 200, 200]
+    assert log_in(client, 'alice', 'wrong').status_code == 401
+
+def test_pool_that_keeps_breaking_sheds_the_call():
+    hasher = App.PasswordHasher('pbkdf2:sha256:1000', workers=1, queue_limit=2)
+    try:
+        with pytest.raises(App.HasherBusy):
+            hasher._run(os._exit, 1)
+        assert hasher.check(hasher.hash('secret'), 'secret')
+    finally:
+        hasher.shutdown()
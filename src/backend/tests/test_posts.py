@@ -0,0 +1,41 @@
+import json
+
+import pytest
+
+import App
+from conftest import create_post, create_thread, read_all
+
+def test_post_pages_forwards_and_back(client):
+    thread_id = create_thread(client)
+    post_ids = [create_post(client, thread_id, f"post {i}") for i in range(5)]
+
+    pages = read_all(client, f'/api/posts?threadId={thread_id}&limit=2')
+    assert sum(pages, []) == post_ids
+
+    last = client.get(f'/api/posts?threadId={thread_id}&limit=2&after=' + client.get(
+        f'/api/posts?threadId={thread_id}&limit=3').headers['X-Next-Cursor'])
+    assert [post['id'] for post in last.get_json()] == post_ids[3:]
+    previous = client.get(f"/api/posts?threadId={thread_id}&limit=2&before={last.headers['X-Prev-Cursor']}")
+    assert [post['id'] for post in previous.get_json()] == post_ids[1:3]
+
+def test_posts_take_after_or_before_not_both(client):
+    thread_id = create_thread(client)
+    cursor = client.get(f'/api/posts?threadId={thread_id}&limit=1').headers.get('X-Next-Cursor', 'x')
+    response = client.get(f'/api/posts?threadId={thread_id}&after={cursor}&before={cursor}')
+    assert response.status_code == 400
+
+@pytest.mark.parametrize('archived', [False, True])
+def test_streamed_pages_match_plain_pages(client, archived):
+    thread_id = create_thread(client)
+    for i in range(5):
+        create_post(client, thread_id, f"post {i}")
+    if archived:
+        App.archive_threads(App.db.session, -1)
+    cursor = client.get(f'/api/posts?threadId={thread_id}&limit=4').headers['X-Next-Cursor']
+
+    for direction in ('after', 'before'):
+        url = f'/api/posts?threadId={thread_id}&limit=2&{direction}={cursor}'
+        page = [post['id'] for post in client.get(url).get_json()]
+        as_json = [post['id'] for post in client.get(f'{url}&stream=json').get_json()]
+        as_ndjson = [json.loads(line)['id'] for line in client.get(f'{url}&stream=ndjson').get_data(as_text=True).splitlines()]
+        assert as_json == as_ndjson == page
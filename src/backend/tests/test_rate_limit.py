@@ -0,0 +1,91 @@
+import pytest
+
+import App
+from conftest import register
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(App.time, 'monotonic', clock)
+    return clock
+
+def test_burst_then_refill(clock):
+    limiter = App.TokenBucketLimiter(rate=0.5, burst=2)
+
+    limiter.acquire('a')
+    limiter.acquire('a')
+    with pytest.raises(App.RateLimited) as excinfo:
+        limiter.acquire('a')
+    assert excinfo.value.retry_after == 2
+
+    clock.now += 2
+    limiter.acquire('a')
+    with pytest.raises(App.RateLimited):
+        limiter.acquire('a')
+
+def test_keys_are_charged_together_or_not_at_all(clock):
+    limiter = App.TokenBucketLimiter(rate=1, burst=1)
+    limiter.acquire('spent')
+
+    with pytest.raises(App.RateLimited):
+        limiter.acquire('fresh', 'spent')
+
+    # 'fresh' kept its token
+    limiter.acquire('fresh')
+
+def test_only_most_recent_keys_are_kept(clock):
+    limiter = App.TokenBucketLimiter(rate=1, burst=1, maxsize=2)
+    for key in ('a', 'b', 'c'):
+        limiter.acquire(key)
+
+    # 'a' was forgotten, so it is back to a full bucket
+    limiter.acquire('a')
+    with pytest.raises(App.RateLimited):
+        limiter.acquire('c')
+
+def attempt(client, username, address='10.0.0.1'):
+    return client.post('/api/puzzles/1/attempt', json={'username': username, 'solution': 'wrong'},
+                       environ_base={'REMOTE_ADDR': address})
+
+def test_attempts_over_budget_get_429(make_app, clock):
+    client = make_app(ATTEMPT_RATE=0.1, ATTEMPT_BURST=2).test_client()
+
+    assert [attempt(client, 'admin').status_code for _ in range(2)] == [201, 201]
+    response = attempt(client, 'admin')
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '10'
+
+    clock.now += 10
+    assert attempt(client, 'admin').status_code == 201
+
+def test_address_budget_is_shared_by_its_users(make_app, clock):
+    client = make_app(ATTEMPT_RATE=0.1, ATTEMPT_BURST=2).test_client()
+    for username in ('first', 'second'):
+        register(client, username)
+
+    assert attempt(client, 'first').status_code == 201
+    assert attempt(client, 'second').status_code == 201
+    assert attempt(client, 'admin').status_code == 429
+    assert attempt(client, 'admin', address='10.0.0.2').status_code == 201
+
+def test_batch_attempts_share_the_address_budget(make_app, clock):
+    client = make_app(ATTEMPT_RATE=0.1, ATTEMPT_BURST=2).test_client()
+    for username in ('first', 'second', 'third'):
+        register(client, username)
+    assert attempt(client, 'admin').status_code == 201
+
+    response = client.post('/api/batch', json={'operations': [
+        {'op': 'puzzle.attempt', 'puzzleId': 1, 'username': username, 'solution': 'wrong'}
+        for username in ('first', 'second', 'third')
+    ]}, environ_base={'REMOTE_ADDR': '10.0.0.1'})
+
+    results = response.get_json()['results']
+    assert [result['status'] for result in results] == [201, 429, 429]
+    assert results[1]['body']['retryAfter'] == 10
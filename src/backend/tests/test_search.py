@@ -0,0 +1,54 @@
+from conftest import create_post, create_thread, register
+
+def found(client, query, username=None):
+    url = f'/api/search?q={query}' + (f'&username={username}' if username else '')
+    response = client.get(url)
+    assert response.status_code == 200
+    return sorted((result['kind'], result['threadId'], result['postId']) for result in response.get_json())
+
+def gated_thread(client, text):
+    response = client.post('/api/threads', json={
+        'author': 'admin', 'name': f"about {text}", 'description': 'd', 'requiredPuzzleId': 2
+    })
+    assert response.status_code == 201
+    thread_id = response.get_json()['id']
+    return thread_id, create_post(client, thread_id, f"the {text} is here")
+
+def test_threads_and_posts_are_found(client):
+    thread_id = create_thread(client, 'aardvark facts')
+    post_id = create_post(client, thread_id, 'an aardvark eats ants')
+
+    assert found(client, 'aardvark') == [('post', thread_id, post_id), ('thread', thread_id, None)]
+    assert found(client, 'aardv*') == found(client, 'aardvark')
+
+def test_gated_threads_are_hidden_until_their_puzzle_is_solved(client):
+    thread_id, post_id = gated_thread(client, 'zeppelin')
+    register(client, 'alice')
+
+    assert found(client, 'zeppelin') == []
+    assert found(client, 'zeppelin', 'alice') == []
+
+    solved = client.post('/api/puzzles/2/attempt', json={'username': 'alice', 'solution': '36'})
+    assert solved.status_code == 200
+
+    assert found(client, 'zeppelin', 'alice') == [('post', thread_id, post_id), ('thread', thread_id, None)]
+    assert found(client, 'zeppelin') == []
+
+def test_admin_sees_gated_threads(client):
+    thread_id, post_id = gated_thread(client, 'zeppelin')
+
+    assert found(client, 'zeppelin', 'admin') == [('post', thread_id, post_id), ('thread', thread_id, None)]
+
+def test_deleted_threads_are_not_found(client):
+    thread_id = create_thread(client, 'ephemeral')
+
+    assert client.delete(f'/api/threads/{thread_id}?username=admin').status_code == 200
+
+    assert found(client, 'ephemeral') == []
+
+def test_empty_query_is_rejected(client):
+    assert client.get('/api/search?q=').status_code == 400
+    assert client.get('/api/search?q=%20%20').status_code == 400
+
+def test_query_syntax_is_taken_literally(client):
+    assert found(client, '%22OR%20NEAR(') == []
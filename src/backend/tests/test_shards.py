@@ -0,0 +1,73 @@
+import sqlite3
+
+import App
+from conftest import create_post, create_thread
+
+def shard_post_ids(tmp_path, shard):
+    with sqlite3.connect(tmp_path / f"forum-posts-{shard}.db") as conn:
+        return sorted(row[0] for row in conn.execute("SELECT id FROM posts"))
+
+def thread_row(thread_id):
+    session = App.db.session()
+    try:
+        return session.get(App.Thread, thread_id)
+    finally:
+        session.close()
+
+def test_posts_are_stored_in_their_threads_shard(make_app, tmp_path):
+    client = make_app(POST_SHARDS=2).test_client()
+    threads = [create_thread(client, f"thread {i}") for i in range(2)]
+    posts = {thread_id: create_post(client, thread_id, f"in {thread_id}") for thread_id in threads}
+
+    for thread_id, post_id in posts.items():
+        shard = thread_id % 2
+        assert App.post_shards.shard_of_post(post_id) == shard
+        assert post_id in shard_post_ids(tmp_path, shard)
+        assert post_id not in shard_post_ids(tmp_path, 1 - shard)
+        listed = client.get(f'/api/posts?threadId={thread_id}').get_json()
+        assert [post['id'] for post in listed] == [post_id]
+
+def test_posts_are_found_by_id_alone(make_app, tmp_path):
+    client = make_app(POST_SHARDS=2).test_client()
+    thread_id = create_thread(client)
+    keep, drop = create_post(client, thread_id, 'keep'), create_post(client, thread_id, 'drop')
+
+    assert client.patch(f'/api/posts/{keep}/vote', json={'action': 'upvote'}).status_code == 200
+    assert client.delete(f'/api/posts/{drop}?username=admin').status_code == 200
+
+    assert shard_post_ids(tmp_path, thread_id % 2) == [keep]
+    assert [post['id'] for post in client.get(f'/api/posts?threadId={thread_id}').get_json()] == [keep]
+
+def test_ids_outside_every_shard_are_not_found(make_app):
+    client = make_app(POST_SHARDS=2).test_client()
+
+    assert App.post_shards.for_post(1) is None
+    assert client.delete(f'/api/posts/{3 << App.POST_ID_SHARD_BITS}?username=admin').status_code == 404
+
+def test_thread_stats_are_written_on_flush_when_sharded(make_app):
+    client = make_app(POST_SHARDS=2, THREAD_STATS_FLUSH_INTERVAL=3600).test_client()
+    thread_id = create_thread(client)
+
+    create_post(client, thread_id, 'first')
+    create_post(client, thread_id, 'second')
+    assert thread_row(thread_id).post_count == 0
+
+    App.thread_activity.flush()
+
+    row = thread_row(thread_id)
+    assert row.post_count == 2
+    assert row.last_post_author == 'admin'
+    listed = next(thread for thread in client.get('/api/threads').get_json() if thread['id'] == thread_id)
+    assert listed['postCount'] == 2
+
+def test_archiving_is_refused_when_sharded(make_app, tmp_path):
+    app = make_app(POST_SHARDS=2)
+    client = app.test_client()
+    thread_id = create_thread(client)
+    post_id = create_post(client, thread_id)
+
+    result = app.test_cli_runner().invoke(args=['archive-posts', '--idle-days', '-1'])
+
+    assert result.exit_code != 0
+    assert 'POST_SHARDS' in result.output
+    assert shard_post_ids(tmp_path, thread_id % 2) == [post_id]
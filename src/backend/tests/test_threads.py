@@ -0,0 +1,55 @@
+import pytest
+
+import App
+from conftest import create_thread, read_all
+
+def test_thread_pages_cover_every_thread_once(client):
+    for i in range(5):
+        create_thread(client, f"thread {i}")
+    every = [thread['id'] for thread in client.get('/api/threads').get_json()]
+
+    pages = read_all(client, '/api/threads?limit=2')
+
+    assert all(len(page) == 2 for page in pages[:-1]) and len(pages[-1]) < 2
+    assert sum(pages, []) == every
+
+def test_thread_pages_keep_their_sort_order(client):
+    for i in range(4):
+        create_thread(client, f"thread {i}")
+
+    pages = read_all(client, '/api/threads?sort=newest&limit=3')
+
+    ids = sum(pages, [])
+    assert ids == sorted(ids, reverse=True)
+
+def test_full_last_page_ends_with_empty_page(client):
+    create_thread(client)
+    count = len(client.get('/api/threads').get_json())
+
+    pages = read_all(client, f'/api/threads?limit={count}')
+
+    assert pages[-1] == []
+
+def test_bad_cursor_and_sort_are_rejected(client):
+    assert client.get('/api/threads?after=not-a-cursor').status_code == 400
+    assert client.get('/api/threads?sort=sideways').status_code == 400
+
+@pytest.mark.parametrize('sort', sorted(App.THREAD_SORTS))
+def test_every_sort_reads_an_index_in_order(app, sort):
+    query = App.thread_listing_query(sort, limit=10)
+    sql = str(query.compile(App.db.engine, compile_kwargs={'literal_binds': True}))
+
+    with App.db.engine.connect() as conn:
+        plan = ' '.join(row.detail for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}"))
+
+    assert 'TEMP B-TREE' not in plan
+
+def test_votes_sort_follows_net_votes(client):
+    loved, hated = create_thread(client, 'loved'), create_thread(client, 'hated')
+    client.patch(f'/api/threads/{hated}/vote', json={'action': 'downvote'})
+    for _ in range(2):
+        client.patch(f'/api/threads/{loved}/vote', json={'action': 'upvote'})
+
+    ids = [thread['id'] for thread in client.get('/api/threads?sort=votes').get_json()]
+
+    assert ids[0] == loved and ids[-1] == hated
@@ -0,0 +1,43 @@
+import App
+from conftest import create_thread
+
+def thread_row(thread_id):
+    session = App.db.session()
+    try:
+        return session.get(App.Thread, thread_id)
+    finally:
+        session.close()
+
+def test_votes_are_summed_and_written_on_flush(make_app):
+    client = make_app(VOTE_FLUSH_INTERVAL=3600).test_client()
+    thread_id = create_thread(client)
+
+    for action in ('upvote', 'upvote', 'downvote'):
+        assert client.patch(f'/api/threads/{thread_id}/vote', json={'action': action}).status_code == 200
+    assert (thread_row(thread_id).upvotes or 0, thread_row(thread_id).downvotes or 0) == (0, 0)
+
+    App.vote_aggregator.flush()
+
+    assert (thread_row(thread_id).upvotes, thread_row(thread_id).downvotes) == (2, 1)
+
+def test_failing_object_does_not_hold_back_other_votes(make_app, monkeypatch):
+    client = make_app(VOTE_FLUSH_INTERVAL=3600).test_client()
+    good, bad = create_thread(client, 'good'), create_thread(client, 'bad')
+    client.patch(f'/api/threads/{good}/vote', json={'action': 'upvote'})
+    client.patch(f'/api/threads/{bad}/vote', json={'action': 'upvote'})
+    apply_votes = App.apply_votes
+
+    def failing_apply_votes(session, model_class, object_id, upvotes, downvotes):
+        if object_id == bad:
+            raise ValueError("bad object")
+        apply_votes(session, model_class, object_id, upvotes, downvotes)
+    monkeypatch.setattr(App, 'apply_votes', failing_apply_votes)
+
+    App.vote_aggregator.flush()
+    assert thread_row(good).upvotes == 1
+
+    # The bad object's votes are retried, then dropped
+    for _ in range(App.VOTE_FLUSH_MAX_ATTEMPTS - 1):
+        assert App.vote_aggregator._pending
+        App.vote_aggregator.flush()
+    assert not App.vote_aggregator._pending
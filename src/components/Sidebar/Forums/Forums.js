@@ -5,6 +5,7 @@ import CreateThread from './CreateThread/CreateThread';
 import './Forums.css';
 import ConfirmDeleteDialog from './ConfirmDeleteDialog/ConfirmDeleteDialog';
 import { filterAndSortThreads } from './utils';
+import { authHeaders } from '../../../auth';
 import { Trash2, Lock, Unlock, Search, Puzzle } from 'lucide-react';
 
 const ForumsPage = ({
@@ -101,7 +102,8 @@ const ForumsPage = ({
 
   const handleDeleteThread = async (threadId) => {
     await fetch(basePage + `threads/${threadId}?username=${currentUser.username}`, {
-      method: 'DELETE'
+      method: 'DELETE',
+      headers: authHeaders(currentUser)
     });
 
     setThreads(prev => prev.filter(t => t.id !== threadId));
@@ -4,6 +4,7 @@ import './WelcomeThread.css';
 import VoteControls, { handleVote } from './utils';
 import { Trash2 } from 'lucide-react';
 import ConfirmDeleteDialog from '../ConfirmDeleteDialog/ConfirmDeleteDialog';
+import { authHeaders } from '../../../../auth';
 
 
 const WelcomeThread = ({ currentUser, threads, setThreads, currentThreadId}) => {
@@ -34,14 +35,15 @@ const WelcomeThread = ({ currentUser, threads, setThreads, currentThreadId}) =>
   
     fetch(basePage + 'posts', {
       method: 'POST',
-      headers: {
+      headers: authHeaders(currentUser, {
         'Content-Type': 'application/json'
-      },
+      }),
       body: JSON.stringify(newMessageObj)
     })
       .then(res => res.json())
       .then(data => {
-        setMessages([...messages, data]);
+        // The post-created event may have added it already
+        setMessages(prev => prev.some(msg => msg.id === data.id) ? prev : [...prev, data]);
         setNewMessage('');
         // Increment postCount in App.js
         setThreads(prevThreads =>
@@ -56,7 +58,8 @@ const WelcomeThread = ({ currentUser, threads, setThreads, currentThreadId}) =>
  
   const handleDelete = (messageId) => {
     fetch(basePage + `posts/${messageId}?username=${currentUser.username}`, {
-      method: 'DELETE'
+      method: 'DELETE',
+      headers: authHeaders(currentUser)
     })
       .then(res => res.json())
       .then(() => {
@@ -92,6 +95,34 @@ const WelcomeThread = ({ currentUser, threads, setThreads, currentThreadId}) =>
       .then(data => setMessages(data));
   }, [currentThreadId]);
 
+  // Follow other users' posts and votes instead of refetching the thread
+  useEffect(() => {
+    const events = new EventSource(`${basePage}threads/${currentThreadId}/events`);
+
+    events.addEventListener('post-created', e => {
+      const { post } = JSON.parse(e.data);
+      setMessages(prev => prev.some(msg => msg.id === post.id) ? prev : [...prev, post]);
+    });
+    events.addEventListener('post-deleted', e => {
+      const { postId } = JSON.parse(e.data);
+      setMessages(prev => prev.filter(msg => msg.id !== postId));
+    });
+    events.addEventListener('vote-changed', e => {
+      const { type, id, upvotes, downvotes } = JSON.parse(e.data);
+      const update = item => item.id === id ? { ...item, upvotes, downvotes } : item;
+      if (type === 'post') setMessages(prev => prev.map(update));
+      else setThreads(prev => prev.map(update));
+    });
+    // Missed too much while disconnected, so reload the thread in full
+    events.addEventListener('reset', () => {
+      fetch(`${basePage}posts?threadId=${currentThreadId}`)
+        .then(res => res.json())
+        .then(data => setMessages(data));
+    });
+
+    return () => events.close();
+  }, [currentThreadId]);
+
   const thread = threads.find(t => t.id === currentThreadId);
   if (!thread) return <p>Thread not found</p>;
 